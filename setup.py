@@ -17,6 +17,7 @@ setup(
         'boggart==0.1.12',
         'rooibos==0.3.0',
         'kaskara==0.0.3',
+        'psutil',
         'requests',
         'flask'
     ],
@@ -29,7 +30,7 @@ setup(
     packages=find_packages('src'),
     package_dir={'': 'src'},
     package_data={
-        '': ['*.yml', 'data/*.json']
+        '': ['*.yml', 'data/*.json', 'data/*.json.gz', 'data/*.yml']
     },
     py_modules=[
         splitext(basename(path))[0] for path in glob('src/*.py')
@@ -39,7 +40,11 @@ setup(
         'console_scripts': [
             'orchestrator-instrument = orchestrator.instrument:instrument',
             'orchestrator-extract = orchestrator.donor:extract',
-            'orchestrator-precompute = orchestrator.coverage:precompute'
+            'orchestrator-precompute = orchestrator.coverage:precompute',
+            'orchestrator-precompute-kills = orchestrator.killmatrix:precompute',
+            'orchestrator-convert-coverage = orchestrator.coverage:convert',
+            'orchestrator-blacklist = orchestrator.blacklist:explain',
+            'orchestrator-benchmark = orchestrator.benchmark:benchmark'
         ]
     }
 )
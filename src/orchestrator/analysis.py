@@ -0,0 +1,309 @@
+"""
+This module is responsible for performing (and caching) static analysis of
+the source code files that are involved in a repair problem.
+"""
+from typing import Dict, List, Iterable, Optional, Any, Callable
+from timeit import default_timer as timer
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+
+from bugzoo.client import Client as BugZooClient
+from bugzoo.core.bug import Bug as Snapshot
+from bugzoo.core.container import Container
+from boggart import Mutation
+from kaskara import Analysis
+from kaskara.core import FileLocation, FileLocationRange
+from kaskara.functions import FunctionDB, FunctionDesc
+from kaskara.insertions import InsertionPointDB, InsertionPoint
+from kaskara.loops import find_loops
+
+from .cache import CACHE_DIR, DiskCache
+from .pool import ContainerPool
+from .snapshot import snapshot_identity
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['FileAnalysis', 'AnalysisCache']
+
+# the maximum size of the on-disk analysis cache, given in bytes
+ANALYSIS_CACHE_SIZE = 256 * 1024 * 1024
+
+# bumped whenever the format of cached analyses is changed
+ANALYSIS_CACHE_VERSION = 1
+
+# the number of slowest files that are reported after analysis
+ANALYSIS_REPORT_SLOWEST = 5
+
+
+class FileAnalysis(object):
+    """
+    Holds the results of statically analysing a single source code file.
+    """
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> 'FileAnalysis':
+        loops = [FileLocationRange.from_string(s) for s in d['loops']]
+        functions = \
+            [FunctionDesc(name=f['name'],
+                          location=FileLocationRange.from_string(f['location']),
+                          body=FileLocationRange.from_string(f['body']),
+                          return_type=f['return-type'],
+                          is_global=f['global'],
+                          is_pure=f['pure'])
+             for f in d['functions']]
+        insertions = \
+            [InsertionPoint(FileLocation.from_string(i['location']),
+                            frozenset(i['visible']))
+             for i in d['insertions']]
+        return FileAnalysis(d['file'], loops, functions, insertions)
+
+    def __init__(self,
+                 filename: str,
+                 loops: List[FileLocationRange],
+                 functions: List[FunctionDesc],
+                 insertions: List[InsertionPoint]
+                 ) -> None:
+        self.__filename = filename
+        self.__loops = loops
+        self.__functions = functions
+        self.__insertions = insertions
+
+    @property
+    def filename(self) -> str:
+        return self.__filename
+
+    @property
+    def loops(self) -> List[FileLocationRange]:
+        """
+        The locations of the bodies of the loops within this file.
+        """
+        return list(self.__loops)
+
+    @property
+    def functions(self) -> List[FunctionDesc]:
+        """
+        The functions that are defined within this file.
+        """
+        return list(self.__functions)
+
+    @property
+    def insertions(self) -> List[InsertionPoint]:
+        """
+        The statement insertion points within this file.
+        """
+        return list(self.__insertions)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'file': self.__filename,
+                'loops': [str(l) for l in self.__loops],
+                'functions': [{'name': f.name,
+                               'location': str(f.location),
+                               'body': str(f.body),
+                               'return-type': f.return_type,
+                               'global': f.is_global,
+                               'pure': f.is_pure}
+                              for f in self.__functions],
+                'insertions': [i.to_dict() for i in self.__insertions]}
+
+
+def analyse_file(client_bugzoo: BugZooClient,
+                 snapshot: Snapshot,
+                 filename: str,
+                 container: Container
+                 ) -> FileAnalysis:
+    """
+    Statically analyses a single file inside a given container.
+    """
+    files = [filename]
+    loops = find_loops(client_bugzoo, snapshot, files, container)
+    functions = FunctionDB.build(client_bugzoo, snapshot, files, container)
+    insertions = \
+        InsertionPointDB.build(client_bugzoo, snapshot, files, container)
+    return FileAnalysis(filename,
+                        [l for l in loops if l.filename == filename],
+                        list(functions.in_file(filename)),
+                        list(insertions.in_file(filename)))
+
+
+def analyse_files(client_bugzoo: BugZooClient,
+                  snapshot: Snapshot,
+                  files: List[str],
+                  *,
+                  threads: int = 1,
+                  callback_analysed: Optional[Callable[[FileAnalysis, float], None]] = None  # noqa: pycodestyle
+                  ) -> Dict[str, FileAnalysis]:
+    """
+    Statically analyses a given set of files within a snapshot. Files are
+    sharded across a pool of containers and analysed concurrently.
+
+    Parameters:
+        client_bugzoo: a connection to the BugZoo server.
+        snapshot: the snapshot to which the files belong.
+        files: the names of the files that should be analysed.
+        threads: the maximum number of files that may be analysed at once.
+        callback_analysed: an optional callback that is invoked with the
+            analysis of each file, and the time taken to produce it (in
+            seconds), as soon as that file has been analysed.
+
+    Returns:
+        a mapping from the name of each file to the results of its analysis.
+
+    Raises:
+        Exception: if the analysis of any file fails.
+    """
+    assert threads > 0
+    if not files:
+        return {}
+    threads = min(threads, len(files))
+    timings = {}  # type: Dict[str, float]
+
+    def analyse(pool: ContainerPool, filename: str) -> FileAnalysis:
+        with pool.container() as container:
+            time_start = timer()
+            analysis = analyse_file(client_bugzoo, snapshot, filename,
+                                    container)
+            time_taken = timer() - time_start
+        logger.debug("analysed file [%s] (took %.3f seconds)",
+                     filename, time_taken)
+        timings[filename] = time_taken
+        if callback_analysed:
+            callback_analysed(analysis, time_taken)
+        return analysis
+
+    analyses = {}  # type: Dict[str, FileAnalysis]
+    with ContainerPool(client_bugzoo, snapshot, threads) as pool:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:  # noqa: pycodestyle
+            fn_to_future = {fn: executor.submit(analyse, pool, fn)
+                            for fn in files}
+            for (filename, future) in fn_to_future.items():
+                analyses[filename] = future.result()
+
+    slowest = sorted(timings.items(), key=lambda t: t[1], reverse=True)
+    logger.info("slowest files to analyse: %s",
+                ', '.join('{} ({:.3f}s)'.format(fn, t)
+                          for (fn, t) in slowest[:ANALYSIS_REPORT_SLOWEST]))
+    return analyses
+
+
+def merge_analyses(analyses: Iterable[FileAnalysis]) -> Analysis:
+    """
+    Combines the results of analysing several files into a single analysis.
+    """
+    loops = []  # type: List[FileLocationRange]
+    functions = []  # type: List[FunctionDesc]
+    insertions = []  # type: List[InsertionPoint]
+    for analysis in analyses:
+        loops += analysis.loops
+        functions += analysis.functions
+        insertions += analysis.insertions
+    return Analysis(loops, FunctionDB(functions), InsertionPointDB(insertions))
+
+
+class AnalysisCache(object):
+    """
+    Caches the static analysis of individual source code files, both in
+    memory and on disk. Each analysis is keyed by the contents of its file.
+    Since the contents of each file are entirely determined by the baseline
+    and the mutations applied to that file, their digest is used in place of
+    a digest of the file itself, which would require a container to obtain.
+    """
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 max_size: int = ANALYSIS_CACHE_SIZE
+                 ) -> None:
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, 'analysis')
+        self.__disk = DiskCache(directory, max_size)
+        self.__memory = {}  # type: Dict[str, FileAnalysis]
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def content_key(baseline: Snapshot,
+                    filename: str,
+                    mutations: Iterable[Mutation] = ()
+                    ) -> str:
+        """
+        Computes a key that uniquely identifies the contents of a given file
+        after a set of mutations has been applied to the baseline. Mutations
+        to other files are ignored.
+        """
+        mutations = sorted(json.dumps(m.to_dict(), sort_keys=True)
+                           for m in mutations
+                           if m.location.filename == filename)
+        return DiskCache.key(ANALYSIS_CACHE_VERSION,
+                             snapshot_identity(baseline),
+                             filename,
+                             mutations)
+
+    def get(self, key: str) -> Optional[FileAnalysis]:
+        """
+        Retrieves the analysis for the file with a given content key, or None
+        if that file has not been analysed.
+        """
+        with self.__lock:
+            if key in self.__memory:
+                return self.__memory[key]
+        jsn = self.__disk.get(key)
+        if jsn is None:
+            return None
+        analysis = FileAnalysis.from_dict(jsn)
+        with self.__lock:
+            self.__memory[key] = analysis
+        return analysis
+
+    def put(self, key: str, analysis: FileAnalysis) -> None:
+        """
+        Stores the analysis for the file with a given content key.
+        """
+        with self.__lock:
+            self.__memory[key] = analysis
+        self.__disk.put(key, analysis.to_dict())
+
+    def build(self,
+              client_bugzoo: BugZooClient,
+              snapshot: Snapshot,
+              file_to_key: Dict[str, str],
+              *,
+              threads: int = 1
+              ) -> Analysis:
+        """
+        Produces an analysis of a given set of files within a snapshot. Only
+        those files whose analyses are not already cached are analysed.
+
+        Parameters:
+            client_bugzoo: a connection to the BugZoo server.
+            snapshot: the snapshot to which the files belong.
+            file_to_key: a mapping from the name of each file that should be
+                analysed to the key for its contents.
+            threads: the number of files that may be analysed concurrently.
+        """
+        analyses = {}  # type: Dict[str, FileAnalysis]
+        for (filename, key) in file_to_key.items():
+            analysis = self.get(key)
+            if analysis is not None:
+                analyses[filename] = analysis
+
+        missing = [fn for fn in file_to_key if fn not in analyses]
+        logger.info("reusing cached analysis for %d files; analysing %d files",
+                    len(analyses), len(missing))
+        if missing:
+            logger.debug("analysing files using %d threads: %s",
+                         threads, missing)
+            time_start = timer()
+
+            # store each analysis as soon as it is produced, so that progress
+            # is not lost if the analysis of another file fails
+            def on_analysed(analysis: FileAnalysis, time_taken: float) -> None:
+                self.put(file_to_key[analysis.filename], analysis)
+
+            analyses.update(analyse_files(client_bugzoo,
+                                          snapshot,
+                                          missing,
+                                          threads=threads,
+                                          callback_analysed=on_analysed))
+            logger.info("analysed %d files (took %.3f seconds)",
+                        len(missing), timer() - time_start)
+        return merge_analyses(analyses.values())
@@ -0,0 +1,272 @@
+"""
+This module provides an offline benchmark for the orchestrator. It drives
+complete perturbation and adaptation scenarios against the in-process
+stand-ins provided by `orchestrator.fake`, and reports the throughput and
+latency percentiles of each public operation, allowing performance
+regressions in orchestration code to be caught without Docker.
+
+Results depend on the state of the cache directory: to measure a cold run,
+set ORCHESTRATOR_CACHE_DIR to an empty directory.
+"""
+from typing import Dict, List, Any, Optional, Iterator
+from timeit import default_timer as timer
+import argparse
+import contextlib
+import json
+import logging
+import math
+import random
+import threading
+
+from .cache import CACHE_DIR
+from .exceptions import NeutralPerturbation
+from .fake import Latencies, Recording, FakeBugZoo, FakeBoggart, \
+                  FakeRooibos, DEFAULT_LATENCIES
+from .orchestrator import Orchestrator, OrchestratorState
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['run_benchmark']
+
+# the percentiles that are reported for each operation
+PERCENTILES = (50, 90, 99)
+
+# the maximum number of seconds to wait for a single adaptation to finish
+ADAPT_TIMEOUT = 3600
+
+
+def _percentile(values: List[float], p: float) -> float:
+    """
+    Computes a given percentile of a non-empty list of values using the
+    nearest-rank method.
+    """
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(p / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def _summarise(samples: List[float]) -> Dict[str, float]:
+    total = sum(samples)
+    summary = {'count': len(samples),
+               'total': total,
+               'throughput': len(samples) / total if total > 0 else 0.0,
+               'max': max(samples)}
+    for p in PERCENTILES:
+        summary['p{}'.format(p)] = _percentile(samples, p)
+    return summary
+
+
+def run_benchmark(recording: Recording,
+                  latencies: Latencies,
+                  *,
+                  scenarios: int = 10,
+                  attempts: int = 10,
+                  threads: Optional[int] = None,
+                  seed: int = 0
+                  ) -> Dict[str, Any]:
+    """
+    Runs a number of scenarios, each of which constructs an orchestrator,
+    queries the perturbations for each recorded file, applies one of those
+    perturbations, and (if it is not neutral) adapts the system for a fixed
+    number of candidate patches. The stand-in clients are shared by all
+    scenarios.
+
+    Parameters:
+        recording: the recorded responses that should be replayed.
+        latencies: decides the duration of each simulated request.
+        scenarios: the number of scenarios that should be run.
+        attempts: the number of candidate patches that are evaluated by
+            each adaptation.
+        threads: passed to each orchestrator. If None, concurrency is sized
+            according to the resources of the host.
+        seed: the seed used to select perturbations.
+
+    Returns:
+        a report that describes the latency and throughput of each
+        operation, the number of simulated requests of each kind, and the
+        total time spent in each internal phase of the orchestrator.
+    """
+    assert scenarios > 0
+    assert attempts > 0
+    client_bugzoo = FakeBugZoo(recording, latencies)
+    client_boggart = FakeBoggart(client_bugzoo)
+    client_rooibos = FakeRooibos(client_bugzoo)
+
+    mutations = [m for fn in recording.files for m in recording.mutations(fn)]
+    if not mutations:
+        raise ValueError("recording does not contain any perturbations")
+    random.Random(seed).shuffle(mutations)
+
+    samples = {}  # type: Dict[str, List[float]]
+    phases = {}  # type: Dict[str, List[float]]
+    outcomes = {'neutral': 0, 'adapted': 0, 'errors': 0, 'candidates': 0}
+
+    # samples are recorded even if the operation raises an exception, so
+    # that neutral perturbations are included in the latency of `perturb`
+    @contextlib.contextmanager
+    def timed(operation: str) -> Iterator[None]:
+        time_start = timer()
+        try:
+            yield
+        finally:
+            samples.setdefault(operation, []).append(timer() - time_start)
+
+    time_start = timer()
+    for i in range(scenarios):
+        finished = threading.Event()
+
+        def on_done(*args: Any) -> None:
+            finished.set()
+
+        def on_error(kind: str, message: str) -> None:
+            logger.error("adaptation failed [%s]: %s", kind, message)
+            outcomes['errors'] += 1
+            finished.set()
+
+        with timed('setup'):
+            orchestrator = Orchestrator('fake', 'fake', 'fake',
+                                        lambda *args: None,
+                                        on_done,
+                                        on_error,
+                                        threads=threads,
+                                        seed=seed,
+                                        client_bugzoo=client_bugzoo,
+                                        client_boggart=client_boggart,
+                                        client_rooibos=client_rooibos)
+        for fn in recording.files:
+            with timed('perturbations'):
+                orchestrator.perturbations(fn)
+
+        mutation = mutations[i % len(mutations)]
+        neutral = orchestrator.metrics.counter('perturbations_total',
+                                               outcome='neutral')
+        num_neutral = neutral.value
+        try:
+            with timed('perturb'):
+                orchestrator.perturb(mutation)
+        except NeutralPerturbation:
+            # the orchestrator also reports a failure to build the repair
+            # problem as a neutral perturbation, but only counts those
+            # perturbations that fail no tests as neutral
+            if neutral.value == num_neutral:
+                logger.error("failed to build repair problem for perturbation: %s",  # noqa: pycodestyle
+                             mutation)
+                outcomes['errors'] += 1
+            else:
+                outcomes['neutral'] += 1
+            continue
+
+        with timed('adapt'):
+            orchestrator.adapt(attempts=attempts)
+            if not finished.wait(ADAPT_TIMEOUT):
+                raise TimeoutError("adaptation did not finish")
+        if orchestrator.state == OrchestratorState.FINISHED:
+            outcomes['adapted'] += 1
+            outcomes['candidates'] += orchestrator.resource_usage[0]
+
+        for histogram in orchestrator.metrics.histograms:
+            phase = histogram.labels.get('phase')
+            if phase:
+                totals = phases.setdefault(phase, [0, 0.0])
+                totals[0] += histogram.count
+                totals[1] += histogram.sum
+    time_taken = timer() - time_start
+
+    return {'scenarios': scenarios,
+            'time-taken': time_taken,
+            'outcomes': outcomes,
+            'operations': {op: _summarise(s) for (op, s) in samples.items()},
+            'phases': {phase: {'count': count, 'total': total}
+                       for (phase, (count, total)) in phases.items()},
+            'requests': latencies.counts}
+
+
+def _report_to_string(report: Dict[str, Any]) -> str:
+    header = '{:<16}{:>8}{:>12}' + '{:>10}' * (len(PERCENTILES) + 1)
+    row = '{:<16}{:>8}{:>12.3f}' + '{:>10.3f}' * (len(PERCENTILES) + 1)
+    columns = ['p{}'.format(p) for p in PERCENTILES] + ['max']
+    lines = [header.format('operation', 'count', 'ops/sec', *columns)]
+    for (op, summary) in sorted(report['operations'].items()):
+        lines.append(row.format(op, summary['count'], summary['throughput'],
+                                *[summary[c] for c in columns]))
+    lines.append('')
+    lines.append('{:<24}{:>8}{:>12}'.format('phase', 'count', 'seconds'))
+    for (phase, totals) in sorted(report['phases'].items()):
+        lines.append('{:<24}{:>8}{:>12.3f}'.format(phase,
+                                                   totals['count'],
+                                                   totals['total']))
+    lines.append('')
+    outcomes = report['outcomes']
+    lines.append('{} scenarios in {:.3f} seconds: {} adapted, {} neutral, {} errors, {} candidates'.format(  # noqa: pycodestyle
+        report['scenarios'], report['time-taken'], outcomes['adapted'],
+        outcomes['neutral'], outcomes['errors'], outcomes['candidates']))
+    return '\n'.join(lines)
+
+
+def benchmark() -> None:
+    """
+    Runs the offline benchmark from the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the orchestrator against local stand-ins for BugZoo, boggart and rooibos.")  # noqa: pycodestyle
+    parser.add_argument('--recording',
+                        help="a recording of server responses. If omitted, a recording is synthesized from the baseline coverage.")  # noqa: pycodestyle
+    parser.add_argument('--save-recording',
+                        help="the file to which the recording should be written.")  # noqa: pycodestyle
+    parser.add_argument('--files', type=int, default=5,
+                        help="the number of files in a synthesized recording.")  # noqa: pycodestyle
+    parser.add_argument('--mutations', type=int, default=20,
+                        help="the number of perturbations per file in a synthesized recording.")  # noqa: pycodestyle
+    parser.add_argument('--scenarios', type=int, default=10,
+                        help="the number of scenarios to run.")
+    parser.add_argument('--attempts', type=int, default=10,
+                        help="the number of candidates evaluated per adaptation.")  # noqa: pycodestyle
+    parser.add_argument('--threads', type=int,
+                        help="the number of threads used by the orchestrator.")  # noqa: pycodestyle
+    parser.add_argument('--latency', action='append', default=[],
+                        metavar='KIND=SECONDS',
+                        help="overrides the latency of a kind of request ({}).".format(  # noqa: pycodestyle
+                            ', '.join(sorted(DEFAULT_LATENCIES))))
+    parser.add_argument('--scale', type=float, default=0.01,
+                        help="a factor applied to all latencies.")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="the maximum relative deviation of each latency.")  # noqa: pycodestyle
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output',
+                        help="the file to which the report should be written as JSON.")  # noqa: pycodestyle
+    args = parser.parse_args()
+
+    overrides = {}  # type: Dict[str, float]
+    for override in args.latency:
+        kind, sep, seconds = override.partition('=')
+        if not sep:
+            parser.error("expected KIND=SECONDS: {}".format(override))
+        overrides[kind] = float(seconds)
+    try:
+        latencies = Latencies(overrides,
+                              scale=args.scale,
+                              jitter=args.jitter,
+                              seed=args.seed)
+    except ValueError as err:
+        parser.error(str(err))
+
+    if args.recording:
+        recording = Recording.from_file(args.recording)
+    else:
+        recording = Recording.synthesize(num_files=args.files,
+                                         mutations_per_file=args.mutations,
+                                         seed=args.seed)
+    if args.save_recording:
+        recording.save(args.save_recording)
+
+    logger.info("using cache directory: %s", CACHE_DIR)
+    report = run_benchmark(recording, latencies,
+                           scenarios=args.scenarios,
+                           attempts=args.attempts,
+                           threads=args.threads,
+                           seed=args.seed)
+    print(_report_to_string(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
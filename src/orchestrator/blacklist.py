@@ -1,103 +1,196 @@
+"""
+This module is used to determine which source code files may be the subject
+of perturbation. The rules that exclude files from perturbation are loaded
+from a versioned configuration file (data/blacklist.yml) and are compiled
+into a prefix trie.
+"""
+from typing import Dict, List, Optional, Any
+import argparse
+import logging
+import os
+
+import yaml
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['BlacklistRule', 'Blacklist', 'load_blacklist', 'is_file_mutable']
+
+BLACKLIST_FN = os.path.join(os.path.dirname(__file__),
+                            'data/blacklist.yml')
+
+# the version of the blacklist configuration format that is supported
+BLACKLIST_VERSION = 1
+
+__BLACKLIST = None  # type: Optional[Blacklist]
+
+
+class BlacklistRule(object):
+    """
+    Excludes all files whose name begins with a given prefix.
+    """
+    def __init__(self, prefix: str, category: str) -> None:
+        self.__prefix = prefix
+        self.__category = category
+
+    @property
+    def prefix(self) -> str:
+        return self.__prefix
+
+    @property
+    def category(self) -> str:
+        """
+        The reason that files matched by this rule are excluded.
+        """
+        return self.__category
+
+    def __str__(self) -> str:
+        return "{} [{}]".format(self.__prefix, self.__category)
+
+
+class Blacklist(object):
+    """
+    Decides whether files may be perturbed. Rules are stored in a prefix
+    trie, allowing the rule (if any) that excludes a file to be found in time
+    proportional to the length of its name. Decisions are memoised.
+    """
+    @staticmethod
+    def from_file(fn: str) -> 'Blacklist':
+        with open(fn, 'r') as f:
+            jsn = yaml.safe_load(f)
+        return Blacklist.from_dict(jsn)
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> 'Blacklist':
+        """
+        Raises:
+            ValueError: if the given description uses an unsupported version
+                of the configuration format.
+        """
+        version = d.get('version')
+        if version != BLACKLIST_VERSION:
+            msg = "unsupported blacklist version: {} (expected {})"
+            raise ValueError(msg.format(version, BLACKLIST_VERSION))
+        rules = [BlacklistRule(prefix, category)
+                 for (category, prefixes) in d.get('categories', {}).items()
+                 for prefix in (prefixes or [])]
+        return Blacklist(rules, d.get('extensions', []))
+
+    def __init__(self,
+                 rules: List[BlacklistRule],
+                 extensions: List[str]
+                 ) -> None:
+        """
+        Constructs a new blacklist.
+
+        Parameters:
+            rules: the rules used to exclude files.
+            extensions: the file extensions of the files that may be
+                perturbed. All other files are excluded.
+        """
+        self.__rules = list(rules)
+        self.__extensions = tuple(extensions)
+        self.__trie = {}  # type: Dict[str, Any]
+        self.__memo = {}  # type: Dict[str, Optional[BlacklistRule]]
+        for rule in self.__rules:
+            node = self.__trie
+            for c in rule.prefix:
+                node = node.setdefault(c, {})
+            # the empty string marks the end of a prefix; a character key
+            # can never be empty, so it cannot collide with a child node.
+            node.setdefault('', rule)
+
+    @property
+    def rules(self) -> List[BlacklistRule]:
+        return list(self.__rules)
+
+    @property
+    def extensions(self) -> List[str]:
+        """
+        The file extensions of the files that may be perturbed.
+        """
+        return list(self.__extensions)
+
+    def _match(self, fn: str) -> Optional[BlacklistRule]:
+        node = self.__trie
+        for c in fn:
+            if '' in node:
+                return node['']
+            node = node.get(c)
+            if node is None:
+                return None
+        return node.get('')
+
+    def excluded_by(self, fn: str) -> Optional[BlacklistRule]:
+        """
+        Returns the rule that excludes a given file from perturbation, or
+        None if no rule excludes that file. If several rules match, the one
+        with the shortest prefix is returned.
+        """
+        try:
+            return self.__memo[fn]
+        except KeyError:
+            pass
+        rule = self._match(fn)
+        self.__memo[fn] = rule
+        return rule
+
+    def is_mutable(self, fn: str) -> bool:
+        """
+        Determines whether a given file may be the subject of perturbation.
+        """
+        if not fn.endswith(self.__extensions):
+            return False
+        return self.excluded_by(fn) is None
+
+    def explain(self, fn: str) -> str:
+        """
+        Produces a human-readable explanation of whether and why a given file
+        is excluded from perturbation.
+        """
+        if not fn.endswith(self.__extensions):
+            return "excluded: not a source file ({})".format(
+                ', '.join(self.__extensions))
+        rule = self.excluded_by(fn)
+        if rule is None:
+            return "mutable"
+        return "excluded by rule: {}".format(rule)
+
+
+def load_blacklist() -> Blacklist:
+    """
+    Loads the blacklist that is used to determine whether files may be
+    perturbed.
+    """
+    global __BLACKLIST
+    if __BLACKLIST:
+        return __BLACKLIST
+    logger.debug("loading blacklist: %s", BLACKLIST_FN)
+    __BLACKLIST = Blacklist.from_file(BLACKLIST_FN)
+    logger.debug("loaded blacklist with %d rules", len(__BLACKLIST.rules))
+    return __BLACKLIST
+
+
 def is_file_mutable(fn: str) -> bool:
     """
     Determines whether a given source code file may be the subject of
     perturbation on the basis of its name.
     """
-    if not fn.endswith('.cpp'):
-        return False
-
-    #
-    # TODO: ignore blacklisted files (e.g., Gazebo, ROS core code)
-    #
-    blacklist = [
-        'src/yujin_ocs/yocs_cmd_vel_mux/src/cmd_vel_subscribers.cpp',
-        'src/rospack/src/rospack.cpp',
-        'src/ros_comm/xmlrpcpp/src/XmlRpcUtil.cpp',
-        'src/actionlib/test',
-        'src/geometry/tf/test',
-        'src/geometry2/tf2/test',
-        'src/kdl_parser/kdl_parser/test',
-        'src/roscpp_core/rostime/test',
-        'src/class_loader/test',
-        'src/navigation/costmap_2d/test',
-        'src/navigation/base_local_planner/test',
-        'src/ros_comm/message_filters/test',
-        'src/pluginlib/test',
-        'src/navigation/costmap_2d/test',
-        'src/navigation/robot_pose_ekf/test',
-        'build/',
-        'src/dynamic_reconfigure/test',
-        'src/image_common/camera_info_manager/tests',
-        'src/diagnostics/diagnostic_updater',
-        'src/diagnostics/diagnostic_aggregator',
-        'src/navigation/clear_costmap_recovery/test',
-        'src/geometry2/tf2_ros/test',
-        'src/rospack/test',
-        'src/ros/roslib/test',
-        'src/pcl_conversions/test',
-        'src/navigation/voxel_grid/test',
-        'src/laser_geometry/test',
-        'src/angles/test',
-        'src/geometry2/tf2_kdl/test',
-        'src/geometry2/tf2_ros/test',
-        'src/navigation/navfn/test',
-        'src/geometry2/tf2_py',
-        'src/navigation/map_server/test/rtest.cpp',
-        'src/bfl/test',
-        'src/orocos_kinematics_dynamics/orocos_kdl/tests',
-
-        # no perturbations
-        'src/roscpp_core/roscpp_serialization/src/serialization.cpp',
-        'src/bond_core/bondcpp',
-        'src/dynamic_reconfigure/src/dynamic_reconfigure_config_init_mutex.cpp',
-        'src/kdl_parser',
-        'src/kobuki/kobuki_safety_controller/src/nodelet.cpp',
-        'src/ros_comm/message_filters/src/connection.cpp',
-        'src/image_common/camera_calibration_parsers/src/parse.cpp',
-        'src/geometry/eigen_conversions/src/eigen_msg.cpp',
-        'src/vision_opencv',
-        'src/image_common/image_transport/src/camera_common.cpp',
-        'src/navigation/rotate_recovery/src/rotate_recovery.cpp',
-        'src/navigation/base_local_planner/src/map_cell.cpp',
-        'src/ros_comm/topic_tools',
-        'src/perception_pcl',
-        'src/orocos_kinematics_dynamics/orocos_kdl/src/path_roundedcomposite.cpp',
-        'src/orocos_kinematics_dynamics/orocos_kdl/src/velocityprofile.cpp',
-        'src/rospack/src/utils.cpp',
-
-        'src/image_pipeline/depth_image_proc/src/nodelets/convert_metric.cpp',
-        'src/image_pipeline/depth_image_proc/src/nodelets/crop_foremost.cpp',
-        'src/image_pipeline/depth_image_proc/src/nodelets/point_cloud_xyzrgb.cpp',
-        'src/image_pipeline/image_proc',
-        'src/navigation/robot_pose_ekf',
-
-        'src/orocos_kinematics_dynamics/orocos_kdl/src/chain.cpp',
-
-        'src/nodelet_core/nodelet/src/nodelet_class.cpp',
-        'src/image_common/image_transport/src/raw_publisher.cpp',
-        'src/image_common/image_transport/src/image_transport.cpp',
-
-        # out of scope
-        'src/ecl_core/ecl_threads',
-        'src/bfl/examples',
-        'src/bfl/src/wrappers/rng',
-        'src/ros_comm/rosout',
-        'src/ros_comm/rosbag',
-        'src/stage_ros',
-        'src/ros_comm/rosconsole',
-        'src/rosconsole_bridge',
-        'src/nodelet_core',
-        'src/roscpp_core/cpp_common',
-
-        # TEMPORARY
-        'src/ros_comm/xmlrpcpp',
-        'src/ros_comm/roscpp/src/libros',
-
-        # misbehaving in baseline A
-        'src/robot_state_publisher',
-        'src/navigation/navfn/src/read_pgm_costmap.cpp',
-
-        # coverage problems
-        'src/navigation/voxel_grid'
-    ]
-    return not any(fn.startswith(b) for b in blacklist)
+    return load_blacklist().is_mutable(fn)
+
+
+def explain() -> None:
+    """
+    Reports whether each of a given list of files may be perturbed, and if
+    not, which rule excluded it.
+    """
+    parser = argparse.ArgumentParser(
+        description="Explains whether files may be perturbed.")
+    parser.add_argument('files', nargs='+',
+                        help="the names of the files, relative to the workspace.")  # noqa: pycodestyle
+    parser.add_argument('--config', default=BLACKLIST_FN,
+                        help="the blacklist configuration file.")
+    args = parser.parse_args()
+    blacklist = Blacklist.from_file(args.config)
+    for fn in args.files:
+        print("{}: {}".format(fn, blacklist.explain(fn)))
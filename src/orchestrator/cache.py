@@ -0,0 +1,181 @@
+"""
+This module determines where the orchestrator keeps its persistent, on-disk
+state (e.g., learned statistics and cached results), and provides a
+size-bounded, content-addressed cache for storing results on disk.
+"""
+from typing import Any, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['CACHE_DIR', 'cache_path', 'DiskCache']
+
+# the directory used to store persistent state; may be overridden by setting
+# the ORCHESTRATOR_CACHE_DIR environment variable.
+CACHE_DIR = os.environ.get('ORCHESTRATOR_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'),
+                                        '.cache',
+                                        'orchestrator'))  # type: str
+
+
+def cache_path(*parts: str) -> str:
+    """
+    Returns the path to a given file within the cache directory, creating its
+    parent directory if necessary.
+    """
+    fn = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    return fn
+
+
+class DiskCache(object):
+    """
+    A persistent, content-addressed store of JSON-serialisable values with a
+    bound on its total size. Each entry is stored in its own file, named after
+    the SHA-256 digest of its key. When the cache exceeds its size limit, the
+    least recently used entries are evicted.
+
+    The total size of the cache is measured once, when the first entry is
+    written, and is then tracked as entries are written. The directory is only
+    walked again when the tracked size exceeds the size limit.
+    """
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """
+        Computes a content-based key for a given sequence of JSON-serialisable
+        values.
+        """
+        jsn = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(jsn.encode('utf-8')).hexdigest()
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        """
+        Constructs a new cache.
+
+        Parameters:
+            directory: the directory in which entries should be stored.
+            max_size: the maximum total size of the cache, in bytes.
+        """
+        assert max_size > 0
+        os.makedirs(directory, exist_ok=True)
+        self.__directory = directory
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        # the tracked total size of the cache, or None if not yet measured
+        self.__size = None  # type: Optional[int]
+
+    @property
+    def directory(self) -> str:
+        """
+        The directory in which entries are stored.
+        """
+        return self.__directory
+
+    @property
+    def max_size(self) -> int:
+        """
+        The maximum total size of the cache, in bytes.
+        """
+        return self.__max_size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.__directory, key[:2], key + '.json')
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """
+        Returns a list of `(last_used, size, path)` tuples for each entry in
+        the cache.
+        """
+        entries = []
+        for (dirpath, _, filenames) in os.walk(self.__directory):
+            for name in filenames:
+                if not name.endswith('.json'):
+                    continue
+                fn = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(fn)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fn))
+        return entries
+
+    @property
+    def size(self) -> int:
+        """
+        The total size of all entries in the cache, in bytes.
+        """
+        return sum(size for (_, size, _) in self._entries())
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Retrieves the value for a given key, or None if there is no entry for
+        that key. Retrieving an entry marks it as recently used.
+        """
+        fn = self._path(key)
+        try:
+            with open(fn, 'r') as f:
+                value = json.load(f)
+            os.utime(fn, None)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.exception("failed to read cache entry: %s", fn)
+            return None
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Stores a value for a given key, evicting the least recently used
+        entries if the cache exceeds its size limit.
+        """
+        fn = self._path(key)
+        fn_tmp = '{}.tmp.{}.{}'.format(fn, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn_tmp, 'w') as f:
+                json.dump(value, f, separators=(',', ':'))
+            size_new = os.path.getsize(fn_tmp)
+            try:
+                size_old = os.path.getsize(fn)
+            except OSError:
+                size_old = 0
+            os.replace(fn_tmp, fn)
+        except OSError:
+            logger.exception("failed to write cache entry: %s", fn)
+            if os.path.exists(fn_tmp):
+                os.remove(fn_tmp)
+            return
+
+        with self.__lock:
+            if self.__size is None:
+                self.__size = sum(s for (_, s, _) in self._entries())
+            else:
+                self.__size += size_new - size_old
+            if self.__size > self.__max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        Evicts the least recently used entries until the cache is within its
+        size limit, and resynchronises the tracked size with the directory.
+        Must be called while holding the lock.
+        """
+        entries = sorted(self._entries())
+        size = sum(s for (_, s, _) in entries)
+        while size > self.__max_size and entries:
+            _, entry_size, fn = entries.pop(0)
+            logger.debug("evicting cache entry: %s", fn)
+            try:
+                os.remove(fn)
+            except OSError:
+                continue
+            size -= entry_size
+        self.__size = size
@@ -0,0 +1,334 @@
+"""
+This module is responsible for deciding how many workers each stage of the
+orchestrator may use at once. Limits are initially sized according to the
+resources of the host, and are subsequently adjusted using an additive
+increase, multiplicative decrease (AIMD) policy: the limit for a stage is
+halved whenever one of its workers fails (e.g., because a container timed out
+or a test was flaky), and is increased by one after a run of successes.
+"""
+from typing import Dict, Optional, Tuple, Iterator
+from enum import Enum
+import contextlib
+import logging
+import threading
+
+import psutil
+from bugzoo.core.test import TestOutcome
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['Stage', 'ConcurrencyController', 'ContainerBudget',
+           'default_controller', 'timed_out']
+
+# the number of bytes in a gigabyte
+GIGABYTE = 1024 ** 3
+
+# the number of consecutive successes required before a limit is increased
+INCREASE_AFTER_SUCCESSES = 3
+
+# the exit codes that are produced by `timeout` when a test exceeds its time
+# limit and is either terminated (124) or killed (137)
+TIMEOUT_EXIT_CODES = frozenset([124, 137])
+
+__DEFAULT_CONTROLLER = None  # type: Optional[ConcurrencyController]
+
+
+class Stage(Enum):
+    """
+    Identifies a stage of the orchestrator that executes work concurrently.
+    """
+    EVALUATION = 'evaluation'
+    COVERAGE = 'coverage'
+    LIVENESS = 'liveness'
+    ANALYSIS = 'analysis'
+    SEARCH_SPACE = 'search-space'
+
+
+# for each stage, a tuple of the form (workers per core, memory required per
+# worker in gigabytes, maximum number of workers).
+STAGE_REQUIREMENTS = {
+    Stage.EVALUATION: (1.0, 2.0, 64),
+    # NOTE coverage appears to become flaky beyond 8 simultaneous threads
+    Stage.COVERAGE: (1.0, 2.0, 8),
+    Stage.LIVENESS: (1.0, 2.0, 32),
+    Stage.ANALYSIS: (0.25, 3.0, 16),
+    Stage.SEARCH_SPACE: (1.0, 0.25, 16)
+}
+
+
+# the stages whose workers each occupy a container
+CONTAINER_STAGES = frozenset([Stage.EVALUATION,
+                              Stage.COVERAGE,
+                              Stage.LIVENESS,
+                              Stage.ANALYSIS])
+
+
+def timed_out(outcome: TestOutcome) -> bool:
+    """
+    Determines whether a given test execution exceeded its time limit.
+    """
+    return outcome.response.code in TIMEOUT_EXIT_CODES
+
+
+def _host_resources() -> Tuple[int, float]:
+    """
+    Returns the number of logical cores and the available memory, in
+    gigabytes, for the host.
+    """
+    cores = psutil.cpu_count(logical=True) or 1
+    try:
+        memory = psutil.virtual_memory().available / GIGABYTE
+    except Exception:
+        logger.exception("failed to determine available memory")
+        memory = float('inf')
+    return cores, memory
+
+
+class ContainerBudget(object):
+    """
+    Caps the total number of containers that may be used at once by the
+    workers of several orchestrators within the same process. Each unit of
+    work reserves its containers up front and returns them when it
+    finishes, so a unit of work never waits for containers while holding
+    others. Each reservation is limited to a fair share of the capacity: the
+    capacity divided by the number of members that share the budget (see
+    `join`), or by the number of reservations (including the new one) if
+    that is greater. Since reservations are not revoked, a member that
+    joins while the budget is fully reserved waits for a reservation to be
+    returned.
+    """
+    def __init__(self, capacity: int) -> None:
+        assert capacity > 0
+        self.__capacity = capacity
+        self.__available = capacity
+        self.__holders = 0
+        self.__members = 0
+        self.__cv = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        return self.__capacity
+
+    @property
+    def available(self) -> int:
+        """
+        The number of containers that are not currently reserved.
+        """
+        with self.__cv:
+            return self.__available
+
+    @property
+    def members(self) -> int:
+        """
+        The number of members that currently share this budget.
+        """
+        with self.__cv:
+            return self.__members
+
+    def join(self) -> None:
+        """
+        Registers a new member (e.g., a session) that shares this budget,
+        reducing the share that is granted to each reservation.
+        """
+        with self.__cv:
+            self.__members += 1
+
+    def leave(self) -> None:
+        """
+        Deregisters a member that was registered by `join`.
+        """
+        with self.__cv:
+            assert self.__members > 0
+            self.__members -= 1
+
+    def _acquire(self, wanted: int) -> int:
+        with self.__cv:
+            while self.__available == 0:
+                self.__cv.wait()
+            sharers = max(1, self.__members, self.__holders + 1)
+            share = max(1, self.__capacity // sharers)
+            granted = min(wanted, share, self.__available)
+            self.__available -= granted
+            self.__holders += 1
+            return granted
+
+    def _release(self, granted: int) -> None:
+        with self.__cv:
+            self.__available += granted
+            self.__holders -= 1
+            self.__cv.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, wanted: int) -> Iterator[int]:
+        """
+        Reserves up to a given number of containers for the duration of a
+        `with` statement, blocking until at least one container is
+        available. Provides the number of containers that were granted.
+        """
+        assert wanted > 0
+        granted = self._acquire(wanted)
+        logger.debug("reserved %d of %d requested containers",
+                     granted, wanted)
+        try:
+            yield granted
+        finally:
+            self._release(granted)
+
+
+class ConcurrencyController(object):
+    """
+    Maintains the current limit on the number of concurrent workers for each
+    stage of the orchestrator.
+    """
+    def __init__(self,
+                 overrides: Optional[Dict[Stage, int]] = None,
+                 *,
+                 cores: Optional[int] = None,
+                 memory: Optional[float] = None,
+                 budget: Optional[ContainerBudget] = None
+                 ) -> None:
+        """
+        Constructs a new controller.
+
+        Parameters:
+            overrides: an optional mapping from stages to fixed limits. The
+                limits for these stages are never adjusted.
+            cores: the number of cores that may be used. Defaults to the
+                number of logical cores on the host.
+            memory: the amount of memory, in gigabytes, that may be used.
+                Defaults to the memory that is currently available on the
+                host.
+            budget: an optional budget, shared with other controllers, from
+                which workers that require containers must reserve them.
+        """
+        host_cores, host_memory = _host_resources()
+        self.__cores = cores if cores is not None else host_cores
+        self.__memory = memory if memory is not None else host_memory
+        self.__budget = budget
+        self.__lock = threading.Lock()
+        self.__fixed = set(overrides or {})
+        self.__ceilings = {}  # type: Dict[Stage, int]
+        self.__limits = {}  # type: Dict[Stage, int]
+        self.__successes = {}  # type: Dict[Stage, int]
+        self.__failures = {}  # type: Dict[Stage, int]
+        for stage in Stage:
+            if overrides and stage in overrides:
+                ceiling = overrides[stage]
+                assert ceiling > 0
+            else:
+                ceiling = self._ceiling_for_host(stage)
+            self.__ceilings[stage] = ceiling
+            self.__limits[stage] = ceiling
+            self.__successes[stage] = 0
+            self.__failures[stage] = 0
+        logger.info("concurrency limits (%d cores, %.1f GB memory): %s",
+                    self.__cores, self.__memory,
+                    ', '.join('{}={}'.format(s.value, n)
+                              for (s, n) in self.__limits.items()))
+
+    def _ceiling_for_host(self, stage: Stage) -> int:
+        per_core, memory_per_worker, maximum = STAGE_REQUIREMENTS[stage]
+        by_cpu = int(self.__cores * per_core)
+        by_memory = int(self.__memory / memory_per_worker)
+        return max(1, min(maximum, by_cpu, by_memory))
+
+    @property
+    def budget(self) -> Optional[ContainerBudget]:
+        return self.__budget
+
+    @property
+    def limits(self) -> Dict[str, int]:
+        """
+        The current limit for each stage, indexed by the name of the stage.
+        """
+        with self.__lock:
+            return {s.value: n for (s, n) in self.__limits.items()}
+
+    def ceiling(self, stage: Stage) -> int:
+        """
+        Returns the largest limit that may be used by a given stage.
+        """
+        return self.__ceilings[stage]
+
+    def limit(self, stage: Stage) -> int:
+        """
+        Returns the number of workers that a given stage may currently use.
+        """
+        with self.__lock:
+            return self.__limits[stage]
+
+    def report_success(self, stage: Stage) -> None:
+        """
+        Reports that a unit of work for a given stage completed without
+        failure. After several consecutive successes, the limit for that
+        stage is increased by one, up to its ceiling.
+        """
+        with self.__lock:
+            if stage in self.__fixed:
+                return
+            self.__successes[stage] += 1
+            if self.__successes[stage] < INCREASE_AFTER_SUCCESSES:
+                return
+            self.__successes[stage] = 0
+            limit = self.__limits[stage]
+            if limit < self.__ceilings[stage]:
+                self.__limits[stage] = limit + 1
+                logger.debug("increased %s concurrency limit to %d",
+                             stage.value, limit + 1)
+
+    def report_failure(self, stage: Stage) -> None:
+        """
+        Reports that a unit of work for a given stage failed, or that one of
+        its containers timed out. The limit for that stage is halved.
+        """
+        with self.__lock:
+            self.__failures[stage] += 1
+            if stage in self.__fixed:
+                return
+            self.__successes[stage] = 0
+            limit = self.__limits[stage]
+            self.__limits[stage] = max(1, limit // 2)
+            if self.__limits[stage] != limit:
+                logger.warning("reduced %s concurrency limit to %d",
+                               stage.value, self.__limits[stage])
+
+    @contextlib.contextmanager
+    def track(self, stage: Stage) -> Iterator[int]:
+        """
+        Provides the number of workers that may be used by a unit of work for
+        a given stage, and reports the success or failure of that work once
+        it has finished. Work fails if it raises an exception, which is
+        propagated, or if a failure (e.g., a timeout) is reported for the
+        stage while the work is running. If the controller has a
+        container budget, and the stage requires containers, the workers'
+        containers are reserved for the duration of the work, and the number
+        of workers is limited to the number of containers that were granted.
+        """
+        with self.__lock:
+            limit = self.__limits[stage]
+            failures = self.__failures[stage]
+        with contextlib.ExitStack() as stack:
+            if self.__budget and stage in CONTAINER_STAGES:
+                limit = stack.enter_context(self.__budget.reserve(limit))
+            try:
+                yield limit
+            except Exception:
+                self.report_failure(stage)
+                raise
+        with self.__lock:
+            failed = self.__failures[stage] != failures
+        if not failed:
+            self.report_success(stage)
+
+
+def default_controller() -> ConcurrencyController:
+    """
+    Returns the concurrency controller that is used when no limit is given
+    explicitly. The controller is shared by the entire process.
+    """
+    global __DEFAULT_CONTROLLER
+    if __DEFAULT_CONTROLLER:
+        return __DEFAULT_CONTROLLER
+    __DEFAULT_CONTROLLER = ConcurrencyController()
+    return __DEFAULT_CONTROLLER
@@ -2,8 +2,10 @@
 This module is responsible for (pre-)computing coverage information for
 baselines A and B.
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterable, Set
+from collections import ChainMap
 from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 from timeit import default_timer as timer
 import functools
 import os
@@ -14,60 +16,269 @@ import bugzoo.server
 from bugzoo.client import Client as BugZooClient
 from bugzoo.core.bug import Bug as Snapshot
 from bugzoo.core.test import TestCase
+from bugzoo.core.fileline import FileLine, FileLineSet
 from bugzoo.core.coverage import TestCoverage, TestSuiteCoverage
 from bugzoo.exceptions import BugZooException
 from boggart import Client as BoggartClient
-from boggart import Mutant
+from boggart import Mutant, Mutation
 
 from .orchestrator import fetch_instrumentation_snapshot
 from .exceptions import FailedToComputeCoverage
 from .blacklist import is_file_mutable
-from .snapshot import fetch_instrumentation_snapshot
+from .snapshot import fetch_instrumentation_snapshot, snapshot_identity
+from .cache import DiskCache, CACHE_DIR
+from .coveragedb import CoverageDatabase, convert_json
+from .coverageindex import CoverageIndex
+from .analysis import AnalysisCache
+from .pool import ContainerPool
+from .concurrency import Stage, default_controller
+from .metrics import MetricsRegistry
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
 
 __BASELINE_COVERAGE = None  #  type: Optional[TestSuiteCoverage]
+__BASELINE_COVERAGE_DB = None  # type: Optional[CoverageDatabase]
+__BASELINE_LINES = None  # type: Optional[FileLineSet]
+__BASELINE_INDEX = None  # type: Optional[CoverageIndex]
 
 BASELINE_COVERAGE_FN = \
     os.path.join(os.path.dirname(__file__),
                  'data/baseline.coverage.json')  # type: str
 
+# the coverage database is built from the JSON coverage report on first use,
+# and is kept in the cache directory since the package may be read-only
+BASELINE_COVERAGE_DB_FN = \
+    os.path.join(CACHE_DIR, 'baseline.coverage.db')  # type: str
+
+class TestSelection(Enum):
+    """
+    Determines which tests are rerun when computing coverage for a mutant.
+    Tests that are not rerun are assumed to have the same coverage as they
+    do for the baseline.
+    """
+    # tests that cover any line in a perturbed file
+    FILE = 'file'
+    # tests that cover any perturbed line
+    LINE = 'line'
+    # tests that cover any line in a function that encloses a perturbed line
+    FUNCTION = 'function'
+
+
+# the maximum size of the on-disk mutant coverage cache, given in bytes
+MUTANT_COVERAGE_CACHE_SIZE = 512 * 1024 * 1024
+
+# bumped whenever the contents of the mutant coverage cache are invalidated
+MUTANT_COVERAGE_CACHE_VERSION = 2
+
+
+class MutantCoverageCache(object):
+    """
+    A persistent cache of the coverage for previously computed mutants, keyed
+    by the identity of the baseline snapshot and the set of mutations that
+    were applied to it. Only the coverage of the tests that were rerun for
+    each mutant is stored; the coverage of all other tests is taken from the
+    baseline when an entry is retrieved.
+    """
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 max_size: int = MUTANT_COVERAGE_CACHE_SIZE
+                 ) -> None:
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, 'mutant-coverage')
+        self.__cache = DiskCache(directory, max_size)
+
+    @staticmethod
+    def _key(baseline: Snapshot,
+             mutations: Iterable[Mutation],
+             selection: TestSelection
+             ) -> str:
+        mutations = sorted(json.dumps(m.to_dict(), sort_keys=True)
+                           for m in mutations)
+        return DiskCache.key(MUTANT_COVERAGE_CACHE_VERSION,
+                             snapshot_identity(baseline),
+                             mutations,
+                             selection.value)
+
+    def get(self,
+            baseline: Snapshot,
+            mutations: Iterable[Mutation],
+            selection: TestSelection = TestSelection.FILE
+            ) -> Optional[TestSuiteCoverage]:
+        """
+        Retrieves the coverage for the mutant produced by applying a given set
+        of mutations to a given baseline, or None if there is no entry for
+        that mutant.
+        """
+        jsn = self.__cache.get(self._key(baseline, mutations, selection))
+        if jsn is None:
+            return None
+        return merge_with_baseline(TestSuiteCoverage.from_dict(jsn))
+
+    def put(self,
+            baseline: Snapshot,
+            mutations: Iterable[Mutation],
+            coverage: TestSuiteCoverage,
+            selection: TestSelection = TestSelection.FILE
+            ) -> None:
+        """
+        Stores the coverage for the mutant produced by applying a given set of
+        mutations to a given baseline.
+
+        Parameters:
+            coverage: the coverage of the tests that were rerun for the
+                mutant (see `compute_selected_coverage`).
+        """
+        key = self._key(baseline, mutations, selection)
+        self.__cache.put(key, coverage.to_dict())
+
+
+def select_tests_for_mutant(client_bugzoo: BugZooClient,
+                            mutant: Mutant,
+                            selection: TestSelection,
+                            *,
+                            analysis_cache: Optional[AnalysisCache] = None
+                            ) -> Set[str]:
+    """
+    Determines the names of the tests whose coverage may be changed by a
+    given mutant.
+
+    Parameters:
+        client_bugzoo: a connection to the BugZoo server.
+        mutant: the mutant.
+        selection: the strategy used to select tests.
+        analysis_cache: the static analysis cache that is used to find the
+            functions that enclose the mutant. If unspecified, the default
+            on-disk cache is used.
+    """
+    index = load_baseline_index()
+    locations = [m.location for m in mutant.mutations]
+    if selection == TestSelection.FILE:
+        tests = set()  # type: Set[str]
+        for filename in set(l.filename for l in locations):
+            tests |= index.tests_covering_file(filename)
+        return tests
+
+    lines = [FileLine(l.filename, num)
+             for l in locations
+             for num in range(l.start.line, l.stop.line + 1)]
+    tests = index.tests_covering_lines(lines)
+    if selection == TestSelection.LINE:
+        return tests
+
+    # include tests that reach the functions that enclose the perturbed lines
+    if analysis_cache is None:
+        analysis_cache = AnalysisCache()
+    snapshot = client_bugzoo.bugs[mutant.snapshot]
+    baseline = client_bugzoo.bugs[mutant.base]
+    files = list(set(l.filename for l in locations))
+    logger.debug("finding functions that enclose mutant in files: %s", files)
+    file_to_key = \
+        {fn: AnalysisCache.content_key(baseline, fn, mutant.mutations)
+         for fn in files}
+    analysis = analysis_cache.build(client_bugzoo, snapshot, file_to_key)
+    functions = [f for fn in files for f in analysis.functions.in_file(fn)]
+    for function in functions:
+        loc = function.location
+        if not any(loc.filename == line.filename and
+                   loc.start.line <= line.num <= loc.stop.line
+                   for line in lines):
+            continue
+        logger.debug("including tests that cover function: %s", loc)
+        body = [FileLine(loc.filename, num)
+                for num in range(loc.start.line, loc.stop.line + 1)]
+        tests |= index.tests_covering_lines(body)
+    return tests
+
+
+def merge_with_baseline(coverage: TestSuiteCoverage) -> TestSuiteCoverage:
+    """
+    Completes a coverage report for a subset of tests by copying the coverage
+    of all other tests from the baseline. The coverage of each baseline test
+    is only decoded when it is first accessed.
+    """
+    coverage_baseline = load_baseline_coverage()
+    test_to_coverage = {}  # type: Dict[str, TestCoverage]
+    for test_name in coverage:
+        test_to_coverage[test_name] = coverage[test_name]
+    # coverage for the rerun tests takes precedence over the baseline
+    return TestSuiteCoverage(ChainMap(test_to_coverage, coverage_baseline))
+
 
 def compute_mutant_coverage(client_bugzoo: BugZooClient,
                             client_boggart: BoggartClient,
                             mutant: Mutant,
                             *,
-                            threads: int = 6
+                            threads: Optional[int] = None,
+                            selection: TestSelection = TestSelection.FILE,
+                            metrics: Optional[MetricsRegistry] = None,
+                            analysis_cache: Optional[AnalysisCache] = None
                             ) -> TestSuiteCoverage:
-    # NOTE coverage appears to become flaky beyond 8 simultaneous threads
-    # threads = max(threads, 8)
+    """
+    Computes coverage for a given mutant by rerunning the tests selected by a
+    given strategy against an instrumented version of that mutant. Coverage
+    for all other tests is copied from the baseline. If the number of threads
+    is unspecified, the current coverage concurrency limit is used. If a
+    metrics registry is given, the time taken to create the instrumented
+    mutant and to run its tests are recorded. If a static analysis cache is
+    given, it is used to find the functions that enclose the mutant when
+    tests are selected by function.
+    """
+    coverage = compute_selected_coverage(client_bugzoo, client_boggart,
+                                         mutant,
+                                         threads=threads,
+                                         selection=selection,
+                                         metrics=metrics,
+                                         analysis_cache=analysis_cache)
+    return merge_with_baseline(coverage)
+
+
+def compute_selected_coverage(client_bugzoo: BugZooClient,
+                              client_boggart: BoggartClient,
+                              mutant: Mutant,
+                              *,
+                              threads: Optional[int] = None,
+                              selection: TestSelection = TestSelection.FILE,
+                              metrics: Optional[MetricsRegistry] = None,
+                              analysis_cache: Optional[AnalysisCache] = None
+                              ) -> TestSuiteCoverage:
+    """
+    Computes coverage for a given mutant for only those tests that are
+    selected by a given strategy. The parameters are the same as those of
+    `compute_mutant_coverage`.
+    """
+    if metrics is None:
+        metrics = MetricsRegistry()
+    if threads is None:
+        threads = default_controller().limit(Stage.COVERAGE)
     logger.info("computing coverage for mutant: %s", mutant.uuid)
     logger.debug("num. coverage threads: %d", threads)
-    coverage_baseline = load_baseline_coverage()
     snapshot_mutant = client_bugzoo.bugs[mutant.snapshot]
 
-    # restrict to tests that cover the perturbed file
-    filename = list(mutant.mutations)[0].location.filename
-    tests = [t for t in snapshot_mutant.tests \
-             if filename in coverage_baseline[t.name].lines.files]
+    # restrict to tests that may be affected by the perturbation
+    logger.debug("selecting tests by %s", selection.value)
+    covering = select_tests_for_mutant(client_bugzoo, mutant, selection,
+                                       analysis_cache=analysis_cache)
+    tests = [t for t in snapshot_mutant.tests if t.name in covering]
     logger.debug("restricting coverage for mutant to following tests: %s",
                  ', '.join([t.name for t in tests]))
 
     mutant_instrumented = None
     try:
         logger.debug("creating temporary instrumented mutant")
-        mutant_instrumented = \
-            client_boggart.mutate(fetch_instrumentation_snapshot(client_bugzoo),
-                                  mutant.mutations)
+        with metrics.time('instrumented-mutant'):
+            mutant_instrumented = \
+                client_boggart.mutate(fetch_instrumentation_snapshot(client_bugzoo),  # noqa: pycodestyle
+                                      mutant.mutations)
         snapshot_instrumented = \
             client_bugzoo.bugs[mutant_instrumented.snapshot]
         logger.debug("created temporary instrumented mutant: %s",
                      mutant_instrumented)
-        coverage = compute_coverage(client_bugzoo,
-                                    snapshot_instrumented,
-                                    tests,
-                                    threads=threads)
+        with metrics.time('coverage-tests'):
+            coverage = compute_coverage(client_bugzoo,
+                                        snapshot_instrumented,
+                                        tests,
+                                        threads=threads)
     except Exception:
         logger.warning("failed to compute coverage for mutant: %s", mutant)
         raise FailedToComputeCoverage
@@ -76,33 +287,32 @@ def compute_mutant_coverage(client_bugzoo: BugZooClient,
         if mutant_instrumented:
             del client_boggart.mutants[mutant_instrumented.uuid]
 
-    # complete the rest of the coverage report
-    test_to_coverage = {}  # type: Dict[str, TestCoverage]
-    for test_name in coverage_baseline:
-        test_to_coverage[test_name] = coverage_baseline[test_name]
-    for test_name in coverage:
-        test_to_coverage[test_name] = coverage[test_name]
-    coverage = TestSuiteCoverage(test_to_coverage)
-
     logger.info("computed coverage for mutant: %s", mutant)
     return coverage
 
 
-# FIXME stop provisioning containers -- have one for each thread
 def compute_test_coverage(client_bugzoo: BugZooClient,
                           snapshot: Snapshot,
-                          test: TestCase
+                          test: TestCase,
+                          *,
+                          pool: Optional[ContainerPool] = None
                           ) -> TestCoverage:
     """
-    Computes coverage information for a given test using a fresh container.
+    Computes coverage information for a given test. If a container pool is
+    provided, the test is executed inside a container borrowed from that pool;
+    otherwise, a fresh container is provisioned for the test.
     """
     logger.info("computing coverage for test: %s", test.name)
+    if pool is None:
+        with ContainerPool(client_bugzoo, snapshot, 1) as pool:
+            return compute_test_coverage(client_bugzoo, snapshot, test,
+                                         pool=pool)
+
     ctr_mgr = client_bugzoo.containers
-    container = None
     try:
-        container = ctr_mgr.provision(snapshot)
-        outcome = ctr_mgr.test(container, test)
-        lines = ctr_mgr.extract_coverage(container)
+        with pool.container() as container:
+            outcome = ctr_mgr.test(container, test)
+            lines = ctr_mgr.extract_coverage(container)
         lines = lines.filter(lambda ln: is_file_mutable(ln.filename))
         logger.info("computed coverage for test: %s", test.name)
         return TestCoverage(test.name, outcome, lines)
@@ -110,24 +320,31 @@ def compute_test_coverage(client_bugzoo: BugZooClient,
         logger.exception("failed to compute coverage for snapshot (%s) on test (%s).",
                          snapshot.name, test.name)
         raise FailedToComputeCoverage
-    finally:
-        if container is not None:
-            del ctr_mgr[container.uid]
 
 
 def compute_coverage(client_bugzoo: BugZooClient,
                      snapshot: Snapshot,
                      tests: List[TestCase],
                      *,
-                     threads: int = 6
+                     threads: Optional[int] = None
                      ) -> TestSuiteCoverage:
+    """
+    Computes coverage information for a given set of tests using a pool of
+    containers, each of which is reused across tests. If the number of
+    threads is unspecified, the current coverage concurrency limit is used.
+    """
+    if threads is None:
+        threads = default_controller().limit(Stage.COVERAGE)
     t_start = timer()
     logger.debug("computing coverage")
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        func_coverage = functools.partial(compute_test_coverage,
-                                          client_bugzoo,
-                                          snapshot)
-        test_to_coverage = executor.map(func_coverage, tests)
+    with ContainerPool(client_bugzoo, snapshot, threads,
+                       reset_coverage=True) as pool:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            func_coverage = functools.partial(compute_test_coverage,
+                                              client_bugzoo,
+                                              snapshot,
+                                              pool=pool)
+            test_to_coverage = list(executor.map(func_coverage, tests))
 
     coverage = \
         TestSuiteCoverage({cov.test: cov
@@ -137,15 +354,59 @@ def compute_coverage(client_bugzoo: BugZooClient,
     return coverage
 
 
+def load_baseline_coverage_database() -> CoverageDatabase:
+    """
+    Attempts to load the memory-mapped coverage database for Baseline A. If
+    the database is missing, or was produced from an older version of the
+    precomputed JSON coverage report, it is (re)built from that report.
+
+    The database is kept in the cache directory (see `CACHE_DIR`).
+
+    Raises:
+        OSError: if the database is missing or out of date and cannot be
+            written to disk.
+    """
+    global __BASELINE_COVERAGE_DB
+    if __BASELINE_COVERAGE_DB:
+        return __BASELINE_COVERAGE_DB
+
+    if not CoverageDatabase.is_fresh(BASELINE_COVERAGE_DB_FN,
+                                     BASELINE_COVERAGE_FN):
+        logger.info("coverage database for baseline A is missing or stale.")
+        convert()
+    __BASELINE_COVERAGE_DB = CoverageDatabase(BASELINE_COVERAGE_DB_FN)
+    return __BASELINE_COVERAGE_DB
+
+
 def load_baseline_coverage() -> TestSuiteCoverage:
     """
     Attempts to load coverage information for Baseline A.
+
+    Coverage is read lazily from a memory-mapped coverage database whenever
+    possible; if the database cannot be used, the precomputed JSON coverage
+    report is loaded in its entirety instead.
     """
     global __BASELINE_COVERAGE
     if __BASELINE_COVERAGE:
         return __BASELINE_COVERAGE
 
     logger.debug("attempting to load precomputed coverage for baseline A.")
+    try:
+        db = load_baseline_coverage_database()
+    except Exception:
+        logger.warning("failed to load coverage database for baseline A: falling back to JSON coverage report.",  # noqa: pycodestyle
+                       exc_info=True)
+        db = None
+
+    if db is not None:
+        # restrict to mutable files
+        files = [fn for fn in db.files if is_file_mutable(fn)]
+        __BASELINE_COVERAGE = db.to_coverage(files)
+        logger.debug("loaded precomputed coverage for baseline A.")
+        return __BASELINE_COVERAGE
+
+    logger.warning("loading JSON coverage report for baseline A in its entirety: %s",  # noqa: pycodestyle
+                   BASELINE_COVERAGE_FN)
     try:
         with open(BASELINE_COVERAGE_FN, 'r') as f:
             jsn = json.load(f)
@@ -160,6 +421,51 @@ def load_baseline_coverage() -> TestSuiteCoverage:
     return __BASELINE_COVERAGE
 
 
+def load_baseline_lines() -> FileLineSet:
+    """
+    Returns the set of mutable lines that are covered by the test suite for
+    Baseline A. Whenever possible, the lines are read from the per-file index
+    of the coverage database, without decoding the coverage for each test.
+    """
+    global __BASELINE_LINES
+    if __BASELINE_LINES:
+        return __BASELINE_LINES
+
+    coverage = load_baseline_coverage()
+    db = __BASELINE_COVERAGE_DB
+    if db is not None:
+        files = [fn for fn in db.files if is_file_mutable(fn)]
+        __BASELINE_LINES = db.lines(files)
+    else:
+        __BASELINE_LINES = coverage.lines
+    return __BASELINE_LINES
+
+
+def load_baseline_index() -> CoverageIndex:
+    """
+    Builds an inverted index over the coverage for Baseline A, mapping each
+    mutable line and file to the tests that cover it. Whenever possible, the
+    index is built from the per-file postings of the coverage database,
+    without decoding the coverage for each test.
+    """
+    global __BASELINE_INDEX
+    if __BASELINE_INDEX:
+        return __BASELINE_INDEX
+
+    logger.debug("building coverage index for baseline A.")
+    time_start = timer()
+    coverage = load_baseline_coverage()
+    db = __BASELINE_COVERAGE_DB
+    if db is not None:
+        files = [fn for fn in db.files if is_file_mutable(fn)]
+        __BASELINE_INDEX = CoverageIndex.from_database(db, files)
+    else:
+        __BASELINE_INDEX = CoverageIndex.from_coverage(coverage)
+    logger.debug("built coverage index for baseline A (took %.3f seconds).",
+                 timer() - time_start)
+    return __BASELINE_INDEX
+
+
 def precompute() -> None:
     """
     Precomputes coverage information for baseline A and saves to a given
@@ -174,4 +480,14 @@ def precompute() -> None:
     logger.info("writing coverage information to disk: %s", dest_fn)
     with open(dest_fn, 'w') as f:
         json.dump(coverage.to_dict(), f, separators=(',',':'))
+    convert_json(dest_fn, 'baseline.coverage.db')
     logger.info("wrote coverage information to disk.")
+
+
+def convert() -> None:
+    """
+    Converts the precomputed JSON coverage report for baseline A into a
+    memory-mapped coverage database, stored in the cache directory.
+    """
+    os.makedirs(os.path.dirname(BASELINE_COVERAGE_DB_FN), exist_ok=True)
+    convert_json(BASELINE_COVERAGE_FN, BASELINE_COVERAGE_DB_FN)
@@ -0,0 +1,420 @@
+"""
+This module provides a compact, memory-mapped binary format for storing
+test suite coverage information, together with a converter from the JSON
+format produced by BugZoo.
+
+A coverage database is laid out as follows (all integers are little-endian):
+
+    header    magic, version, counts, section offsets, digest of the source
+    files     one record per file: name, [start, count) into the postings,
+              [start, count) into the covered lines
+    tests     one record per test: name, outcome, [start, count) into entries
+    entries   one record per (test, file): file index, [start, count) into lines
+    postings  uint32 test indices for each file
+    lines     uint32 line numbers for each entry, sorted
+    covered   uint32 line numbers covered by any test, for each file, sorted
+    strings   UTF-8 encoded names and JSON-encoded test outcomes
+
+Only the header and the file and test tables are decoded when a database is
+opened; coverage for individual tests and files is decoded on demand. The
+covered section allows the lines covered by the test suite as a whole to be
+read without decoding the coverage of each test.
+"""
+from typing import Dict, List, Iterator, Iterable, Optional, Any, Set, Tuple
+from collections.abc import Mapping
+import hashlib
+import logging
+import json
+import mmap
+import os
+import struct
+
+from bugzoo.core.test import TestOutcome
+from bugzoo.core.fileline import FileLineSet
+from bugzoo.core.coverage import TestCoverage, TestSuiteCoverage
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['CoverageDatabase', 'write_database', 'convert_json']
+
+MAGIC = b'P2C2COV\x00'
+VERSION = 2
+
+_HEADER = struct.Struct('<8sIII8Q32s')
+_FILE = struct.Struct('<IIIIII')
+_TEST = struct.Struct('<IIIIII')
+_ENTRY = struct.Struct('<III')
+_UINT32 = struct.Struct('<I')
+
+
+def _digest_file(fn: str) -> bytes:
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.digest()
+
+
+def write_database(jsn: Dict[str, Any],
+                   fn: str,
+                   *,
+                   source_digest: bytes = b''
+                   ) -> None:
+    """
+    Writes a coverage database to disk.
+
+    Parameters:
+        jsn: a dictionary-based description of the test suite coverage, as
+            produced by `TestSuiteCoverage.to_dict`.
+        fn: the path to which the database should be written. The database
+            is written to a temporary file that is atomically moved to this
+            path once complete.
+        source_digest: an optional SHA-256 digest of the file from which the
+            coverage was obtained.
+    """
+    strings = bytearray()
+
+    def add_string(s: str) -> Tuple[int, int]:
+        b = s.encode('utf-8')
+        offset = len(strings)
+        strings.extend(b)
+        return offset, len(b)
+
+    test_names = sorted(jsn)
+    file_names = sorted(set(fn_cov
+                            for name in test_names
+                            for fn_cov in jsn[name]['coverage']))
+    file_to_index = {name: i for (i, name) in enumerate(file_names)}
+    file_to_tests = [[] for _ in file_names]  # type: List[List[int]]
+    file_to_lines = [set() for _ in file_names]  # type: List[Set[int]]
+
+    tests = bytearray()
+    entries = bytearray()
+    lines = bytearray()
+    num_entries = 0
+    num_lines = 0
+    for (test_index, name) in enumerate(test_names):
+        desc = jsn[name]
+        name_off, name_len = add_string(name)
+        outcome = json.dumps(desc['outcome'], separators=(',', ':'))
+        outcome_off, outcome_len = add_string(outcome)
+        covered = sorted((file_to_index[f], ls)
+                         for (f, ls) in desc['coverage'].items() if ls)
+        tests.extend(_TEST.pack(name_off, name_len,
+                                outcome_off, outcome_len,
+                                num_entries, len(covered)))
+        for (file_index, file_lines) in covered:
+            file_lines = sorted(set(file_lines))
+            entries.extend(_ENTRY.pack(file_index, num_lines, len(file_lines)))
+            lines.extend(struct.pack('<{}I'.format(len(file_lines)),
+                                     *file_lines))
+            file_to_tests[file_index].append(test_index)
+            file_to_lines[file_index].update(file_lines)
+            num_entries += 1
+            num_lines += len(file_lines)
+
+    files = bytearray()
+    postings = bytearray()
+    covered = bytearray()
+    num_postings = 0
+    num_covered = 0
+    for (file_index, name) in enumerate(file_names):
+        name_off, name_len = add_string(name)
+        covering = file_to_tests[file_index]
+        file_lines = sorted(file_to_lines[file_index])
+        files.extend(_FILE.pack(name_off, name_len,
+                                num_postings, len(covering),
+                                num_covered, len(file_lines)))
+        postings.extend(struct.pack('<{}I'.format(len(covering)), *covering))
+        covered.extend(struct.pack('<{}I'.format(len(file_lines)),
+                                   *file_lines))
+        num_postings += len(covering)
+        num_covered += len(file_lines)
+
+    off_files = _HEADER.size
+    off_tests = off_files + len(files)
+    off_entries = off_tests + len(tests)
+    off_postings = off_entries + len(entries)
+    off_lines = off_postings + len(postings)
+    off_covered = off_lines + len(lines)
+    off_strings = off_covered + len(covered)
+    size = off_strings + len(strings)
+    header = _HEADER.pack(MAGIC, VERSION, len(file_names), len(test_names),
+                          off_files, off_tests, off_entries, off_postings,
+                          off_lines, off_covered, off_strings, size,
+                          source_digest.ljust(32, b'\x00'))
+
+    fn_tmp = '{}.tmp.{}'.format(fn, os.getpid())
+    try:
+        with open(fn_tmp, 'wb') as f:
+            for section in (header, files, tests, entries, postings, lines,
+                            covered, strings):
+                f.write(section)
+        os.replace(fn_tmp, fn)
+    finally:
+        if os.path.exists(fn_tmp):
+            os.remove(fn_tmp)
+
+
+def convert_json(fn_json: str, fn_db: str) -> None:
+    """
+    Converts a JSON-based coverage report, produced by BugZoo, into a coverage
+    database.
+    """
+    logger.info("converting coverage report (%s) to database (%s)",
+                fn_json, fn_db)
+    with open(fn_json, 'r') as f:
+        jsn = json.load(f)
+    write_database(jsn, fn_db, source_digest=_digest_file(fn_json))
+    logger.info("converted coverage report to database: %s", fn_db)
+
+
+class CoverageDatabase(object):
+    """
+    Provides lazy, read-only access to a memory-mapped coverage database.
+    """
+    @staticmethod
+    def is_fresh(fn_db: str, fn_source: str) -> bool:
+        """
+        Determines whether a given coverage database exists and was produced
+        from the current contents of a given JSON coverage report.
+        """
+        if not os.path.exists(fn_db):
+            return False
+        try:
+            with open(fn_db, 'rb') as f:
+                header = _HEADER.unpack(f.read(_HEADER.size))
+        except (OSError, struct.error):
+            return False
+        magic, version = header[0], header[1]
+        digest = header[-1]
+        return magic == MAGIC and version == VERSION \
+            and digest == _digest_file(fn_source)
+
+    def __init__(self, fn: str) -> None:
+        self.__filename = fn
+        with open(fn, 'rb') as f:
+            self.__buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, num_files, num_tests,
+         self.__off_files, self.__off_tests, self.__off_entries,
+         self.__off_postings, self.__off_lines, self.__off_covered,
+         self.__off_strings, size, _) = _HEADER.unpack_from(self.__buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("not a coverage database: {}".format(fn))
+        if size != len(self.__buffer):
+            self.close()
+            raise ValueError("truncated coverage database: {}".format(fn))
+
+        self.__num_files = num_files
+        self.__num_tests = num_tests
+        self.__file_names = []  # type: List[str]
+        for i in range(num_files):
+            offset = self.__off_files + i * _FILE.size
+            name_off, name_len, _, _, _, _ = \
+                _FILE.unpack_from(self.__buffer, offset)
+            self.__file_names.append(self._string(name_off, name_len))
+        self.__test_names = []  # type: List[str]
+        for i in range(num_tests):
+            offset = self.__off_tests + i * _TEST.size
+            name_off, name_len, _, _, _, _ = \
+                _TEST.unpack_from(self.__buffer, offset)
+            self.__test_names.append(self._string(name_off, name_len))
+        self.__file_to_index = \
+            {name: i for (i, name) in enumerate(self.__file_names)}
+        self.__test_to_index = \
+            {name: i for (i, name) in enumerate(self.__test_names)}
+
+    def close(self) -> None:
+        """
+        Unmaps the underlying database file.
+        """
+        self.__buffer.close()
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self.__off_strings + offset
+        return self.__buffer[start:start + length].decode('utf-8')
+
+    def _uint32s(self, section: int, start: int, count: int) -> List[int]:
+        offset = section + start * _UINT32.size
+        return list(struct.unpack_from('<{}I'.format(count),
+                                       self.__buffer, offset))
+
+    def _test_record(self, test: str) -> Tuple[int, ...]:
+        index = self.__test_to_index[test]
+        return _TEST.unpack_from(self.__buffer,
+                                 self.__off_tests + index * _TEST.size)
+
+    def _entries(self, test: str) -> Iterator[Tuple[int, int, int]]:
+        _, _, _, _, start, count = self._test_record(test)
+        for i in range(start, start + count):
+            yield _ENTRY.unpack_from(self.__buffer,
+                                     self.__off_entries + i * _ENTRY.size)
+
+    @property
+    def filename(self) -> str:
+        """
+        The path to the underlying database file.
+        """
+        return self.__filename
+
+    @property
+    def tests(self) -> List[str]:
+        """
+        The names of the tests contained in this database, in sorted order.
+        """
+        return list(self.__test_names)
+
+    @property
+    def files(self) -> List[str]:
+        """
+        The names of the files covered by at least one test, in sorted order.
+        """
+        return list(self.__file_names)
+
+    def __len__(self) -> int:
+        return self.__num_tests
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__test_names)
+
+    def __contains__(self, test: str) -> bool:
+        return test in self.__test_to_index
+
+    def outcome(self, test: str) -> TestOutcome:
+        """
+        Returns the outcome of a given test.
+        """
+        _, _, offset, length, _, _ = self._test_record(test)
+        return TestOutcome.from_dict(json.loads(self._string(offset, length)))
+
+    def files_covered_by(self, test: str) -> List[str]:
+        """
+        Returns the names of the files that are covered by a given test.
+        """
+        return [self.__file_names[i] for (i, _, _) in self._entries(test)]
+
+    def lines_covered_by(self, test: str, filename: str) -> List[int]:
+        """
+        Returns a sorted list of the lines within a given file that are
+        covered by a given test.
+        """
+        index = self.__file_to_index.get(filename)
+        if index is None:
+            return []
+        for (file_index, start, count) in self._entries(test):
+            if file_index == index:
+                return self._uint32s(self.__off_lines, start, count)
+        return []
+
+    def tests_covering_file(self, filename: str) -> List[str]:
+        """
+        Returns the names of the tests that cover at least one line within a
+        given file.
+        """
+        index = self.__file_to_index.get(filename)
+        if index is None:
+            return []
+        offset = self.__off_files + index * _FILE.size
+        _, _, start, count, _, _ = _FILE.unpack_from(self.__buffer, offset)
+        return [self.__test_names[i]
+                for i in self._uint32s(self.__off_postings, start, count)]
+
+    def lines_in_file(self, filename: str) -> List[int]:
+        """
+        Returns a sorted list of the lines within a given file that are
+        covered by at least one test.
+        """
+        index = self.__file_to_index.get(filename)
+        if index is None:
+            return []
+        offset = self.__off_files + index * _FILE.size
+        _, _, _, _, start, count = _FILE.unpack_from(self.__buffer, offset)
+        return self._uint32s(self.__off_covered, start, count)
+
+    def lines(self, files: Optional[Iterable[str]] = None) -> FileLineSet:
+        """
+        Returns the set of lines that are covered by at least one test,
+        without decoding the coverage for individual tests.
+
+        Parameters:
+            files: if specified, restricts the lines to this set of files.
+        """
+        if files is None:
+            files = self.__file_names
+        return FileLineSet.from_dict({fn: self.lines_in_file(fn)
+                                      for fn in files
+                                      if fn in self.__file_to_index})
+
+    def coverage(self,
+                 test: str,
+                 files: Optional[Set[str]] = None
+                 ) -> TestCoverage:
+        """
+        Decodes the coverage for a given test.
+
+        Parameters:
+            test: the name of the test.
+            files: if specified, restricts the coverage to this set of files.
+        """
+        file_to_lines = {}  # type: Dict[str, List[int]]
+        for (file_index, start, count) in self._entries(test):
+            filename = self.__file_names[file_index]
+            if files is not None and filename not in files:
+                continue
+            file_to_lines[filename] = \
+                self._uint32s(self.__off_lines, start, count)
+        return TestCoverage(test,
+                            self.outcome(test),
+                            FileLineSet.from_dict(file_to_lines))
+
+    def to_coverage(self,
+                    files: Optional[Iterable[str]] = None
+                    ) -> TestSuiteCoverage:
+        """
+        Returns a view of this database as a test suite coverage report.
+        Coverage for each test is decoded when it is first accessed.
+
+        Parameters:
+            files: if specified, restricts the report to this set of files.
+        """
+        if files is not None:
+            files = set(files)
+        return TestSuiteCoverage(_LazyCoverageMapping(self, files))
+
+
+class _LazyCoverageMapping(Mapping):
+    """
+    A read-only mapping from test names to their coverage that decodes (and
+    memoises) coverage for each test on first access.
+    """
+    def __init__(self,
+                 db: CoverageDatabase,
+                 files: Optional[Set[str]]
+                 ) -> None:
+        self.__db = db
+        self.__files = files
+        self.__cache = {}  # type: Dict[str, TestCoverage]
+
+    def __getitem__(self, test: str) -> TestCoverage:
+        try:
+            return self.__cache[test]
+        except KeyError:
+            pass
+        if test not in self.__db:
+            raise KeyError(test)
+        coverage = self.__db.coverage(test, self.__files)
+        self.__cache[test] = coverage
+        return coverage
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__db)
+
+    def __len__(self) -> int:
+        return len(self.__db)
+
+    def __contains__(self, test: object) -> bool:
+        return test in self.__db
+
@@ -0,0 +1,161 @@
+"""
+This module provides an inverted index over test suite coverage, mapping each
+covered line and file to the set of tests that cover it.
+"""
+from typing import Dict, Set, FrozenSet, Iterable, Iterator, List, \
+                   Optional, Callable
+import logging
+
+from bugzoo.core.fileline import FileLine
+from bugzoo.core.coverage import TestSuiteCoverage
+
+from .coveragedb import CoverageDatabase
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['CoverageIndex']
+
+
+class CoverageIndex(object):
+    """
+    Maps source code lines, and files, to the names of the tests that cover
+    them. Lines may be given as any object with `filename` and `num`
+    attributes (e.g., BugZoo and boggart file lines).
+
+    The tests that cover each line of a file are loaded when that file is
+    first queried, and are kept for the lifetime of the index.
+    """
+    @staticmethod
+    def from_coverage(coverage: TestSuiteCoverage) -> 'CoverageIndex':
+        """
+        Builds an inverted index from a given test suite coverage report.
+        """
+        file_to_lines = {}  # type: Dict[str, Dict[int, Set[str]]]
+        file_to_tests = {}  # type: Dict[str, Set[str]]
+        for test in coverage:
+            for line in coverage[test].lines:
+                lines = file_to_lines.setdefault(line.filename, {})
+                lines.setdefault(line.num, set()).add(test)
+                file_to_tests.setdefault(line.filename, set()).add(test)
+        return CoverageIndex(file_to_tests,
+                             lambda filename: file_to_lines.get(filename, {}))
+
+    @staticmethod
+    def from_database(db: CoverageDatabase,
+                      files: Optional[Iterable[str]] = None
+                      ) -> 'CoverageIndex':
+        """
+        Builds an inverted index from the per-file postings of a given
+        coverage database, without decoding the coverage for each test.
+        When a file is first queried, only the coverage of the tests that
+        cover that file, within that file, is read from the database.
+
+        Parameters:
+            db: the coverage database.
+            files: if specified, restricts the index to this set of files.
+        """
+        if files is None:
+            files = db.files
+        file_to_tests = {}  # type: Dict[str, Set[str]]
+        for filename in files:
+            tests = db.tests_covering_file(filename)
+            if tests:
+                file_to_tests[filename] = set(tests)
+
+        def load(filename: str) -> Dict[int, Set[str]]:
+            line_to_tests = {}  # type: Dict[int, Set[str]]
+            for test in file_to_tests.get(filename, ()):
+                for num in db.lines_covered_by(test, filename):
+                    line_to_tests.setdefault(num, set()).add(test)
+            return line_to_tests
+
+        return CoverageIndex(file_to_tests, load)
+
+    def __init__(self,
+                 file_to_tests: Dict[str, Set[str]],
+                 load_lines: Callable[[str], Dict[int, Set[str]]]
+                 ) -> None:
+        """
+        Constructs a new index.
+
+        Parameters:
+            file_to_tests: maps each covered file to the names of the tests
+                that cover it.
+            load_lines: given the name of a covered file, returns a mapping
+                from each covered line number in that file to the names of
+                the tests that cover it.
+        """
+        self.__file_to_tests = \
+            {k: frozenset(v) for (k, v) in file_to_tests.items()}  # type: Dict[str, FrozenSet[str]]  # noqa: pycodestyle
+        self.__load_lines = load_lines
+        self.__file_to_lines = {}  # type: Dict[str, Dict[int, FrozenSet[str]]]  # noqa: pycodestyle
+
+    def _lines(self, filename: str) -> Dict[int, FrozenSet[str]]:
+        """
+        Returns a mapping from each covered line in a given file to the names
+        of the tests that cover it, loading it if necessary.
+        """
+        try:
+            return self.__file_to_lines[filename]
+        except KeyError:
+            pass
+        if filename in self.__file_to_tests:
+            line_to_tests = {k: frozenset(v) for (k, v)
+                             in self.__load_lines(filename).items()}
+        else:
+            line_to_tests = {}
+        self.__file_to_lines[filename] = line_to_tests
+        return line_to_tests
+
+    def __len__(self) -> int:
+        """
+        Returns the number of lines that are covered by at least one test.
+        The lines of every file are loaded.
+        """
+        return sum(len(self._lines(fn)) for fn in self.__file_to_tests)
+
+    def __iter__(self) -> Iterator[FileLine]:
+        """
+        Returns an iterator over the lines that are covered by at least one
+        test. The lines of every file are loaded.
+        """
+        for filename in self.__file_to_tests:
+            for num in self._lines(filename):
+                yield FileLine(filename, num)
+
+    def __contains__(self, line: FileLine) -> bool:
+        """
+        Determines whether a given line is covered by at least one test.
+        """
+        return line.num in self._lines(line.filename)
+
+    @property
+    def files(self) -> List[str]:
+        """
+        The names of the files that are covered by at least one test.
+        """
+        return list(self.__file_to_tests)
+
+    def tests_covering_line(self, line: FileLine) -> FrozenSet[str]:
+        """
+        Returns the names of the tests that cover a given line.
+        """
+        return self._lines(line.filename).get(line.num, frozenset())
+
+    def tests_covering_lines(self, lines: Iterable[FileLine]) -> Set[str]:
+        """
+        Returns the names of the tests that cover at least one of the given
+        lines.
+        """
+        tests = set()  # type: Set[str]
+        for line in lines:
+            tests |= self.tests_covering_line(line)
+        return tests
+
+    def tests_covering_file(self, filename: str) -> FrozenSet[str]:
+        """
+        Returns the names of the tests that cover at least one line in a given
+        file.
+        """
+        return self.__file_to_tests.get(filename, frozenset())
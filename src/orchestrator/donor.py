@@ -1,8 +1,12 @@
-from typing import List, Dict, Any, Tuple, Callable, Optional
+from typing import List, Dict, Any, Tuple, Callable, Optional, Iterable, \
+                   Iterator
+import argparse
+import concurrent.futures
 import logging
 import json
 import sys
 import functools
+import hashlib
 import os
 
 import rooibos
@@ -17,7 +21,8 @@ from boggart.core import FileLocationRange, Location, LocationRange
 from boggart.core.constraint import Constraint, IsSingleTerm, PrecededBy
 
 from .snapshot import fetch_baseline_snapshot
-from .coverage import load_baseline_coverage
+from .coverage import load_baseline_lines
+from .cache import CACHE_DIR, DiskCache
 
 logger = logging.getLogger(__name__)  # type: logger.Logging
 logger.setLevel(logging.DEBUG)
@@ -26,11 +31,100 @@ logger.setLevel(logging.DEBUG)
 DONOR_POOL_FN = os.path.join(os.path.dirname(__file__),
                              'data/snippets.json')
 
+# the maximum size of the cache of compact donor pools, given in bytes
+DONOR_POOL_CACHE_SIZE = 64 * 1024 * 1024
+
+# bumped whenever the compact form of the donor pool is changed
+DONOR_POOL_COMPACT_VERSION = 1
+
+# the default number of files that are searched for snippets at once
+DONOR_EXTRACTION_THREADS = 8
+
+# bumped whenever the format of the donor pool manifest is changed
+DONOR_POOL_MANIFEST_VERSION = 1
+
+__DONOR_POOL = None  # type: Optional[DonorPool]
+
+
+def _digest_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _manifest_fn(fn_pool: str) -> str:
+    return '{}.manifest.json'.format(os.path.splitext(fn_pool)[0])
+
+
+def _load_previous_pool(fn_pool: str,
+                        digests: Dict[str, str]
+                        ) -> Tuple[SnippetDatabase, List[str]]:
+    """
+    Loads the snippets from a previously extracted donor pool that were taken
+    from files whose contents have not changed since that pool was built.
+
+    Parameters:
+        fn_pool: the path to the previously extracted pool.
+        digests: a mapping from the name of each file in the program to the
+            SHA-256 digest of its current contents.
+
+    Returns:
+        a tuple of the form `(snippets, changed)`, where `snippets` holds the
+        snippets that may be reused, and `changed` lists the files whose
+        snippets must be extracted.
+    """
+    snippets = SnippetDatabase()
+    fn_manifest = _manifest_fn(fn_pool)
+    if not os.path.exists(fn_pool) or not os.path.exists(fn_manifest):
+        return snippets, list(digests)
+
+    try:
+        with open(fn_manifest, 'r') as f:
+            manifest = json.load(f)
+        with open(fn_pool, 'r') as f:
+            previous = SnippetDatabase.from_dict(json.load(f))
+    except (OSError, ValueError):
+        logger.exception("failed to load previous donor pool: %s", fn_pool)
+        return snippets, list(digests)
+    if manifest.get('version') != DONOR_POOL_MANIFEST_VERSION:
+        logger.warning("ignoring donor pool manifest with unsupported version: %s",  # noqa: pycodestyle
+                       fn_manifest)
+        return snippets, list(digests)
+
+    old_digests = manifest['files']
+    unchanged = set(fn for (fn, digest) in digests.items()
+                    if old_digests.get(fn) == digest)
+    for snippet in previous:
+        for location in snippet.locations:
+            if location.filename in unchanged:
+                snippets.add(snippet.content,
+                             origin=location,
+                             kind=snippet.kind,
+                             reads=list(snippet.reads))
+    changed = [fn for fn in digests if fn not in unchanged]
+    logger.info("reusing snippets from %d unchanged files", len(unchanged))
+    return snippets, changed
+
 
 def extract() -> None:
+    """
+    Extracts the donor pool for Baseline A and writes it, together with a
+    manifest of the digests of the files from which it was extracted, to
+    disk. If a previously extracted pool and its manifest exist, snippets
+    are only extracted from those files that have changed since.
+    """
+    parser = argparse.ArgumentParser(
+        description="Extracts a donor pool from Baseline A.")
+    parser.add_argument('--output', default='transformer-snippets.json',
+                        help="the file to which the pool should be written.")
+    parser.add_argument('--threads', type=int,
+                        default=DONOR_EXTRACTION_THREADS,
+                        help="the number of files to search concurrently.")
+    parser.add_argument('--full', action='store_true',
+                        help="ignores any previously extracted pool.")
+    args = parser.parse_args()
+    fn = args.output
+
     with rooibos.ephemeral_server() as client_rooibos:
-        coverage = load_baseline_coverage()
-        files = list(coverage.lines.files)
+        files = list(load_baseline_lines().files)
 
         logger.info("storing contents of source files")
         with bugzoo.server.ephemeral() as client_bugzoo:
@@ -42,25 +136,191 @@ def extract() -> None:
                                      files)
         logger.info("stored contents of source files")
 
-        snippets = SnippetDatabase()
-        build_transformer_pool(client_rooibos, sources, snippets)
-        fn = 'transformer-snippets.json'
+        digests = {f: _digest_text(sources.read_file(f)) for f in files}
+        if args.full:
+            snippets, changed = SnippetDatabase(), files
+        else:
+            snippets, changed = _load_previous_pool(fn, digests)
+        logger.info("extracting snippets from %d files", len(changed))
+        build_transformer_pool(client_rooibos, sources, snippets,
+                               files=changed,
+                               threads=args.threads)
+
         logger.info("writing donor pool to file: %s", fn)
         with open(fn, 'w') as f:
             json.dump(snippets.to_dict(), f, indent=2)
+        with open(_manifest_fn(fn), 'w') as f:
+            json.dump({'version': DONOR_POOL_MANIFEST_VERSION,
+                       'files': digests}, f, indent=2, sort_keys=True)
         logger.info("wrote donor pool to file: %s", fn)
 
 
-def load_pool() -> None:
-    with open(DONOR_POOL_FN, 'r') as f:
-        jsn = json.load(f)
-    snippets = SnippetDatabase.from_dict(jsn)
-    return snippets
+class DonorPool(object):
+    """
+    An immutable pool of donor snippets, indexed by their kind, the files
+    from which they were taken, and the variables that they read.
+    Provides the same `in_file` and iteration interface as a
+    `SnippetDatabase`.
+    """
+    @staticmethod
+    def from_compact(d: Dict[str, Any]) -> 'DonorPool':
+        """
+        Loads a donor pool from its compact form.
+
+        Raises:
+            ValueError: if the given compact form uses an unsupported version.
+        """
+        if d.get('version') != DONOR_POOL_COMPACT_VERSION:
+            raise ValueError("unsupported donor pool version: {}".format(
+                d.get('version')))
+        files = d['files']
+        kinds = d['kinds']
+        snippets = []  # type: List[Snippet]
+        for (content, kind, reads, locations) in d['snippets']:
+            snippet = Snippet(content,
+                              kinds[kind] if kind >= 0 else None,
+                              reads)
+            for (fn, l_start, c_start, l_stop, c_stop) in locations:
+                loc_range = LocationRange(Location(l_start, c_start),
+                                          Location(l_stop, c_stop))
+                snippet.locations.add(FileLocationRange(files[fn], loc_range))
+            snippets.append(snippet)
+        return DonorPool(snippets)
+
+    def __init__(self, snippets: Iterable[Snippet]) -> None:
+        self.__snippets = {}  # type: Dict[str, Snippet]
+        self.__by_kind = {}  # type: Dict[Optional[str], List[Snippet]]
+        self.__by_file = {}  # type: Dict[str, List[Snippet]]
+        self.__by_read = {}  # type: Dict[str, List[Snippet]]
+        for snippet in snippets:
+            if snippet.content in self.__snippets:
+                continue
+            self.__snippets[snippet.content] = snippet
+            self.__by_kind.setdefault(snippet.kind, []).append(snippet)
+            for fn in set(l.filename for l in snippet.locations):
+                self.__by_file.setdefault(fn, []).append(snippet)
+            for var in snippet.reads:
+                self.__by_read.setdefault(var, []).append(snippet)
+
+    def __iter__(self) -> Iterator[Snippet]:
+        yield from self.__snippets.values()
+
+    def __len__(self) -> int:
+        return len(self.__snippets)
+
+    @property
+    def files(self) -> List[str]:
+        """
+        The names of the files from which snippets were taken.
+        """
+        return list(self.__by_file)
+
+    @property
+    def kinds(self) -> List[Optional[str]]:
+        return list(self.__by_kind)
+
+    def in_file(self, fn: str) -> Iterator[Snippet]:
+        """
+        Returns an iterator over the snippets that were taken from a given
+        file.
+        """
+        yield from self.__by_file.get(fn, [])
+
+    def of_kind(self, kind: Optional[str]) -> Iterator[Snippet]:
+        """
+        Returns an iterator over the snippets of a given kind.
+        """
+        yield from self.__by_kind.get(kind, [])
+
+    def reading(self, var: str) -> Iterator[Snippet]:
+        """
+        Returns an iterator over the snippets that read a given variable.
+        """
+        yield from self.__by_read.get(var, [])
+
+    def restricted_to_files(self, files: Iterable[str]) -> SnippetDatabase:
+        """
+        Returns a snippet database that contains only those snippets that
+        were taken from a given set of files.
+        """
+        snippets = {}  # type: Dict[str, Snippet]
+        for fn in files:
+            for snippet in self.__by_file.get(fn, []):
+                snippets[snippet.content] = snippet
+        return SnippetDatabase(snippets.values())
+
+    def to_compact(self) -> Dict[str, Any]:
+        """
+        Produces a compact, JSON-serialisable form of this pool, in which
+        file names and kinds are interned and locations are stored as
+        integer tuples, avoiding the need to parse location strings.
+        """
+        files = {}  # type: Dict[str, int]
+        kinds = {}  # type: Dict[str, int]
+        snippets = []
+        for snippet in self:
+            if snippet.kind is None:
+                kind = -1
+            else:
+                kind = kinds.setdefault(snippet.kind, len(kinds))
+            locations = \
+                [[files.setdefault(l.filename, len(files)),
+                  l.start.line, l.start.col, l.stop.line, l.stop.col]
+                 for l in sorted(snippet.locations, key=str)]
+            snippets.append([snippet.content,
+                             kind,
+                             sorted(snippet.reads),
+                             locations])
+        return {'version': DONOR_POOL_COMPACT_VERSION,
+                'files': sorted(files, key=files.get),
+                'kinds': sorted(kinds, key=kinds.get),
+                'snippets': snippets}
+
+
+def _load_pool_from_file(fn: str) -> DonorPool:
+    """
+    Loads a donor pool from a given JSON file, using a cached compact copy
+    of that file if one is available.
+    """
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        contents = f.read()
+    h.update(contents)
+    cache = DiskCache(os.path.join(CACHE_DIR, 'donors'), DONOR_POOL_CACHE_SIZE)
+    key = DiskCache.key(DONOR_POOL_COMPACT_VERSION, h.hexdigest())
+    compact = cache.get(key)
+    if compact is not None:
+        try:
+            return DonorPool.from_compact(compact)
+        except (ValueError, KeyError, TypeError):
+            logger.exception("ignoring malformed compact donor pool")
+
+    jsn = json.loads(contents.decode('utf-8'))
+    pool = DonorPool(SnippetDatabase.from_dict(jsn))
+    cache.put(key, pool.to_compact())
+    return pool
+
+
+def load_pool() -> DonorPool:
+    """
+    Returns the donor pool for Baseline A. The pool is loaded once per
+    process.
+    """
+    global __DONOR_POOL
+    if __DONOR_POOL:
+        return __DONOR_POOL
+    logger.debug("loading donor pool: %s", DONOR_POOL_FN)
+    __DONOR_POOL = _load_pool_from_file(DONOR_POOL_FN)
+    logger.debug("loaded donor pool: %d snippets", len(__DONOR_POOL))
+    return __DONOR_POOL
 
 
 def build_transformer_pool(client_rooibos: RooibosClient,
                            sources: ProgramSourceManager,
-                           snippets: SnippetDatabase
+                           snippets: SnippetDatabase,
+                           *,
+                           files: Optional[List[str]] = None,
+                           threads: int = DONOR_EXTRACTION_THREADS
                            ) -> None:
     constraints = [
         IsSingleTerm('1'),
@@ -76,7 +336,68 @@ def build_transformer_pool(client_rooibos: RooibosClient,
         return (content, location, reads)
     _build_pool(client_rooibos, sources, snippets, schema, transformer,
                 constraints=constraints,
-                kind='transformer')
+                kind='transformer',
+                files=files,
+                threads=threads)
+
+
+def _line_offsets(content: str) -> List[int]:
+    """
+    Returns a list specifying the offset of the first character on each line
+    of a given source text.
+    """
+    offsets = [0]
+    offset = content.find('\n')
+    while offset != -1:
+        offsets.append(offset + 1)
+        offset = content.find('\n', offset + 1)
+    return offsets
+
+
+def _find_snippets(client_rooibos: RooibosClient,
+                   filename: str,
+                   file_content: str,
+                   schema: str,
+                   transformer: Callable[[rooibos.Match], Tuple[str, rooibos.LocationRange, List[str]]],  # noqa: pycodestyle
+                   constraints: List[Constraint]
+                   ) -> List[Tuple[str, FileLocationRange, List[str]]]:
+    """
+    Finds all snippets within a given file.
+
+    Returns:
+        a list of `(content, location, reads)` tuples for each snippet.
+    """
+    offsets = _line_offsets(file_content)
+
+    def check_constraints(match: rooibos.Match) -> bool:
+        loc_start = match.location.start
+        loc_stop = match.location.stop
+        offset_start = offsets[loc_start.line - 1] + loc_start.col
+        offset_stop = offsets[loc_stop.line - 1] + loc_stop.col
+        for c in constraints:
+            sat = c.is_satisfied_by(match, file_content, offset_start, offset_stop)  # noqa: pycodestyle
+            if not sat:
+                return False
+        return True
+
+    logger.info("finding snippets in file: %s", filename)
+    found = []  # type: List[Tuple[str, FileLocationRange, List[str]]]
+    for match in client_rooibos.matches(file_content, schema):
+        if not check_constraints(match):
+            continue
+
+        snippet_content, loc_range_rooibos, reads = transformer(match)
+        loc_start = Location(loc_range_rooibos.start.line,
+                             loc_range_rooibos.start.col)
+        loc_stop = Location(loc_range_rooibos.stop.line,
+                            loc_range_rooibos.stop.col)
+        loc_range = LocationRange(loc_start, loc_stop)
+        snippet_location = FileLocationRange(filename, loc_range)
+        found.append((snippet_content, snippet_location, reads))
+        logger.debug("found snippet in file (%s): %s",
+                     filename, snippet_content)
+    logger.info("found all snippets in file: %s", filename)
+    return found
 
 
 def _build_pool(client_rooibos: RooibosClient,
@@ -86,50 +407,36 @@ def _build_pool(client_rooibos: RooibosClient,
                 transformer: Callable[[rooibos.Match], Tuple[str, rooibos.LocationRange, List[str]]],
                 *,
                 constraints: Optional[List[Constraint]] = None,
-                kind: Optional[str] = None
+                kind: Optional[str] = None,
+                files: Optional[List[str]] = None,
+                threads: int = DONOR_EXTRACTION_THREADS
                 ) -> None:
-    # build a constraint checker
+    """
+    Adds the snippets that match a given schema to a snippet database.
+    Files are searched concurrently; their snippets are added to the
+    database in the order in which the files are given.
+
+    Parameters:
+        files: the files that should be searched. If None, all files known
+            to the source manager are searched.
+        threads: the maximum number of files that may be searched at once.
+    """
+    assert threads > 0
     if constraints is None:
         constraints = []
-
-    def check_constraints(match: rooibos.Match, filename: str) -> bool:
-        file_content = sources.read_file(filename)
-        get_offset = \
-            lambda line, col: sources.line_col_to_offset(filename, line, col)
-
-        loc_start = match.location.start
-        loc_stop = match.location.stop
-
-        offset_start = get_offset(loc_start.line, loc_start.col)
-        offset_stop = get_offset(loc_start.line, loc_start.col)
-
-        for c in constraints:
-            sat = c.is_satisfied_by(match, file_content, offset_start, offset_stop)
-            if not sat:
-                return False
-
-        return True
+    if files is None:
+        files = list(sources.files)
 
     logger.info("finding snippets")
-    for fn in sources.files:
-        file_content = sources.read_file(fn)
-        logger.info("finding snippets in file: %s", fn)
-        for match in client_rooibos.matches(file_content, schema):
-            if not check_constraints(match, fn):
-                continue
-
-            snippet_content, loc_range_rooibos, reads = transformer(match)
-            loc_start = Location(loc_range_rooibos.start.line,
-                                 loc_range_rooibos.start.col)
-            loc_stop = Location(loc_range_rooibos.stop.line,
-                                 loc_range_rooibos.stop.col)
-            loc_range = LocationRange(loc_start, loc_stop)
-            snippet_location = FileLocationRange(fn, loc_range)
-            snippets.add(snippet_content,
-                         origin=snippet_location,
-                         kind=kind,
-                         reads=reads)
-            logger.info("found snippet in file (%s): %s",
-                        fn, snippet_content)
-        logger.info("found all snippets in file: %s", fn)
+    contents = [(fn, sources.read_file(fn)) for fn in files]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:  # noqa: pycodestyle
+        futures = [executor.submit(_find_snippets, client_rooibos, fn,
+                                   content, schema, transformer, constraints)
+                   for (fn, content) in contents]
+        for future in futures:
+            for (content, location, reads) in future.result():
+                snippets.add(content,
+                             origin=location,
+                             kind=kind,
+                             reads=reads)
     logger.info("found %d snippets", len(snippets))
@@ -9,6 +9,7 @@ __all__ = [
     'PerturbationFailure',
     'NeutralPerturbation',
     'FailedToComputeCoverage',
+    'PerturbationCancelled',
     'NotReadyToPerturb',
     'NotReadyToAdapt',
     'FileNotFound',
@@ -78,6 +79,15 @@ class FailedToComputeCoverage(PerturbationFailure):
         return self._to_response("invalid perturbation: failed to obtain coverage information.")
 
 
+class PerturbationCancelled(PerturbationFailure):
+    """
+    Indicates that the injection of a perturbation was cancelled before it
+    could finish.
+    """
+    def to_response(self) -> flask.Response:
+        return self._to_response("perturbation was cancelled.", code=409)
+
+
 # FIXME replace with AlreadyPerturbed and AlreadyStartedAdaptation
 class NotReadyToPerturb(OrchestratorError):
     """
@@ -0,0 +1,663 @@
+"""
+This module provides in-process stand-ins for the BugZoo, boggart and rooibos
+clients. Rather than talking to a server, each stand-in replays a recording
+of the responses that a server would give, after waiting for a configurable
+amount of time. Together, they allow the orchestrator to be exercised (e.g.,
+benchmarked) on a host without Docker or any of those servers.
+"""
+from typing import Dict, List, Set, Optional, Iterator, Iterable, Any
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+import rooibos
+from bugzoo.cmd import ExecResponse
+from bugzoo.core.bug import Bug as Snapshot
+from bugzoo.core.container import Container
+from bugzoo.core.fileline import FileLine, FileLineSet
+from bugzoo.core.patch import Patch
+from bugzoo.core.test import TestCase, TestOutcome
+from boggart import Mutation
+from boggart.core.mutant import Mutant
+from boggart.core.replacement import Replacement
+from boggart.core import FileLocationRange, Location, LocationRange
+
+from .coverage import load_baseline_coverage, load_baseline_lines, \
+                      load_baseline_index
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['Latencies', 'Recording', 'FakeBugZoo', 'FakeBoggart',
+           'FakeRooibos']
+
+# bumped whenever the format of recordings is changed
+RECORDING_VERSION = 1
+
+# the default time, in seconds, taken by each kind of request
+DEFAULT_LATENCIES = {
+    'provision': 2.0,
+    'destroy': 0.5,
+    'test': None,  # use the duration recorded for each test
+    'extract_coverage': 1.0,
+    'exec': 0.1,
+    'build': 30.0,
+    'read': 0.05,
+    'mutate': 5.0,
+    'mutations': 0.5,
+    'matches': 0.05
+}  # type: Dict[str, Optional[float]]
+
+# maps each static analysis tool to the name of the file that it writes
+ANALYSIS_OUTPUTS = {
+    'kaskara-loop-finder': 'loops.json',
+    'kaskara-function-scanner': 'functions.json',
+    'kaskara-insertion-point-finder': 'insertion-points.json'
+}
+
+
+def _mutation_key(mutation: Mutation) -> str:
+    return json.dumps(mutation.to_dict(), sort_keys=True)
+
+
+class Latencies(object):
+    """
+    Decides how long each simulated request should take, and counts the
+    number of requests of each kind.
+    """
+    def __init__(self,
+                 overrides: Optional[Dict[str, float]] = None,
+                 *,
+                 scale: float = 1.0,
+                 jitter: float = 0.0,
+                 seed: int = 0
+                 ) -> None:
+        """
+        Constructs a new latency model.
+
+        Parameters:
+            overrides: a mapping from kinds of request (e.g., 'provision') to
+                the number of seconds that they should take, replacing the
+                defaults given by `DEFAULT_LATENCIES`.
+            scale: a factor applied to every latency, allowing a run to be
+                compressed (e.g., 0.01) while preserving relative costs.
+            jitter: the maximum relative amount by which each latency may
+                randomly deviate from its mean.
+            seed: the seed for the random number generator used for jitter.
+        """
+        assert scale >= 0
+        assert 0 <= jitter < 1
+        for kind in (overrides or {}):
+            if kind not in DEFAULT_LATENCIES:
+                raise ValueError("unknown kind of request: {}".format(kind))
+        self.__latencies = dict(DEFAULT_LATENCIES)
+        self.__latencies.update(overrides or {})
+        self.__scale = scale
+        self.__jitter = jitter
+        self.__rng = random.Random(seed)
+        self.__counts = {}  # type: Dict[str, int]
+        self.__lock = threading.Lock()
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """
+        The number of requests of each kind that have been simulated.
+        """
+        with self.__lock:
+            return dict(self.__counts)
+
+    def delay(self, kind: str, recorded: Optional[float] = None) -> float:
+        """
+        Waits for the time taken by a single request of a given kind.
+
+        Parameters:
+            kind: the kind of request.
+            recorded: the duration that was recorded for this particular
+                request, if any. Used when no latency is configured for
+                requests of this kind.
+
+        Returns:
+            the number of seconds that were spent waiting (i.e., the scaled
+            duration of the simulated request), which is reported as the
+            duration of the request so that the phase timings of the
+            orchestrator are consistent with the time that has elapsed.
+        """
+        seconds = self.__latencies[kind]
+        if seconds is None:
+            seconds = recorded or 0.0
+        with self.__lock:
+            self.__counts[kind] = self.__counts.get(kind, 0) + 1
+            if self.__jitter:
+                seconds *= self.__rng.uniform(1 - self.__jitter,
+                                              1 + self.__jitter)
+        seconds *= self.__scale
+        if seconds > 0:
+            time.sleep(seconds)
+        return seconds
+
+
+class Recording(object):
+    """
+    Describes the responses that the BugZoo, boggart and rooibos servers
+    gave (or would give) for the baseline system. A recording contains:
+
+    * the contents of each source file that may be perturbed;
+    * the perturbations that boggart produces for each of those files;
+    * the tests that are failed by each perturbation;
+    * the raw output of each static analysis tool for each file; and
+    * the matches that rooibos finds for each template that contains holes.
+
+    Coverage and test durations are taken from the baseline coverage report.
+    """
+    @staticmethod
+    def from_file(fn: str) -> 'Recording':
+        with open(fn, 'r') as f:
+            return Recording.from_dict(json.load(f))
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> 'Recording':
+        """
+        Raises:
+            ValueError: if the recording uses an unsupported version.
+        """
+        if d.get('version') != RECORDING_VERSION:
+            raise ValueError("unsupported recording version: {}".format(
+                d.get('version')))
+        mutations = {fn: [Mutation.from_dict(m) for m in ms]
+                     for (fn, ms) in d['mutations'].items()}
+        return Recording(files=d['files'],
+                         mutations=mutations,
+                         kills=d.get('kills', {}),
+                         analysis=d.get('analysis', {}),
+                         matches=d.get('matches', {}))
+
+    @staticmethod
+    def synthesize(*,
+                   num_files: int = 5,
+                   mutations_per_file: int = 20,
+                   kill_ratio: float = 0.8,
+                   source_dir: str = '/ros_ws',
+                   seed: int = 0
+                   ) -> 'Recording':
+        """
+        Synthesizes a recording for a sample of the files that are covered by
+        the baseline test suite. Each covered line in a sampled file holds a
+        boolean expression that may be flipped, and each sampled file forms
+        the body of a single void function. A given fraction of the
+        perturbations are killed by the first test that covers them.
+
+        Parameters:
+            num_files: the number of files that should be sampled.
+            mutations_per_file: the maximum number of perturbations that
+                should be recorded for each file.
+            kill_ratio: the fraction of perturbations that are killed.
+            source_dir: the absolute path to the source directory of the
+                baseline snapshot, used by the static analysis outputs.
+            seed: the seed for the random number generator.
+        """
+        assert 0 <= kill_ratio <= 1
+        rng = random.Random(seed)
+        lines = load_baseline_lines()
+        index = load_baseline_index()
+        files = sorted(lines.files)
+        files = sorted(rng.sample(files, min(num_files, len(files))))
+
+        statement = "    ok = lhs && rhs;"
+        col = statement.find('&&')
+        contents = {}  # type: Dict[str, str]
+        mutations = {}  # type: Dict[str, List[Mutation]]
+        kills = {}  # type: Dict[str, List[str]]
+        analysis = {out_fn: {} for out_fn in ANALYSIS_OUTPUTS.values()
+                    }  # type: Dict[str, Dict[str, List[Any]]]
+        for (i, fn) in enumerate(files):
+            covered = sorted(l.num for l in lines[fn])
+            num_lines = covered[-1] + 1
+            contents[fn] = '\n'.join([statement] * num_lines) + '\n'
+
+            mutations[fn] = []
+            for num in sorted(rng.sample(covered,
+                                         min(mutations_per_file,
+                                             len(covered)))):
+                location = FileLocationRange(fn,
+                                             LocationRange(Location(num, col),
+                                                           Location(num, col + 2)))  # noqa: pycodestyle
+                mutation = Mutation('flip-boolean-operator', 0, location,
+                                    {'1': 'lhs', '2': 'rhs'})
+                mutations[fn].append(mutation)
+                covering = sorted(index.tests_covering_lines([FileLine(fn, num)]))  # noqa: pycodestyle
+                if covering and rng.random() < kill_ratio:
+                    kills[_mutation_key(mutation)] = covering[:1]
+
+            fn_abs = os.path.join(source_dir, fn)
+            body = '{}@1:0::{}:0'.format(fn_abs, num_lines)
+            analysis['loops.json'][fn] = []
+            analysis['functions.json'][fn] = [{'name': 'synthetic{}'.format(i),
+                                               'location': body,
+                                               'body': body,
+                                               'return-type': 'void',
+                                               'global': True,
+                                               'pure': False}]
+            analysis['insertion-points.json'][fn] = \
+                [{'location': '{}@{}:0'.format(fn_abs, num),
+                  'visible': ['lhs', 'rhs']}
+                 for num in covered]
+
+        return Recording(files=contents,
+                         mutations=mutations,
+                         kills=kills,
+                         analysis=analysis,
+                         matches={})
+
+    def __init__(self,
+                 *,
+                 files: Dict[str, str],
+                 mutations: Dict[str, List[Mutation]],
+                 kills: Dict[str, List[str]],
+                 analysis: Dict[str, Dict[str, List[Any]]],
+                 matches: Dict[str, Dict[str, List[Any]]]
+                 ) -> None:
+        self.__files = files
+        self.__mutations = mutations
+        self.__kills = kills
+        self.__analysis = analysis
+        self.__matches = matches
+
+    @property
+    def files(self) -> List[str]:
+        """
+        The names of the files for which perturbations were recorded.
+        """
+        return sorted(self.__mutations)
+
+    @property
+    def sources(self) -> List[str]:
+        """
+        The names of the files whose contents were recorded.
+        """
+        return sorted(self.__files)
+
+    def read_file(self, filename: str) -> str:
+        """
+        Raises:
+            KeyError: if no contents were recorded for the given file.
+        """
+        return self.__files[filename]
+
+    def mutations(self, filename: str) -> List[Mutation]:
+        """
+        Returns the perturbations that were recorded for a given file.
+        """
+        return list(self.__mutations.get(filename, []))
+
+    def failing_tests(self, mutations: Iterable[Mutation]) -> Set[str]:
+        """
+        Returns the names of the tests that fail after applying a given
+        sequence of perturbations.
+        """
+        failing = set()  # type: Set[str]
+        for mutation in mutations:
+            failing.update(self.__kills.get(_mutation_key(mutation), []))
+        return failing
+
+    def analysis_output(self, out_fn: str, files: Iterable[str]) -> str:
+        """
+        Returns the contents of the output file that a given static analysis
+        tool would produce for a given set of files.
+        """
+        recorded = self.__analysis.get(out_fn, {})
+        entries = []  # type: List[Any]
+        for fn in files:
+            entries += recorded.get(fn, [])
+        return json.dumps(entries)
+
+    def matches(self, template: str, filename: str) -> List[rooibos.Match]:
+        """
+        Returns the matches of a given template in a given file.
+        """
+        recorded = self.__matches.get(template, {}).get(filename, [])
+        return [rooibos.Match.from_dict(m) for m in recorded]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'version': RECORDING_VERSION,
+                'files': self.__files,
+                'mutations': {fn: [m.to_dict() for m in ms]
+                              for (fn, ms) in self.__mutations.items()},
+                'kills': self.__kills,
+                'analysis': self.__analysis,
+                'matches': self.__matches}
+
+    def save(self, fn: str) -> None:
+        with open(fn, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+
+class _FakeBugManager(object):
+    def __init__(self) -> None:
+        self.__snapshots = {}  # type: Dict[str, Snapshot]
+        self.__lock = threading.Lock()
+
+    def register(self, snapshot: Snapshot) -> None:
+        with self.__lock:
+            self.__snapshots[snapshot.name] = snapshot
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__snapshots
+
+    def __getitem__(self, name: str) -> Snapshot:
+        return self.__snapshots[name]
+
+    def __delitem__(self, name: str) -> None:
+        with self.__lock:
+            del self.__snapshots[name]
+
+
+class _FakeContainerManager(object):
+    def __init__(self, client: 'FakeBugZoo') -> None:
+        self.__client = client
+        self.__containers = {}  # type: Dict[str, Container]
+        # the name of the last test that was executed by each container
+        self.__last_test = {}  # type: Dict[str, str]
+        # the output files that have been written inside each container
+        self.__outputs = {}  # type: Dict[str, Dict[str, str]]
+        self.__lock = threading.Lock()
+
+    def outputs(self, container: Container) -> Dict[str, str]:
+        return self.__outputs.get(container.uid, {})
+
+    def provision(self, snapshot: Snapshot) -> Container:
+        self.__client.latencies.delay('provision')
+        container = Container(uid=uuid.uuid4().hex,
+                              bug=snapshot.name,
+                              tools=[])
+        with self.__lock:
+            self.__containers[container.uid] = container
+            self.__outputs[container.uid] = {}
+        return container
+
+    def __delitem__(self, uid: str) -> None:
+        self.__client.latencies.delay('destroy')
+        with self.__lock:
+            del self.__containers[uid]
+            self.__last_test.pop(uid, None)
+            self.__outputs.pop(uid, None)
+
+    def __len__(self) -> int:
+        return len(self.__containers)
+
+    def is_alive(self, container: Container) -> bool:
+        return container.uid in self.__containers
+
+    def exec(self,
+             container: Container,
+             command: str,
+             context: Optional[str] = None,
+             **kwargs: Any
+             ) -> ExecResponse:
+        tool, _, args = command.partition(' ')
+        if tool == 'catkin':
+            duration = self.__client.latencies.delay('build')
+            return ExecResponse(0, duration, '')
+
+        duration = self.__client.latencies.delay('exec')
+        if tool in ANALYSIS_OUTPUTS:
+            out_fn = ANALYSIS_OUTPUTS[tool]
+            output = self.__client.recording.analysis_output(out_fn,
+                                                             args.split())
+            with self.__lock:
+                self.__outputs[container.uid][out_fn] = output
+        return ExecResponse(0, duration, '')
+
+    def patch(self, container: Container, patch: Patch) -> bool:
+        self.__client.latencies.delay('exec')
+        return True
+
+    def test(self, container: Container, test: TestCase) -> TestOutcome:
+        """
+        Simulates the execution of a test. A test fails if, and only if, it
+        was recorded as killing one of the perturbations that were applied
+        to the snapshot for the container. Patches are assumed not to alter
+        the outcome of any test.
+        """
+        recorded = load_baseline_coverage()[test.name].outcome.duration
+        duration = self.__client.latencies.delay('test', recorded)
+        passed = test.name not in self.__client.failing_tests(container.bug)
+        with self.__lock:
+            self.__last_test[container.uid] = test.name
+        return TestOutcome(ExecResponse(0 if passed else 1, duration, ''),
+                           passed)
+
+    def extract_coverage(self, container: Container) -> FileLineSet:
+        """
+        Returns the baseline coverage for the last test that was executed
+        inside a given container. Coverage is restricted to the files whose
+        contents were recorded, since no other files can be read.
+        """
+        self.__client.latencies.delay('extract_coverage')
+        test = self.__last_test.get(container.uid)
+        if test is None:
+            return FileLineSet.from_list([])
+        lines = load_baseline_coverage()[test].lines
+        return lines.restricted_to_files(self.__client.recording.sources)
+
+
+class _FakeFileManager(object):
+    def __init__(self, client: 'FakeBugZoo') -> None:
+        self.__client = client
+
+    def read(self, container: Container, path: str) -> str:
+        """
+        Raises:
+            FileNotFoundError: if the given file was not recorded.
+        """
+        self.__client.latencies.delay('read')
+        outputs = self.__client.containers.outputs(container)
+        if path in outputs:
+            return outputs[path]
+        source_dir = self.__client.bugs[container.bug].source_dir
+        if path.startswith(source_dir):
+            path = os.path.relpath(path, source_dir)
+        try:
+            return self.__client.recording.read_file(path)
+        except KeyError:
+            raise FileNotFoundError(path)
+
+
+class FakeBugZoo(object):
+    """
+    Provides the subset of the BugZoo client interface that is used by the
+    orchestrator, Darjeeling and Kaskara.
+    """
+    def __init__(self, recording: Recording, latencies: Latencies) -> None:
+        self.__recording = recording
+        self.__latencies = latencies
+        self.__bugs = _FakeBugManager()
+        self.__containers = _FakeContainerManager(self)
+        self.__files = _FakeFileManager(self)
+        # the names of the tests that fail for each registered mutant
+        self.__failing = {}  # type: Dict[str, Set[str]]
+
+    @property
+    def recording(self) -> Recording:
+        return self.__recording
+
+    @property
+    def latencies(self) -> Latencies:
+        return self.__latencies
+
+    @property
+    def bugs(self) -> _FakeBugManager:
+        return self.__bugs
+
+    @property
+    def containers(self) -> _FakeContainerManager:
+        return self.__containers
+
+    @property
+    def files(self) -> _FakeFileManager:
+        return self.__files
+
+    def register_mutant(self, snapshot: Snapshot, failing: Set[str]) -> None:
+        self.__bugs.register(snapshot)
+        self.__failing[snapshot.name] = set(failing)
+
+    def deregister_mutant(self, name: str) -> None:
+        del self.__bugs[name]
+        self.__failing.pop(name, None)
+
+    def failing_tests(self, name: str) -> Set[str]:
+        """
+        Returns the names of the tests that fail for a given snapshot.
+        """
+        return self.__failing.get(name, set())
+
+    def shutdown(self) -> None:
+        pass
+
+
+class _FakeOperator(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class _FakeOperatorCollection(object):
+    def __getitem__(self, name: str) -> _FakeOperator:
+        return _FakeOperator(name)
+
+
+class _FakeMutantManager(object):
+    def __init__(self, client: 'FakeBoggart') -> None:
+        self.__client = client
+        self.__mutants = {}  # type: Dict[uuid.UUID, Mutant]
+        self.__lock = threading.Lock()
+
+    def add(self, mutant: Mutant) -> None:
+        with self.__lock:
+            self.__mutants[mutant.uuid] = mutant
+
+    def __getitem__(self, uid: uuid.UUID) -> Mutant:
+        return self.__mutants[uid]
+
+    def __delitem__(self, uid: uuid.UUID) -> None:
+        with self.__lock:
+            mutant = self.__mutants.pop(uid)
+        self.__client.bugzoo.deregister_mutant(mutant.snapshot)
+
+    def __len__(self) -> int:
+        return len(self.__mutants)
+
+
+class FakeBoggart(object):
+    """
+    Provides the subset of the boggart client interface that is used by the
+    orchestrator. Mutants are registered with a given fake BugZoo client.
+    """
+    def __init__(self, client_bugzoo: FakeBugZoo) -> None:
+        self.__bugzoo = client_bugzoo
+        self.__operators = _FakeOperatorCollection()
+        self.__mutants = _FakeMutantManager(self)
+
+    @property
+    def bugzoo(self) -> FakeBugZoo:
+        return self.__bugzoo
+
+    @property
+    def operators(self) -> _FakeOperatorCollection:
+        return self.__operators
+
+    @property
+    def mutants(self) -> _FakeMutantManager:
+        return self.__mutants
+
+    def mutations(self,
+                  snapshot: Snapshot,
+                  filepath: str,
+                  *,
+                  language: Optional[Any] = None,
+                  operators: Optional[List[_FakeOperator]] = None,
+                  restrict_to_lines: Optional[List[int]] = None
+                  ) -> Iterator[Mutation]:
+        self.__bugzoo.latencies.delay('mutations')
+        op_names = set(op.name for op in operators) if operators else None
+        lines = set(restrict_to_lines) if restrict_to_lines else None
+        for mutation in self.__bugzoo.recording.mutations(filepath):
+            if op_names is not None and mutation.operator not in op_names:
+                continue
+            if lines is not None and mutation.location.start.line not in lines:  # noqa: pycodestyle
+                continue
+            yield mutation
+
+    def mutations_to_replacements(self,
+                                  snapshot: Snapshot,
+                                  mutations: List[Mutation]
+                                  ) -> List[Replacement]:
+        """
+        Returns a replacement for each mutation. Only the locations of the
+        replacements are meaningful.
+        """
+        return [Replacement(m.location, '') for m in mutations]
+
+    def mutate(self,
+               snapshot: Snapshot,
+               mutations: List[Mutation]
+               ) -> Mutant:
+        self.__bugzoo.latencies.delay('mutate')
+        mutations = list(mutations)
+        mutant = Mutant(uuid.uuid4(), snapshot.name, mutations)
+        desc = snapshot.to_dict()
+        desc['name'] = mutant.snapshot
+        desc['image'] = mutant.docker_image
+        failing = self.__bugzoo.recording.failing_tests(mutations)
+        self.__bugzoo.register_mutant(Snapshot.from_dict(desc), failing)
+        self.__mutants.add(mutant)
+        return mutant
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FakeRooibos(rooibos.Client):
+    """
+    Provides the subset of the rooibos client interface that is used by
+    Darjeeling. Templates without holes are matched literally; matches for
+    all other templates are replayed from a recording.
+    """
+    def __init__(self, client_bugzoo: FakeBugZoo) -> None:
+        # NOTE the constructor of the real client contacts the server
+        self.__bugzoo = client_bugzoo
+        self.__content_to_file = {}  # type: Dict[str, str]
+        recording = client_bugzoo.recording
+        for fn in recording.files:
+            try:
+                self.__content_to_file[recording.read_file(fn)] = fn
+            except KeyError:
+                pass
+
+    def matches(self, source: str, template: str) -> Iterator[rooibos.Match]:
+        self.__bugzoo.latencies.delay('matches')
+        if ':[' in template:
+            filename = self.__content_to_file.get(source)
+            if filename is None:
+                return
+            yield from self.__bugzoo.recording.matches(template, filename)
+            return
+
+        for (i, line) in enumerate(source.split('\n')):
+            col = line.find(template)
+            while col != -1:
+                start = rooibos.Location(i + 1, col)
+                stop = rooibos.Location(i + 1, col + len(template))
+                yield rooibos.Match(rooibos.Environment([]),
+                                    rooibos.LocationRange(start, stop))
+                col = line.find(template, col + 1)
+
+    def substitute(self, template: str, args: Dict[str, str]) -> str:
+        for (term, value) in args.items():
+            template = template.replace(':[{}]'.format(term), value)
+        return template
+
+    def shutdown(self) -> None:
+        pass
@@ -0,0 +1,230 @@
+"""
+This module provides handles for perturbations that are injected in the
+background, allowing callers to poll their progress, wait for them to
+finish, or cancel them.
+"""
+from typing import Optional, Callable, Dict, Any
+from timeit import default_timer as timer
+from enum import Enum
+import logging
+import threading
+import uuid
+
+from boggart import Mutation
+
+from .exceptions import PerturbationCancelled
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['PerturbationJob', 'PerturbationStatus', 'PerturbationStage']
+
+
+class PerturbationStatus(Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+class PerturbationStage(Enum):
+    """
+    Identifies the step of the perturbation pipeline that a job is executing.
+    """
+    QUEUED = 'queued'
+    MUTATING = 'mutating'
+    CHECKING_LIVENESS = 'checking-liveness'
+    COMPUTING_COVERAGE = 'computing-coverage'
+    LOCALIZING = 'localizing'
+    ANALYSING = 'analysing'
+    FINISHED = 'finished'
+
+
+class PerturbationJob(object):
+    """
+    Tracks the injection of a single perturbation on a background thread.
+    Cancellation is cooperative: a cancelled job stops at the start of its
+    next stage, after which any mutant that it created is destroyed.
+    """
+    def __init__(self,
+                 perturbation: Mutation,
+                 callback_progress: Optional[Callable[['PerturbationJob'], None]] = None  # noqa: pycodestyle
+                 ) -> None:
+        """
+        Constructs a new job.
+
+        Parameters:
+            perturbation: the perturbation that should be injected.
+            callback_progress: called with this job whenever it moves to a
+                new stage, and once it has finished.
+        """
+        self.__uid = uuid.uuid4().hex
+        self.__perturbation = perturbation
+        self.__callback_progress = callback_progress
+        self.__status = PerturbationStatus.PENDING
+        self.__stage = PerturbationStage.QUEUED
+        self.__error = None  # type: Optional[Exception]
+        self.__committed = False
+        self.__time_start = None  # type: Optional[float]
+        self.__time_stop = None  # type: Optional[float]
+        self.__lock = threading.Lock()
+        self.__cancelled = threading.Event()
+        self.__finished = threading.Event()
+
+    @property
+    def uid(self) -> str:
+        return self.__uid
+
+    @property
+    def perturbation(self) -> Mutation:
+        return self.__perturbation
+
+    @property
+    def status(self) -> PerturbationStatus:
+        return self.__status
+
+    @property
+    def stage(self) -> PerturbationStage:
+        return self.__stage
+
+    @property
+    def error(self) -> Optional[Exception]:
+        """
+        The error that caused this job to fail or to be cancelled, if any.
+        """
+        return self.__error
+
+    @property
+    def done(self) -> bool:
+        """
+        Indicates whether this job has finished, regardless of its outcome.
+        """
+        return self.__finished.is_set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self.__cancelled.is_set()
+
+    @property
+    def time_taken(self) -> Optional[float]:
+        """
+        The number of seconds that this job has been running, or ran for,
+        or None if it has not started.
+        """
+        if self.__time_start is None:
+            return None
+        time_stop = self.__time_stop if self.__time_stop is not None else timer()  # noqa: pycodestyle
+        return time_stop - self.__time_start
+
+    def _report(self) -> None:
+        if not self.__callback_progress:
+            return
+        try:
+            self.__callback_progress(self)
+        except Exception:
+            logger.exception("progress callback failed for job: %s",
+                             self.__uid)
+
+    def cancel(self) -> bool:
+        """
+        Requests that this job be cancelled.
+
+        Returns:
+            True if the request was accepted, or False if the job has
+            already finished or can no longer be cancelled.
+        """
+        with self.__lock:
+            if self.done or self.__committed:
+                return False
+            logger.info("cancelling perturbation job: %s", self.__uid)
+            self.__cancelled.set()
+            return True
+
+    def advance(self, stage: PerturbationStage) -> None:
+        """
+        Records that this job has moved to a given stage.
+
+        Raises:
+            PerturbationCancelled: if cancellation has been requested.
+        """
+        with self.__lock:
+            if self.__cancelled.is_set():
+                raise PerturbationCancelled
+            if self.__status == PerturbationStatus.PENDING:
+                self.__status = PerturbationStatus.RUNNING
+                self.__time_start = timer()
+            self.__stage = stage
+        logger.debug("perturbation job [%s] entered stage: %s",
+                     self.__uid, stage.value)
+        self._report()
+
+    def commit(self) -> None:
+        """
+        Marks the point after which this job can no longer be cancelled.
+
+        Raises:
+            PerturbationCancelled: if cancellation has been requested.
+        """
+        with self.__lock:
+            if self.__cancelled.is_set():
+                raise PerturbationCancelled
+            self.__committed = True
+
+    def finish(self, error: Optional[Exception] = None) -> None:
+        """
+        Records that this job has finished, successfully or otherwise.
+        """
+        with self.__lock:
+            self.__error = error
+            self.__time_stop = timer()
+            if self.__time_start is None:
+                self.__time_start = self.__time_stop
+            if error is None:
+                self.__status = PerturbationStatus.SUCCEEDED
+                self.__stage = PerturbationStage.FINISHED
+            elif isinstance(error, PerturbationCancelled):
+                self.__status = PerturbationStatus.CANCELLED
+            else:
+                self.__status = PerturbationStatus.FAILED
+            self.__finished.set()
+        logger.info("perturbation job [%s] finished: %s",
+                    self.__uid, self.__status.value)
+        self._report()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until this job has finished, or until a given number of
+        seconds has passed.
+
+        Returns:
+            True if the job has finished.
+        """
+        return self.__finished.wait(timeout)
+
+    def result(self, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until this job has finished, and raises the error that caused
+        it to fail, if any.
+
+        Raises:
+            TimeoutError: if the job did not finish within the given number
+                of seconds.
+            NeutralPerturbation: if the perturbation does not fail any tests.
+            PerturbationCancelled: if the job was cancelled.
+            UnexpectedError: if an unexpected error occurred.
+        """
+        if not self.wait(timeout):
+            raise TimeoutError("perturbation job did not finish in time")
+        if self.__error is not None:
+            raise self.__error
+
+    def to_dict(self) -> Dict[str, Any]:
+        jsn = {'id': self.__uid,
+               'status': self.__status.value,
+               'stage': self.__stage.value,
+               'time-taken': self.time_taken}  # type: Dict[str, Any]
+        if self.__error is not None:
+            jsn['error'] = {'kind': self.__error.__class__.__name__,
+                            'message': str(self.__error)}
+        return jsn
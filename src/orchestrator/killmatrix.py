@@ -0,0 +1,358 @@
+"""
+This module provides a persistent kill matrix, which records, for each
+perturbation of the baseline, the set of tests that it causes to fail.
+Since the baseline and its mutation operators always produce the same
+perturbations, and since test outcomes are deterministic, the matrix can be
+computed offline (see `precompute`) and used to determine the liveness of a
+perturbation without provisioning any containers.
+
+The matrix is stored as gzip-compressed JSON. Each perturbation is identified
+by a truncated digest of its description, and the tests that kill it are
+encoded as a hexadecimal bitmask over a shared, ordered list of test names.
+The matrix is stamped with the identity of the baseline snapshot and the
+digest of its Docker image, and is ignored once either of those changes.
+"""
+from typing import Dict, List, Optional, Iterable, Callable, Any
+from timeit import default_timer as timer
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+
+import bugzoo.server
+import boggart.server
+import rooibos
+from bugzoo.client import Client as BugZooClient
+from bugzoo.core.bug import Bug as Snapshot
+from boggart import Client as BoggartClient
+from boggart import Mutation
+
+from .cache import DiskCache
+from .snapshot import snapshot_identity, fetch_image_digest
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['KillMatrix', 'load_kill_matrix']
+
+# bumped whenever the format of the kill matrix is changed
+KILL_MATRIX_VERSION = 1
+
+# the number of hexadecimal digits of the digest used to identify each
+# perturbation
+KEY_LENGTH = 16
+
+# the number of newly screened perturbations after which a partially
+# computed matrix is written to disk
+CHECKPOINT_INTERVAL = 100
+
+KILL_MATRIX_FN = \
+    os.path.join(os.path.dirname(__file__),
+                 'data/baseline.kills.json.gz')  # type: str
+
+__LOCK = threading.Lock()
+__KILL_MATRIX = None  # type: Optional[KillMatrix]
+__KILL_MATRIX_LOADED = False
+
+
+class KillMatrix(object):
+    """
+    Records the tests that are failed by each perturbation of a given
+    baseline snapshot.
+    """
+    @staticmethod
+    def key(mutation: Mutation) -> str:
+        """
+        Computes the key that identifies a given perturbation.
+        """
+        return DiskCache.key(mutation.to_dict())[:KEY_LENGTH]
+
+    @staticmethod
+    def for_snapshot(snapshot: Snapshot,
+                     tests: Iterable[str]
+                     ) -> 'KillMatrix':
+        """
+        Constructs an empty kill matrix for a given snapshot.
+        """
+        return KillMatrix(tests, {},
+                          identity=snapshot_identity(snapshot),
+                          image_digest=fetch_image_digest(snapshot))
+
+    @staticmethod
+    def load(fn: str) -> 'KillMatrix':
+        """
+        Loads a kill matrix from a given file.
+
+        Raises:
+            ValueError: if the file was produced by an incompatible version
+                of the orchestrator.
+        """
+        with gzip.open(fn, 'rt') as f:
+            jsn = json.load(f)
+        if jsn.get('version') != KILL_MATRIX_VERSION:
+            raise ValueError("unsupported kill matrix version: {}".format(
+                jsn.get('version')))
+        kills = {k: int(mask, 16) for (k, mask) in jsn['kills'].items()}
+        return KillMatrix(jsn['tests'], kills,
+                          identity=jsn['snapshot'],
+                          image_digest=jsn['image'])
+
+    def __init__(self,
+                 tests: Iterable[str],
+                 kills: Dict[str, int],
+                 *,
+                 identity: str,
+                 image_digest: Optional[str]
+                 ) -> None:
+        """
+        Constructs a new kill matrix.
+
+        Parameters:
+            tests: the names of the tests in the test suite, in the order
+                used by the bitmasks in `kills`.
+            kills: a bitmask of the tests that are failed by each
+                perturbation, indexed by the key of that perturbation.
+            identity: the identity of the baseline snapshot.
+            image_digest: the digest of the Docker image for the baseline
+                snapshot, if known.
+        """
+        self.__tests = list(tests)
+        self.__test_to_index = \
+            {name: i for (i, name) in enumerate(self.__tests)}
+        self.__kills = dict(kills)
+        self.__identity = identity
+        self.__image_digest = image_digest
+        self.__lock = threading.Lock()
+
+    @property
+    def tests(self) -> List[str]:
+        return list(self.__tests)
+
+    @property
+    def identity(self) -> str:
+        """
+        The identity of the baseline snapshot for which this matrix was
+        computed.
+        """
+        return self.__identity
+
+    @property
+    def image_digest(self) -> Optional[str]:
+        """
+        The digest of the Docker image for which this matrix was computed,
+        if it was known at the time.
+        """
+        return self.__image_digest
+
+    def __len__(self) -> int:
+        """
+        Returns the number of perturbations in this matrix.
+        """
+        return len(self.__kills)
+
+    def __contains__(self, mutation: Mutation) -> bool:
+        return KillMatrix.key(mutation) in self.__kills
+
+    def is_stale(self, snapshot: Snapshot) -> bool:
+        """
+        Determines whether this matrix is out of date with respect to a
+        given snapshot. If the digest of the image for the snapshot cannot
+        be determined (e.g., because the image is only available to a remote
+        BugZoo server), only the description of the snapshot is compared.
+        """
+        if self.__identity != snapshot_identity(snapshot):
+            return True
+        digest = fetch_image_digest(snapshot)
+        if digest is None:
+            logger.warning("unable to verify kill matrix against image: %s",
+                           snapshot.image)
+            return False
+        return digest != self.__image_digest
+
+    def add(self, mutation: Mutation, killing_tests: Iterable[str]) -> None:
+        """
+        Records the tests that are failed by a given perturbation.
+
+        Raises:
+            KeyError: if any of the tests does not belong to this matrix.
+        """
+        mask = 0
+        for name in killing_tests:
+            mask |= 1 << self.__test_to_index[name]
+        with self.__lock:
+            self.__kills[KillMatrix.key(mutation)] = mask
+
+    def killing_tests(self, mutation: Mutation) -> Optional[List[str]]:
+        """
+        Returns the names of the tests that are failed by a given
+        perturbation, in test suite order, or None if the perturbation is
+        not in this matrix.
+        """
+        mask = self.__kills.get(KillMatrix.key(mutation))
+        if mask is None:
+            return None
+        return [name for (i, name) in enumerate(self.__tests)
+                if mask & (1 << i)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.__lock:
+            kills = {k: format(mask, 'x') for (k, mask) in self.__kills.items()}  # noqa: pycodestyle
+        return {'version': KILL_MATRIX_VERSION,
+                'snapshot': self.__identity,
+                'image': self.__image_digest,
+                'tests': self.__tests,
+                'kills': kills}
+
+    def save(self, fn: str) -> None:
+        """
+        Atomically writes this matrix to a given file.
+        """
+        fn_tmp = '{}.tmp.{}'.format(fn, os.getpid())
+        with gzip.open(fn_tmp, 'wt') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(fn_tmp, fn)
+
+
+def load_kill_matrix(snapshot: Snapshot) -> Optional[KillMatrix]:
+    """
+    Attempts to load the precomputed kill matrix for Baseline A. The matrix
+    is only loaded once per process.
+
+    Returns:
+        the kill matrix, or None if there is no precomputed matrix, or if
+        that matrix is out of date.
+    """
+    global __KILL_MATRIX
+    global __KILL_MATRIX_LOADED
+    with __LOCK:
+        if __KILL_MATRIX_LOADED:
+            return __KILL_MATRIX
+        __KILL_MATRIX_LOADED = True
+        if not os.path.exists(KILL_MATRIX_FN):
+            logger.debug("no precomputed kill matrix for baseline A.")
+            return None
+        try:
+            matrix = KillMatrix.load(KILL_MATRIX_FN)
+        except Exception:
+            logger.exception("failed to load kill matrix for baseline A.")
+            return None
+        if matrix.is_stale(snapshot):
+            logger.warning("ignoring stale kill matrix for baseline A: %s",
+                           KILL_MATRIX_FN)
+            return None
+        logger.info("loaded kill matrix for baseline A: %d perturbations",
+                    len(matrix))
+        __KILL_MATRIX = matrix
+        return matrix
+
+
+def compute_kill_matrix(client_bugzoo: BugZooClient,
+                        client_boggart: BoggartClient,
+                        snapshot: Snapshot,
+                        mutations: Iterable[Mutation],
+                        *,
+                        threads: int = 1,
+                        matrix: Optional[KillMatrix] = None,
+                        callback_checkpoint: Optional[Callable[[KillMatrix], None]] = None  # noqa: pycodestyle
+                        ) -> KillMatrix:
+    """
+    Computes the kill matrix for a given set of perturbations by executing
+    every test that covers each perturbation.
+
+    Parameters:
+        client_bugzoo: a connection to the BugZoo server.
+        client_boggart: a connection to the boggart server.
+        snapshot: the baseline snapshot.
+        mutations: the perturbations that should be added to the matrix.
+        threads: the number of containers that should be used to evaluate
+            perturbations in parallel.
+        matrix: an optional, partially computed matrix for the snapshot.
+            Perturbations that already belong to this matrix are skipped.
+        callback_checkpoint: called with the matrix after every
+            `CHECKPOINT_INTERVAL` newly evaluated perturbations.
+
+    Returns:
+        the kill matrix.
+    """
+    # avoid a circular import
+    from .liveness import screen_mutations, ScreeningOutcome
+
+    if matrix is None:
+        matrix = KillMatrix.for_snapshot(snapshot,
+                                         [t.name for t in snapshot.tests])
+    todo = [m for m in mutations if m not in matrix]
+    logger.info("computing kill matrix for %d perturbations", len(todo))
+    time_start = timer()
+    for i in range(0, len(todo), CHECKPOINT_INTERVAL):
+        batch = todo[i:i + CHECKPOINT_INTERVAL]
+        results = screen_mutations(client_bugzoo, client_boggart, snapshot,
+                                   batch,
+                                   threads=threads,
+                                   exhaustive=True)
+        for result in results:
+            if result.outcome != ScreeningOutcome.FAILED:
+                matrix.add(result.mutation, result.killing_tests)
+        logger.info("computed kill matrix for %d of %d perturbations (%.1f seconds elapsed)",  # noqa: pycodestyle
+                    min(i + CHECKPOINT_INTERVAL, len(todo)), len(todo),
+                    timer() - time_start)
+        if callback_checkpoint:
+            callback_checkpoint(matrix)
+    return matrix
+
+
+def precompute() -> None:
+    """
+    Computes the kill matrix for all perturbations of all mutable files in
+    baseline A and saves it to disk. If the output file already contains a
+    partially computed, up-to-date matrix, the computation is resumed.
+    """
+    # avoid a circular import
+    from .coverage import load_baseline_lines
+    from .orchestrator import OPERATOR_NAMES
+    from .perturbationindex import PerturbationIndex
+    from .snapshot import fetch_baseline_snapshot
+
+    parser = argparse.ArgumentParser(
+        description="Precomputes the kill matrix for all perturbations of baseline A.")  # noqa: pycodestyle
+    parser.add_argument('--output', default='baseline.kills.json.gz',
+                        help="the file to which the kill matrix should be written.")  # noqa: pycodestyle
+    parser.add_argument('--threads', type=int, default=1,
+                        help="the number of containers used to evaluate perturbations.")  # noqa: pycodestyle
+    parser.add_argument('--file', dest='files', action='append',
+                        help="restricts the matrix to the perturbations of a given file.")  # noqa: pycodestyle
+    args = parser.parse_args()
+
+    with bugzoo.server.ephemeral(port=6060) as client_bugzoo, \
+            rooibos.ephemeral_server(port=8888), \
+            boggart.server.ephemeral(url_bugzoo='http://127.0.0.1:6060',
+                                     url_rooibos='http://127.0.0.1:8888',
+                                     port=8000) as client_boggart:
+        snapshot = fetch_baseline_snapshot(client_bugzoo)
+        matrix = None  # type: Optional[KillMatrix]
+        if os.path.exists(args.output):
+            matrix = KillMatrix.load(args.output)
+            if matrix.is_stale(snapshot):
+                logger.info("discarding stale kill matrix: %s", args.output)
+                matrix = None
+            else:
+                logger.info("resuming kill matrix: %s", args.output)
+
+        lines = load_baseline_lines()
+        index = PerturbationIndex(client_boggart, snapshot, lines,
+                                  OPERATOR_NAMES)
+        mutations = [r.mutation for r in
+                     index.enumerate_all(args.files, threads=args.threads)]
+
+        def checkpoint(matrix: KillMatrix) -> None:
+            logger.info("writing kill matrix to disk: %s", args.output)
+            matrix.save(args.output)
+
+        matrix = compute_kill_matrix(client_bugzoo, client_boggart, snapshot,
+                                     mutations,
+                                     threads=args.threads,
+                                     matrix=matrix,
+                                     callback_checkpoint=checkpoint)
+        checkpoint(matrix)
+    logger.info("wrote kill matrix to disk.")
@@ -1,65 +1,532 @@
 """
-This module is used to check the liveness of a perturbation.
+This module is used to check the liveness of a perturbation, and to screen
+batches of candidate perturbations for liveness before any of them are
+injected.
 """
+from typing import List, Dict, Optional, Callable, Any, Tuple
+from timeit import default_timer as timer
+from enum import Enum
+import concurrent.futures
 import logging
+import shlex
+import threading
 
 from bugzoo.client import Client as BugZooClient
+from bugzoo.core.bug import Bug as Snapshot
+from bugzoo.core.test import TestCase
 from boggart import Client as BoggartClient
+from bugzoo.core.container import Container
+from boggart import Mutation
 from boggart.core import Mutant
 from boggart.core.location import FileLine
 
-from .coverage import load_baseline_coverage
+from .concurrency import Stage, ConcurrencyController, timed_out
+from .coverage import load_baseline_index
+from .killmatrix import KillMatrix
+from .pool import ContainerPool
+from .scheduler import TestScheduler
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
 
+__all__ = ['mutant_fails_test', 'screen_mutations', 'ScreeningResult',
+           'ScreeningOutcome']
 
-def mutant_fails_test(client_bugzoo: BugZooClient,
-                      client_boggart: BoggartClient,
-                      mutant: Mutant
-                      ) -> None:
+# the suffix given to the copies of source files that are made before a
+# perturbation is applied to a shared container
+BACKUP_SUFFIX = '.screening'
+
+
+class ScreeningOutcome(Enum):
+    KILLED = 'killed'
+    NEUTRAL = 'neutral'
+    FAILED = 'failed'
+
+
+class ScreeningResult(object):
     """
-    Determines whether a given mutant is killed by the test suite.
+    Describes the outcome of screening a single perturbation for liveness.
     """
-    logger.info("ensuring that mutant fails at least one test")
-    mgr_ctr = client_bugzoo.containers
-    snapshot = client_bugzoo.bugs[mutant.snapshot]
+    def __init__(self,
+                 mutation: Mutation,
+                 outcome: ScreeningOutcome,
+                 time_taken: float,
+                 *,
+                 killing_tests: Optional[List[str]] = None,
+                 num_tests: int = 0,
+                 error: Optional[str] = None
+                 ) -> None:
+        self.__mutation = mutation
+        self.__outcome = outcome
+        self.__time_taken = time_taken
+        self.__killing_tests = list(killing_tests or [])
+        self.__num_tests = num_tests
+        self.__error = error
 
-    # find the set of lines changed by the mutant
+    @property
+    def mutation(self) -> Mutation:
+        return self.__mutation
+
+    @property
+    def outcome(self) -> ScreeningOutcome:
+        return self.__outcome
+
+    @property
+    def killed(self) -> bool:
+        return self.__outcome == ScreeningOutcome.KILLED
+
+    @property
+    def killing_test(self) -> Optional[str]:
+        """
+        The name of the test that killed the perturbation, if any.
+        """
+        return self.__killing_tests[0] if self.__killing_tests else None
+
+    @property
+    def killing_tests(self) -> List[str]:
+        """
+        The names of all of the tests that were found to kill the
+        perturbation. Unless the screen was exhaustive, this contains at
+        most one test.
+        """
+        return list(self.__killing_tests)
+
+    @property
+    def num_tests(self) -> int:
+        """
+        The number of tests that were executed before a verdict was reached.
+        """
+        return self.__num_tests
+
+    @property
+    def time_taken(self) -> float:
+        """
+        The number of seconds taken to screen the perturbation.
+        """
+        return self.__time_taken
+
+    @property
+    def error(self) -> Optional[str]:
+        """
+        A description of the reason that the perturbation could not be
+        screened, if any.
+        """
+        return self.__error
+
+    def rank_key(self) -> Tuple[int, float]:
+        """
+        Killed perturbations are ranked first, in ascending order of the
+        time taken to kill them, followed by neutral perturbations and
+        perturbations that could not be screened.
+        """
+        order = [ScreeningOutcome.KILLED,
+                 ScreeningOutcome.NEUTRAL,
+                 ScreeningOutcome.FAILED]
+        return (order.index(self.__outcome), self.__time_taken)
+
+    def to_dict(self) -> Dict[str, Any]:
+        jsn = {'mutation': self.__mutation.to_dict(),
+               'outcome': self.__outcome.value,
+               'killing-test': self.killing_test,
+               'num-tests': self.__num_tests,
+               'time-taken': self.__time_taken}  # type: Dict[str, Any]
+        if self.__error is not None:
+            jsn['error'] = self.__error
+        return jsn
+
+
+def _lines_changed(client_boggart: BoggartClient,
+                   snapshot: Snapshot,
+                   mutations: List[Mutation]
+                   ) -> List[FileLine]:
+    """
+    Finds the set of lines that are changed by a given set of mutations.
+    """
     replacements = client_boggart.mutations_to_replacements(snapshot,
-                                                            mutant.mutations)
+                                                            mutations)
     locations = [r.location for r in replacements]
-    lines = [FileLine(l.filename, l.stop.line) for l in locations]
-    logger.info("lines changed by mutant: %s",
-                sorted(set(l.num for l in lines)))
+    return [FileLine(l.filename, l.stop.line) for l in locations]
 
-    # restrict to the test outcomes that may be changed by the mutant
-    coverage = load_baseline_coverage()
-    # logger.info("coverage tests: %s", [t for t in coverage])
-    tests = list(snapshot.tests)
-    tests = [t for t in tests \
-             if any(line in coverage[t.name] for line in lines)]
+
+def _covering_tests(snapshot: Snapshot,
+                    lines: List[FileLine],
+                    scheduler: Optional[TestScheduler]
+                    ) -> List[TestCase]:
+    """
+    Returns the tests for a snapshot whose outcomes may be changed by a
+    modification to any of the given lines, in the order in which they
+    should be executed.
+    """
+    index = load_baseline_index()
+    covering = index.tests_covering_lines(lines)
+    tests = [t for t in snapshot.tests if t.name in covering]
     logger.info("tests covered by mutant: %s",
                 sorted(set(t.name for t in tests)))
 
+    if scheduler:
+        tests = scheduler.order(tests, lines)
+        logger.info("scheduled tests: %s", ', '.join(t.name for t in tests))
+    return tests
+
+
+def _find_killing_test_sequential(client_bugzoo: BugZooClient,
+                                  snapshot: Snapshot,
+                                  tests: List[TestCase],
+                                  outcomes: Dict[str, bool],
+                                  timeouts: List[str]
+                                  ) -> Optional[TestCase]:
+    """
+    Executes each test, in order, inside a single container until a failing
+    test is found. Whether or not each executed test killed the mutant is
+    recorded in `outcomes`, and the names of tests that exceeded their time
+    limit are added to `timeouts`.
+
+    Returns:
+        the first failing test, or None if all tests pass.
+    """
+    mgr_ctr = client_bugzoo.containers
     container = None
     try:
-        killed = False
         container = mgr_ctr.provision(snapshot)
         for test in tests:
             logger.info("checking whether test [%s] kills mutant",
                         test.name)
             outcome = mgr_ctr.test(container, test)
+            outcomes[test.name] = not outcome.passed
+            if timed_out(outcome):
+                timeouts.append(test.name)
             if not outcome.passed:
-                logger.info("mutant killed by test: %s", test.name)
-                killed = True
-                break
-        if not killed:
-            logger.info("mutant was not killed by any of the test cases")
-            return False
+                return test
     finally:
         if container is not None:
             del mgr_ctr[container.uid]
+    return None
+
+
+def _find_killing_test_parallel(client_bugzoo: BugZooClient,
+                                snapshot: Snapshot,
+                                tests: List[TestCase],
+                                outcomes: Dict[str, bool],
+                                timeouts: List[str],
+                                threads: int
+                                ) -> Optional[TestCase]:
+    """
+    Distributes tests across a pool of containers and returns as soon as any
+    test fails. Tests that have not yet started are cancelled; containers for
+    tests that are still running are destroyed once those tests finish.
+    Whether or not each completed test killed the mutant is recorded in
+    `outcomes`, and the names of tests that exceeded their time limit are
+    added to `timeouts`.
+
+    Returns:
+        a failing test, or None if all tests pass.
+    """
+    mgr_ctr = client_bugzoo.containers
+    killed = threading.Event()
+    lock_outcomes = threading.Lock()
+
+    def check(pool: ContainerPool, test: TestCase) -> Optional[TestCase]:
+        if killed.is_set():
+            return None
+        with pool.container() as container:
+            if killed.is_set():
+                return None
+            logger.info("checking whether test [%s] kills mutant",
+                        test.name)
+            outcome = mgr_ctr.test(container, test)
+        with lock_outcomes:
+            # ignore the outcomes of tests that finish after we return
+            if killed.is_set():
+                return None
+            outcomes[test.name] = not outcome.passed
+            if timed_out(outcome):
+                timeouts.append(test.name)
+            if not outcome.passed:
+                killed.set()
+                return test
+        return None
 
+    pool = ContainerPool(client_bugzoo, snapshot, threads)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    futures = [executor.submit(check, pool, test) for test in tests]
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            killer = future.result()
+            if killer is not None:
+                return killer
+        return None
+    finally:
+        with lock_outcomes:
+            killed.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        pool.close()
+
+
+def mutant_fails_test(client_bugzoo: BugZooClient,
+                      client_boggart: BoggartClient,
+                      mutant: Mutant,
+                      *,
+                      threads: int = 1,
+                      scheduler: Optional[TestScheduler] = None,
+                      kill_matrix: Optional[KillMatrix] = None,
+                      controller: Optional[ConcurrencyController] = None
+                      ) -> bool:
+    """
+    Determines whether a given mutant is killed by the test suite.
+
+    Parameters:
+        client_bugzoo: a connection to the BugZoo server.
+        client_boggart: a connection to the boggart server.
+        mutant: the mutant under test.
+        threads: the number of containers that should be used to execute
+            tests in parallel. If equal to one, tests are executed one after
+            another inside a single container.
+        scheduler: an optional scheduler that is used to decide the order in
+            which tests are executed, and which learns from the outcome of
+            the check.
+        kill_matrix: an optional, precomputed kill matrix. If the mutant
+            is described by the matrix, no tests are executed.
+        controller: an optional concurrency controller, to which a liveness
+            failure is reported if any test exceeds its time limit.
+    """
+    assert threads > 0
+    logger.info("ensuring that mutant fails at least one test")
+    mutations = list(mutant.mutations)
+    if kill_matrix is not None and len(mutations) == 1:
+        killing = kill_matrix.killing_tests(mutations[0])
+        if killing is not None:
+            logger.info("found mutant in kill matrix: killed by %d tests",
+                        len(killing))
+            return bool(killing)
+    snapshot = client_bugzoo.bugs[mutant.snapshot]
+
+    # find the set of lines changed by the mutant
+    lines = _lines_changed(client_boggart, snapshot, mutations)
+    logger.info("lines changed by mutant: %s",
+                sorted(set(l.num for l in lines)))
+
+    # restrict to the test outcomes that may be changed by the mutant
+    tests = _covering_tests(snapshot, lines, scheduler)
+
+    outcomes = {}  # type: Dict[str, bool]
+    timeouts = []  # type: List[str]
+    threads = min(threads, len(tests)) if tests else 1
+    if threads > 1:
+        logger.debug("checking tests in parallel using %d containers",
+                     threads)
+        killer = _find_killing_test_parallel(client_bugzoo, snapshot,
+                                             tests, outcomes, timeouts,
+                                             threads)
+    else:
+        killer = _find_killing_test_sequential(client_bugzoo, snapshot,
+                                               tests, outcomes, timeouts)
+
+    if timeouts:
+        logger.warning("tests exceeded their time limit: %s",
+                       ', '.join(timeouts))
+        if controller:
+            controller.report_failure(Stage.LIVENESS)
+
+    if scheduler:
+        scheduler.record(lines, outcomes)
+
+    if killer is None:
+        logger.info("mutant was not killed by any of the test cases")
+        return False
+
+    logger.info("mutant killed by test: %s", killer.name)
     logger.info("verified that mutant fails at least one test")
     return True
+
+
+def _exec_or_fail(client_bugzoo: BugZooClient,
+                  container: Container,
+                  snapshot: Snapshot,
+                  command: str
+                  ) -> None:
+    response = client_bugzoo.containers.exec(container,
+                                             command,
+                                             snapshot.source_dir)
+    if response.code != 0:
+        raise RuntimeError("command failed inside container [{}]: {}".format(
+            container.uid, command))
+
+
+def _screen_mutation(client_bugzoo: BugZooClient,
+                     client_boggart: BoggartClient,
+                     pool: ContainerPool,
+                     mutation: Mutation,
+                     scheduler: Optional[TestScheduler],
+                     exhaustive: bool
+                     ) -> ScreeningResult:
+    """
+    Screens a single perturbation by applying it to a container for the
+    baseline that is borrowed from a shared pool. Once the screen is
+    complete, the original source files are restored and the container is
+    returned to the pool. Containers in which the perturbation could not be
+    applied or compiled, or in which an error occurred, are destroyed
+    instead. If `exhaustive` is True, all covering tests are executed,
+    rather than stopping at the first failing test.
+    """
+    mgr_ctr = client_bugzoo.containers
+    snapshot = pool.snapshot
+    time_start = timer()
+
+    def result(outcome: ScreeningOutcome, **kwargs: Any) -> ScreeningResult:
+        return ScreeningResult(mutation, outcome, timer() - time_start,
+                               **kwargs)
+
+    lines = _lines_changed(client_boggart, snapshot, [mutation])
+    tests = _covering_tests(snapshot, lines, scheduler)
+    if not tests:
+        logger.info("perturbation is not covered by any tests: %s", mutation)
+        return result(ScreeningOutcome.NEUTRAL)
+
+    diff = client_boggart.mutations_to_diff(snapshot, [mutation])
+    filenames = [shlex.quote(fn) for fn in diff.files]
+    backup = ' && '.join('cp {0} {0}{1}'.format(fn, BACKUP_SUFFIX)
+                         for fn in filenames)
+    # the restored files are given a fresh modification time to ensure that
+    # they are recompiled before the container is next used
+    restore = ' && '.join('cp {0}{1} {0} && rm {0}{1}'.format(fn, BACKUP_SUFFIX)  # noqa: pycodestyle
+                          for fn in filenames)
+
+    outcomes = {}  # type: Dict[str, bool]
+    killers = []  # type: List[str]
+    failure = None  # type: Optional[str]
+    # the pool destroys the container if an error is raised within this
+    # block, so the original source files only need to be restored after a
+    # successful screen, and can never mask the original error
+    with pool.container() as container:
+        _exec_or_fail(client_bugzoo, container, snapshot, backup)
+        if not mgr_ctr.patch(container, diff):
+            failure = "failed to apply perturbation"
+        elif not mgr_ctr.compile(container).successful:
+            failure = "failed to compile perturbation"
+        else:
+            for test in tests:
+                logger.debug("checking whether test [%s] kills perturbation: %s",  # noqa: pycodestyle
+                             test.name, mutation)
+                outcome = mgr_ctr.test(container, test)
+                outcomes[test.name] = not outcome.passed
+                if not outcome.passed:
+                    killers.append(test.name)
+                    if not exhaustive:
+                        break
+
+        if failure is None:
+            _exec_or_fail(client_bugzoo, container, snapshot, restore)
+        else:
+            # the container may hold a partially applied patch or a broken
+            # build, either of which would poison later screens
+            logger.debug("discarding container [%s]: %s",
+                         container.uid, failure)
+            pool.discard(container)
+
+    if failure is not None:
+        return result(ScreeningOutcome.FAILED, error=failure)
+    if scheduler:
+        scheduler.record(lines, outcomes)
+    if not killers:
+        return result(ScreeningOutcome.NEUTRAL, num_tests=len(outcomes))
+    return result(ScreeningOutcome.KILLED,
+                  killing_tests=killers,
+                  num_tests=len(outcomes))
+
+
+def screen_mutations(client_bugzoo: BugZooClient,
+                     client_boggart: BoggartClient,
+                     snapshot: Snapshot,
+                     mutations: List[Mutation],
+                     *,
+                     threads: int = 1,
+                     scheduler: Optional[TestScheduler] = None,
+                     kill_matrix: Optional[KillMatrix] = None,
+                     exhaustive: bool = False,
+                     callback: Optional[Callable[[ScreeningResult], None]] = None  # noqa: pycodestyle
+                     ) -> List[ScreeningResult]:
+    """
+    Determines which of a batch of perturbations are killed by the test
+    suite. Rather than building a mutant snapshot for each perturbation,
+    perturbations are applied to and compiled within a bounded pool of
+    containers for the baseline, which are shared by all perturbations in
+    the batch, and several perturbations are screened at once.
+
+    Parameters:
+        client_bugzoo: a connection to the BugZoo server.
+        client_boggart: a connection to the boggart server.
+        snapshot: the snapshot for the baseline.
+        mutations: the perturbations that should be screened.
+        threads: the number of containers that should be used to screen
+            perturbations in parallel.
+        scheduler: an optional scheduler that is used to decide the order in
+            which tests are executed, and which learns from the outcome of
+            each screen.
+        kill_matrix: an optional, precomputed kill matrix. Perturbations
+            that are described by the matrix are screened without executing
+            any tests.
+        exhaustive: if True, every test that covers each perturbation is
+            executed, rather than stopping at the first failing test.
+        callback: called with the result for each perturbation as soon as
+            it has been screened.
+
+    Returns:
+        a result for each perturbation, ranked such that killed
+        perturbations come first, in ascending order of the time taken to
+        kill them.
+    """
+    assert threads > 0
+    logger.info("screening %d perturbations using %d containers",
+                len(mutations), threads)
+    time_start = timer()
+
+    def report(result: ScreeningResult) -> None:
+        logger.info("screened perturbation [%s]: %s",
+                    result.outcome.value, result.mutation)
+        if callback:
+            try:
+                callback(result)
+            except Exception:
+                logger.exception("screening callback failed")
+
+    def screen(mutation: Mutation) -> ScreeningResult:
+        time_start_mutation = timer()
+        try:
+            result = _screen_mutation(client_bugzoo, client_boggart, pool,
+                                      mutation, scheduler, exhaustive)
+        except Exception as err:
+            logger.exception("failed to screen perturbation: %s", mutation)
+            result = ScreeningResult(mutation, ScreeningOutcome.FAILED,
+                                     timer() - time_start_mutation,
+                                     error=str(err))
+        report(result)
+        return result
+
+    results = []  # type: List[ScreeningResult]
+    remaining = []  # type: List[Mutation]
+    for mutation in mutations:
+        killing = kill_matrix.killing_tests(mutation) if kill_matrix else None
+        if killing is None:
+            remaining.append(mutation)
+            continue
+        outcome = ScreeningOutcome.KILLED if killing else ScreeningOutcome.NEUTRAL  # noqa: pycodestyle
+        result = ScreeningResult(mutation, outcome, 0.0,
+                                 killing_tests=killing)
+        results.append(result)
+        report(result)
+    if results:
+        logger.info("found %d perturbations in kill matrix", len(results))
+
+    if remaining:
+        threads = min(threads, len(remaining))
+        with ContainerPool(client_bugzoo, snapshot, threads) as pool, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:  # noqa: pycodestyle
+            results += executor.map(screen, remaining)
+
+    results.sort(key=ScreeningResult.rank_key)
+    logger.info("screened %d perturbations (took %.3f seconds): %d killed",
+                len(results), timer() - time_start,
+                sum(1 for r in results if r.killed))
+    return results
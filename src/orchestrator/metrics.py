@@ -0,0 +1,316 @@
+"""
+This module provides a registry of counters and latency histograms that
+describe where the orchestrator spends its time. The contents of the registry
+may be read programmatically, or served in the Prometheus text exposition
+format via a small Flask application.
+"""
+from typing import Dict, List, Tuple, Optional, Iterator, Any
+from timeit import default_timer as timer
+import bisect
+import contextlib
+import logging
+import threading
+
+import flask
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['Counter', 'Histogram', 'MetricsRegistry', 'create_app',
+           'start_metrics_server']
+
+# the upper bounds, in seconds, of the buckets used by latency histograms.
+# phases range from sub-second lookups to static analyses that take minutes.
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   120.0, 300.0, 600.0, 1800.0)
+
+# the prefix given to the name of each metric in the Prometheus format
+METRIC_PREFIX = 'orchestrator_'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels_to_string(labels: Labels,
+                      extra: Optional[Tuple[str, str]] = None
+                      ) -> str:
+    pairs = list(labels)
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escape = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')  # noqa: pycodestyle
+    return '{' + ','.join('{}="{}"'.format(k, escape(v))
+                          for (k, v) in pairs) + '}'
+
+
+class Counter(object):
+    """
+    A monotonically increasing count of events.
+    """
+    def __init__(self, name: str, labels: Labels) -> None:
+        self.__name = name
+        self.__labels = labels
+        self.__value = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return dict(self.__labels)
+
+    @property
+    def value(self) -> float:
+        return self.__value
+
+    def inc(self, amount: float = 1.0) -> None:
+        assert amount >= 0
+        with self.__lock:
+            self.__value += amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.__name,
+                'labels': self.labels,
+                'value': self.__value}
+
+    def to_prometheus(self) -> List[str]:
+        return ['{}{}{} {}'.format(METRIC_PREFIX, self.__name,
+                                   _labels_to_string(self.__labels),
+                                   self.__value)]
+
+
+class Histogram(object):
+    """
+    Records the distribution of a set of observations (e.g., latencies) using
+    a fixed set of cumulative buckets.
+    """
+    def __init__(self,
+                 name: str,
+                 labels: Labels,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+                 ) -> None:
+        self.__name = name
+        self.__labels = labels
+        self.__buckets = tuple(sorted(buckets))
+        self.__counts = [0] * (len(self.__buckets) + 1)
+        self.__sum = 0.0
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return dict(self.__labels)
+
+    @property
+    def count(self) -> int:
+        """
+        The number of observations.
+        """
+        return self.__count
+
+    @property
+    def sum(self) -> float:
+        """
+        The sum of all observations.
+        """
+        return self.__sum
+
+    def observe(self, value: float) -> None:
+        with self.__lock:
+            self.__counts[bisect.bisect_left(self.__buckets, value)] += 1
+            self.__sum += value
+            self.__count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        Returns a list of `(upper_bound, count)` tuples, where each count is
+        the number of observations that are less than or equal to the bound.
+        The final bound is infinite.
+        """
+        with self.__lock:
+            counts = list(self.__counts)
+        bounds = list(self.__buckets) + [float('inf')]
+        cumulative = []
+        total = 0
+        for (bound, count) in zip(bounds, counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.__name,
+                'labels': self.labels,
+                'count': self.__count,
+                'sum': self.__sum,
+                'buckets': [[b, c] for (b, c) in self.cumulative()]}
+
+    def to_prometheus(self) -> List[str]:
+        name = METRIC_PREFIX + self.__name
+        lines = []
+        for (bound, count) in self.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('{}_bucket{} {}'.format(
+                name, _labels_to_string(self.__labels, ('le', le)), count))
+        labels = _labels_to_string(self.__labels)
+        lines.append('{}_sum{} {}'.format(name, labels, self.__sum))
+        lines.append('{}_count{} {}'.format(name, labels, self.__count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    Holds the counters and histograms for a single orchestrator. Metrics are
+    created on first use and are identified by their name and labels.
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__counters = {}  # type: Dict[Tuple[str, Labels], Counter]
+        self.__histograms = {}  # type: Dict[Tuple[str, Labels], Histogram]
+        self.__help = {}  # type: Dict[str, str]
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((k, str(v)) for (k, v) in labels.items()))
+
+    def counter(self,
+                name: str,
+                description: str = '',
+                **labels: str
+                ) -> Counter:
+        """
+        Returns the counter with a given name and labels, creating it if
+        necessary.
+        """
+        key = (name, self._labels(labels))
+        with self.__lock:
+            if key not in self.__counters:
+                self.__counters[key] = Counter(name, key[1])
+            if description:
+                self.__help.setdefault(name, description)
+            return self.__counters[key]
+
+    def histogram(self,
+                  name: str,
+                  description: str = '',
+                  **labels: str
+                  ) -> Histogram:
+        """
+        Returns the histogram with a given name and labels, creating it if
+        necessary.
+        """
+        key = (name, self._labels(labels))
+        with self.__lock:
+            if key not in self.__histograms:
+                self.__histograms[key] = Histogram(name, key[1])
+            if description:
+                self.__help.setdefault(name, description)
+            return self.__histograms[key]
+
+    def observe_duration(self, phase: str, seconds: float) -> None:
+        """
+        Records the time taken by a single execution of a given phase.
+        """
+        self.histogram('phase_duration_seconds',
+                       'time taken by each phase of the orchestrator',
+                       phase=phase).observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, phase: str) -> Iterator[None]:
+        """
+        Measures the time taken to execute the body of a `with` statement
+        as an execution of a given phase. The number of executions of that
+        phase that raise an exception is also counted.
+        """
+        time_start = timer()
+        try:
+            yield
+        except Exception:
+            self.counter('phase_errors_total',
+                         'number of phase executions that failed',
+                         phase=phase).inc()
+            raise
+        finally:
+            self.observe_duration(phase, timer() - time_start)
+
+    @property
+    def counters(self) -> List[Counter]:
+        with self.__lock:
+            return list(self.__counters.values())
+
+    @property
+    def histograms(self) -> List[Histogram]:
+        with self.__lock:
+            return list(self.__histograms.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'counters': [c.to_dict() for c in self.counters],
+                'histograms': [h.to_dict() for h in self.histograms]}
+
+    def to_prometheus(self) -> str:
+        """
+        Produces a description of all metrics in the Prometheus text
+        exposition format (version 0.0.4).
+        """
+        lines = []  # type: List[str]
+        families = {}  # type: Dict[Tuple[str, str], List[Any]]
+        for counter in self.counters:
+            families.setdefault((counter.name, 'counter'), []).append(counter)
+        for histogram in self.histograms:
+            families.setdefault((histogram.name, 'histogram'), []).append(histogram)  # noqa: pycodestyle
+        for ((name, kind), metrics) in sorted(families.items()):
+            description = self.__help.get(name)
+            if description:
+                lines.append('# HELP {}{} {}'.format(METRIC_PREFIX, name,
+                                                     description))
+            lines.append('# TYPE {}{} {}'.format(METRIC_PREFIX, name, kind))
+            for metric in metrics:
+                lines += metric.to_prometheus()
+        return '\n'.join(lines) + '\n'
+
+
+def create_app(registry: MetricsRegistry) -> flask.Flask:
+    """
+    Constructs a Flask application that serves the contents of a given
+    registry in the Prometheus text format at /metrics, and as JSON at
+    /metrics.json.
+    """
+    app = flask.Flask(__name__)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return flask.Response(registry.to_prometheus(),
+                              mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics.json', methods=['GET'])
+    def metrics_json():
+        return flask.jsonify(registry.to_dict())
+
+    return app
+
+
+def start_metrics_server(registry: MetricsRegistry,
+                         *,
+                         host: str = '0.0.0.0',
+                         port: int = 9090
+                         ) -> threading.Thread:
+    """
+    Serves the metrics for a given registry on a background thread.
+
+    Returns:
+        the (daemon) thread on which the server is running.
+    """
+    app = create_app(registry)
+    thread = threading.Thread(target=app.run,
+                              kwargs={'host': host,
+                                      'port': port,
+                                      'threaded': True},
+                              daemon=True)
+    thread.start()
+    logger.info("serving metrics at http://%s:%d/metrics", host, port)
+    return thread
@@ -8,6 +8,7 @@ import datetime
 import os
 import yaml
 import random
+import itertools
 import concurrent.futures
 
 import rooibos
@@ -37,9 +38,20 @@ from .problem import Problem
 from .exceptions import *
 from .snapshot import fetch_baseline_snapshot, fetch_instrumentation_snapshot
 from .blacklist import is_file_mutable
-from .coverage import load_baseline_coverage, compute_mutant_coverage
-from .liveness import mutant_fails_test
+from .coverage import load_baseline_coverage, load_baseline_lines, \
+                       compute_selected_coverage, merge_with_baseline, \
+                       MutantCoverageCache, TestSelection
+from .liveness import mutant_fails_test, screen_mutations, ScreeningResult
+from .killmatrix import KillMatrix, load_kill_matrix
+from .perturbationindex import PerturbationIndex, PerturbationRecord
+from .analysis import AnalysisCache
+from .scheduler import TestScheduler, load_test_scheduler
 from .space import build_search_space
+from .ranking import CandidateRanker, load_schema_history
+from .concurrency import Stage, ConcurrencyController, ContainerBudget, \
+    timed_out
+from .metrics import MetricsRegistry
+from .job import PerturbationJob, PerturbationStage
 from .localization import localize
 
 logger = logging.getLogger("orchestrator")  # type: logging.Logger
@@ -119,8 +131,22 @@ class Orchestrator(object):
                  callback_progress: Callable[[CandidateEvaluation, List[CandidateEvaluation]], None],
                  callback_done: Callable[[List[CandidateEvaluation], int, OrchestratorOutcome, float], None],
                  callback_error: Callable[[str, str], None],
-                 threads: int = 8,
-                 seed: int = 0
+                 threads: Optional[int] = None,
+                 seed: int = 0,
+                 liveness_threads: Optional[int] = None,
+                 test_selection: TestSelection = TestSelection.FILE,
+                 analysis_threads: Optional[int] = None,
+                 lazy_search_space: bool = False,
+                 rank_candidates: bool = False,
+                 *,
+                 client_bugzoo: Optional[bugzoo.client.Client] = None,
+                 client_boggart: Optional[boggart.Client] = None,
+                 client_rooibos: Optional[rooibos.Client] = None,
+                 container_budget: Optional[ContainerBudget] = None,
+                 coverage_cache: Optional[MutantCoverageCache] = None,
+                 analysis_cache: Optional[AnalysisCache] = None,
+                 perturbation_index: Optional[PerturbationIndex] = None,
+                 kill_matrix: Optional[KillMatrix] = None
                  ) -> None:
         """
         Constructs a new orchestrator.
@@ -133,15 +159,76 @@ class Orchestrator(object):
             callback_done: called when the search process has finished.
             callback_error: called when an unexpected error is encountered
                 during a non-blocking call.
+            threads: the number of threads used to evaluate candidate patches
+                and to compute coverage. If unspecified, the number of threads
+                used by each stage is sized according to the resources of the
+                host, and is adjusted automatically when containers fail.
+            seed: the seed for the random number generator.
+            liveness_threads: the number of containers used to check whether
+                a perturbation is killed by the test suite. Defaults to the
+                value of `threads`, if given. If set to one, tests are
+                executed sequentially inside a single container.
+            test_selection: the strategy used to select the tests that should
+                be rerun when computing coverage for a perturbed system.
+            analysis_threads: the number of files that may be statically
+                analysed at the same time, each within its own container.
+                Defaults to the value of `threads`, if given.
+            lazy_search_space: if True, candidate patches are generated
+                incrementally, in descending order of suspiciousness, while
+                the search is running, rather than before it begins.
+            rank_candidates: if True, candidate patches are prioritised using
+                knowledge of the perturbation (i.e., its location and the
+                mutation operator that was used) and the success rates of
+                each transformation schema against that operator, which are
+                learned across runs. Since ranked candidates are attempted in
+                a fixed order, `seed` has no effect on their ordering.
+            client_bugzoo: an optional client that should be used to
+                communicate with BugZoo, in place of a connection to
+                `url_bugzoo` (e.g., a stand-in from `orchestrator.fake`).
+            client_boggart: an optional client that should be used in place
+                of a connection to `url_boggart`.
+            client_rooibos: an optional client that should be used in place
+                of a connection to `url_rooibos`.
+            container_budget: an optional budget, which may be shared with
+                other orchestrators, that caps the number of containers used
+                by the workers of each stage.
+            coverage_cache: an optional mutant coverage cache, which may be
+                shared with other orchestrators.
+            analysis_cache: an optional static analysis cache, which may be
+                shared with other orchestrators.
+            perturbation_index: an optional perturbation index for the
+                baseline, which may be shared with other orchestrators that
+                use the same boggart client.
+            kill_matrix: an optional kill matrix that is used to determine
+                the liveness of perturbations without executing any tests.
+                Defaults to the precomputed kill matrix for the baseline, if
+                there is one and it is up to date.
         """
         logger.info("- using BugZoo: %s", bugzoo.__version__)
         logger.info("- using Darjeeling: %s", darjeeling.__version__)
         logger.info("- using boggart: %s", boggart.__version__)
         logger.info("- using RNG seed: %d", seed)
-        logger.info("- using %d threads for evaluation", threads)
+        logger.info("- selecting coverage tests by: %s", test_selection.value)
         report_system_resources(logger)
         report_resource_limits(logger)
 
+        if liveness_threads is None:
+            liveness_threads = threads
+        if analysis_threads is None:
+            analysis_threads = threads
+        overrides = {}  # type: Dict[Stage, int]
+        for (stage, num) in [(Stage.EVALUATION, threads),
+                             (Stage.COVERAGE, threads),
+                             (Stage.SEARCH_SPACE, threads),
+                             (Stage.LIVENESS, liveness_threads),
+                             (Stage.ANALYSIS, analysis_threads)]:
+            if num is not None:
+                overrides[stage] = num
+        self.__concurrency = ConcurrencyController(overrides,
+                                                   budget=container_budget)
+        for (stage, num) in self.__concurrency.limits.items():
+            logger.info("- using %d threads for %s", num, stage)
+
         self.__callback_progress = callback_progress
         self.__callback_done = callback_done
         self.__callback_error = callback_error
@@ -157,14 +244,27 @@ class Orchestrator(object):
 
         self.__patches = [] # type: List[CandidateEvaluation]
         self.__state = OrchestratorState.READY_TO_PERTURB
-        self.__client_rooibos = rooibos.Client(url_rooibos, timeout_connection=120)
-        self.__client_boggart = boggart.Client(url_boggart, timeout_connection=120)
-        self.__client_bugzoo = bugzoo.Client(url_bugzoo, timeout_connection=120)
+        if client_rooibos is None:
+            client_rooibos = rooibos.Client(url_rooibos, timeout_connection=120)
+        if client_boggart is None:
+            client_boggart = boggart.Client(url_boggart, timeout_connection=120)
+        if client_bugzoo is None:
+            client_bugzoo = bugzoo.Client(url_bugzoo, timeout_connection=120)
+        self.__client_rooibos = client_rooibos
+        self.__client_boggart = client_boggart
+        self.__client_bugzoo = client_bugzoo
         # TODO it would be nicer if Darjeeling was a service
 
-        self.__num_threads = threads
+        self.__lazy_search_space = lazy_search_space
+        self.__rank_candidates = rank_candidates
+        self.__test_selection = test_selection
         self.__problem = None  # type: Optional[Problem]
+        self.__perturbation_job = None  # type: Optional[PerturbationJob]
         self.__searcher = None  # type: Optional[Searcher]
+        self.__search_thread = None  # type: Optional[threading.Thread]
+        # set once the orchestrator has been closed, to stop any search that
+        # has not yet been constructed
+        self.__closing = threading.Event()
         self.__localization = None  # type: Optional[Localization]
         self.__coverage_for_mutant = None  # type: Optional[TestSuiteCoverage]
         self.__baseline = \
@@ -175,10 +275,60 @@ class Orchestrator(object):
         logger.debug("fetching coverage information for Baseline A.")
         self.__coverage_for_baseline = \
             load_baseline_coverage()  # type: TestSuiteCoverage
-        logger.debug("mutable files: %s",
-                     self.__coverage_for_baseline.lines.files)
+        self.__lines = load_baseline_lines()  # type: FileLineSet
+        logger.debug("mutable files: %s", self.__lines.files)
         logger.debug("fetched coverage information for Baseline A.")
         logger.debug("line coverage for Baseline A: %d lines", len(self.lines))
+        self.__test_scheduler = load_test_scheduler()  # type: TestScheduler
+        self.__coverage_cache = coverage_cache or MutantCoverageCache()
+        self.__metrics = MetricsRegistry()
+        self.__analysis_cache = analysis_cache or AnalysisCache()
+        if perturbation_index is None:
+            perturbation_index = PerturbationIndex(self.__client_boggart,
+                                                   self.__baseline,
+                                                   self.lines,
+                                                   OPERATOR_NAMES)
+        self.__perturbation_index = perturbation_index
+        if kill_matrix is None:
+            kill_matrix = load_kill_matrix(self.__baseline)
+        self.__kill_matrix = kill_matrix
+
+    def close(self) -> None:
+        """
+        Releases the resources that are held by the current scenario. Any
+        unfinished perturbation is cancelled, any ongoing search is stopped
+        (once its current candidates have been evaluated), and the mutant for
+        the injected perturbation is destroyed. Unlike `shutdown`, the
+        clients are left open, since they may be shared with other
+        orchestrators.
+        """
+        self.__closing.set()
+        job = self.__perturbation_job
+        if job and not job.done:
+            logger.debug("cancelling perturbation job: %s", job.uid)
+            job.cancel()
+            job.wait()
+
+        searcher = self.__searcher
+        if searcher:
+            searcher.stop()
+        thread = self.__search_thread
+        if thread:
+            logger.debug("waiting for search to stop")
+            thread.join()
+
+        with self.__lock:
+            problem = self.__problem
+            self.__problem = None
+        if problem:
+            mutant = problem.mutant
+            logger.debug("destroying mutant for perturbation: %s",
+                         mutant.uuid)
+            try:
+                del self.__client_boggart.mutants[mutant.uuid]
+                logger.debug("destroyed mutant for perturbation")
+            except Exception:
+                logger.exception("failed to destroy mutant for perturbation")  # noqa: pycodestyle
 
     def shutdown(self) -> None:
         """
@@ -245,7 +395,49 @@ class Orchestrator(object):
         Furthermore, lines in certain blacklisted files are removed from
         consideration, even if covered by the test suite.
         """
-        return self.__coverage_for_baseline.lines
+        return self.__lines
+
+    @property
+    def perturbation_index(self) -> PerturbationIndex:
+        """
+        The on-disk index of perturbations for the original, unperturbed
+        system that is used to answer perturbation queries.
+        """
+        return self.__perturbation_index
+
+    @property
+    def test_scheduler(self) -> TestScheduler:
+        """
+        The scheduler used to order tests when checking whether a
+        perturbation is killed by the test suite. The ordering chosen for the
+        most recent check is given by its `last_ordering` property.
+        """
+        return self.__test_scheduler
+
+    @property
+    def perturbation_job(self) -> Optional[PerturbationJob]:
+        """
+        The job for the most recent attempt to perturb the system, if any.
+        May be used to poll the progress of a perturbation, or to cancel it.
+        """
+        return self.__perturbation_job
+
+    @property
+    def metrics(self) -> MetricsRegistry:
+        """
+        The registry of timings and counters for each phase of perturbation
+        and adaptation. May be served over HTTP using
+        `orchestrator.metrics.start_metrics_server`.
+        """
+        return self.__metrics
+
+    @property
+    def concurrency(self) -> ConcurrencyController:
+        """
+        The controller that decides how many workers each stage may use. Its
+        current limits are given by its `limits` property.
+        """
+        return self.__concurrency
 
     @property
     def patches(self) -> List[CandidateEvaluation]:
@@ -275,12 +467,163 @@ class Orchestrator(object):
             minutes = 0.0
         return (num_attempts, minutes)
 
-    # TODO add return type
+    def _check_perturbation_query(self,
+                                  filename: str,
+                                  line_num: Optional[int] = None,
+                                  op_name: Optional[str] = None
+                                  ) -> None:
+        """
+        Ensures that a given query for perturbations is valid.
+
+        Raises:
+            FileNotFound: if the specified file does not exist or cannot be
+                pertubed.
+            LineNotFound: if the specified line does not exist or cannot be
+                perturbed.
+            OperatorNotFound: if no operator with the given name exists.
+            AssertionError: if a line number is provided and that line number
+                is less than or equal to zero.
+        """
+        assert line_num is None or line_num > 0
+        line = FileLine(filename, line_num) if line_num else None
+        if filename not in self.files:
+            raise FileNotFound(filename)
+        if line is not None and line not in self.lines:
+            raise LineNotFound(line)
+        if op_name is not None and op_name not in OPERATOR_NAMES:
+            raise OperatorNotFound(op_name)
+
+    def iter_perturbations(self,
+                           filename: str,
+                           line_num: Optional[int] = None,
+                           op_name: Optional[str] = None
+                           ) -> Iterator[Mutation]:
+        """
+        Returns an iterator over all perturbations that can be made to a given
+        file. Perturbations are produced as soon as they are found, rather
+        than after the complete set has been enumerated. The query is
+        validated before this method returns.
+
+        Parameters:
+            filename: the path to the file, relative to the root source
+                directory.
+            line_num: if specified, restricts the perturbations to those that
+                cover the line with this one-indexed number.
+            op_name: if specified, restricts the perturbations to those that
+                are generated using the mutation operator with this name.
+
+        Raises:
+            FileNotFound: if the specified file does not exist or cannot be
+                pertubed.
+            LineNotFound: if the specified line does not exist or cannot be
+                perturbed.
+            OperatorNotFound: if no operator with the given name exists.
+            AssertionError: if a line number is provided and that line number
+                is less than or equal to zero.
+        """
+        self._check_perturbation_query(filename, line_num, op_name)
+        return self.__perturbation_index.iter_mutations(filename,
+                                                        line_num,
+                                                        op_name)
+
+    def perturbations_page(self,
+                           filename: str,
+                           line_num: Optional[int] = None,
+                           op_name: Optional[str] = None,
+                           *,
+                           offset: int = 0,
+                           limit: int = 100
+                           ) -> Tuple[List[Mutation], Optional[int]]:
+        """
+        Returns a single page of the perturbations that can be made to a given
+        file. If the file has not been indexed, all of its perturbations are
+        enumerated and indexed by the first request, so that every page is
+        cut from the same, canonically ordered list and later pages do not
+        need to contact boggart.
+
+        Parameters:
+            filename: the path to the file, relative to the root source
+                directory.
+            line_num: if specified, restricts the perturbations to those that
+                cover the line with this one-indexed number.
+            op_name: if specified, restricts the perturbations to those that
+                are generated using the mutation operator with this name.
+            offset: the number of perturbations that should be skipped.
+            limit: the maximum number of perturbations that should be
+                returned.
+
+        Returns:
+            a tuple of the form `(perturbations, next_offset)`, where
+            `next_offset` is the offset of the following page, or None if
+            this is the last page.
+
+        Raises:
+            FileNotFound: if the specified file does not exist or cannot be
+                pertubed.
+            LineNotFound: if the specified line does not exist or cannot be
+                perturbed.
+            OperatorNotFound: if no operator with the given name exists.
+            AssertionError: if a line number is provided and that line number
+                is less than or equal to zero, or if the offset is negative
+                or the limit is not positive.
+        """
+        assert offset >= 0
+        assert limit > 0
+        self._check_perturbation_query(filename, line_num, op_name)
+        self.__perturbation_index.in_file(filename)
+        mutations = self.__perturbation_index.iter_mutations(filename,
+                                                             line_num,
+                                                             op_name)
+        page = list(itertools.islice(mutations, offset, offset + limit + 1))
+        if len(page) > limit:
+            return (page[:limit], offset + limit)
+        return (page, None)
+
+    def all_perturbations(self,
+                          *,
+                          files: Optional[List[str]] = None,
+                          operators: Optional[List[str]] = None,
+                          threads: Optional[int] = None,
+                          callback_timing: Optional[Callable[[str, float], None]] = None  # noqa: pycodestyle
+                          ) -> Iterator[PerturbationRecord]:
+        """
+        Returns an iterator over the perturbations for many (by default, all)
+        mutable files. Files and operators are enumerated in parallel, and
+        each perturbation is produced as soon as it is found.
+
+        Parameters:
+            files: if specified, restricts enumeration to these files.
+            operators: if specified, restricts enumeration to the operators
+                with these names.
+            threads: the maximum number of concurrent enumeration tasks.
+                Defaults to the current evaluation concurrency limit.
+            callback_timing: called with the name of each file, and the
+                number of seconds taken to enumerate its perturbations, once
+                that file has been enumerated.
+
+        Raises:
+            FileNotFound: if any of the specified files does not exist or
+                cannot be perturbed.
+            OperatorNotFound: if no operator exists for any of the given names.
+        """
+        for filename in (files or []):
+            if filename not in self.files:
+                raise FileNotFound(filename)
+        for op_name in (operators or []):
+            if op_name not in OPERATOR_NAMES:
+                raise OperatorNotFound(op_name)
+        if threads is None:
+            threads = self.__concurrency.limit(Stage.EVALUATION)
+        return self.__perturbation_index.enumerate_all(files,
+                                                       operators,
+                                                       threads=threads,
+                                                       callback_timing=callback_timing)  # noqa: pycodestyle
+
     def perturbations(self,
                       filename: str,
                       line_num: Optional[int] = None,
                       op_name: Optional[str] = None
-                      ):
+                      ) -> List[Mutation]:
         """
         Returns a list of all perturbations that can be made to a given file.
 
@@ -305,8 +648,6 @@ class Orchestrator(object):
             AssertionError: if a line number is provided and that line number
                 is less than or equal to zero.
         """
-        baseline = self.__baseline
-        boggartd = self.__client_boggart
         if line_num is None:
             loc_s = filename
         else:
@@ -318,43 +659,100 @@ class Orchestrator(object):
             op_s = "operator: {}".format(op_name)
 
         logger.info("Finding all perturbations in %s using %s.", loc_s, op_s)
-        assert line_num is None or line_num > 0
-
-        line = FileLine(filename, line_num) if line_num else None
-
-        if filename not in self.files:
-            raise FileNotFound(filename)
-        if line is not None and line not in self.lines:
-            raise LineNotFound(line)
-        if op_name is not None and op_name not in OPERATOR_NAMES:
-            raise OperatorNotFound(op_name)
-
-        # fetch the mutation operators
-        if op_name is not None:
-            operators = [boggartd.operators[op_name]]
-        else:
-            operators = [boggartd.operators[name] for name in OPERATOR_NAMES]
-        logger.debug("Using perturbation operators: %s",
-                     [op.name for op in operators])
-
-        if line_num is None:
-            restrict_to_lines = [l.num for l in self.lines[filename]]
-        else:
-            restrict_to_lines = [line_num]
-        logger.info("Looking for perturbations at lines: %s",
-                    sorted(set(restrict_to_lines)))
-
-        generator_mutations = \
-            boggartd.mutations(baseline,
-                               filepath=filename,
-                               operators=operators,
-                               restrict_to_lines=restrict_to_lines)
-        mutations = list(generator_mutations)
+        self._check_perturbation_query(filename, line_num, op_name)
+        mutations = \
+            self.__perturbation_index.mutations(filename, line_num, op_name)
         logger.info("Found %d perturbations in %s using %s.",
                     len(mutations), loc_s, op_s)
 
         return mutations
 
+    def screen_perturbations(self,
+                             perturbations: List[Mutation],
+                             *,
+                             callback: Optional[Callable[[ScreeningResult], None]] = None  # noqa: pycodestyle
+                             ) -> List[ScreeningResult]:
+        """
+        Determines which of a batch of perturbations (e.g., those returned by
+        `perturbations`) would be killed by the test suite, without injecting
+        any of them. Perturbations are screened in parallel within a pool of
+        containers for the baseline that is shared by the whole batch. The
+        state of the orchestrator is unaffected.
+
+        Parameters:
+            perturbations: the perturbations that should be screened.
+            callback: called with the result for each perturbation as soon
+                as it has been screened.
+
+        Returns:
+            a result for each perturbation, describing whether it was killed
+            or neutral, the name of the test that killed it, and the time
+            taken to screen it. Killed perturbations are ranked first, in
+            ascending order of the time taken to kill them.
+        """
+        logger.info("Screening %d perturbations for liveness.",
+                    len(perturbations))
+        with self.__metrics.time('screening'), \
+                self.__concurrency.track(Stage.LIVENESS) as threads:
+            results = screen_mutations(self.__client_bugzoo,
+                                       self.__client_boggart,
+                                       self.__baseline,
+                                       perturbations,
+                                       threads=threads,
+                                       scheduler=self.__test_scheduler,
+                                       kill_matrix=self.__kill_matrix,
+                                       callback=callback)
+        for result in results:
+            self.__metrics.counter('screened_perturbations_total',
+                                   'number of screened perturbations',
+                                   outcome=result.outcome.value).inc()
+        logger.info("Screened %d perturbations: %d killed.",
+                    len(results), sum(1 for r in results if r.killed))
+        return results
+
+    def _record_evaluation_metrics(self,
+                                   log: List[CandidateEvaluation]
+                                   ) -> None:
+        """
+        Records the time taken to build and test each evaluated candidate.
+        """
+        metrics = self.__metrics
+        for evaluation in log:
+            metrics.counter('candidates_total',
+                            'number of evaluated candidate patches').inc()
+            build = evaluation.build
+            if not build:
+                continue
+            metrics.observe_duration('candidate-build', build.time_taken)
+            if not build.successful:
+                metrics.counter('candidate_build_failures_total',
+                                'number of candidate patches that failed to build').inc()  # noqa: pycodestyle
+                continue
+            for name in evaluation.tests:
+                metrics.observe_duration('candidate-test',
+                                         evaluation.tests[name].time_taken)
+
+    def _count_evaluation_timeouts(self, problem: Problem) -> int:
+        """
+        Counts the number of test executions, across all candidates that
+        were evaluated by the current search, that failed after exceeding
+        their time limit.
+        """
+        time_limits = {t.name: t.time_limit for t in problem.tests}
+        timeouts = 0
+        for patch in self.__searcher.history:
+            try:
+                outcome = self.__searcher.outcomes[patch]
+            except KeyError:
+                continue
+            for name in outcome.tests:
+                test = outcome.tests[name]
+                time_limit = time_limits.get(name)
+                if not test.successful and time_limit and \
+                        test.time_taken >= time_limit:
+                    timeouts += 1
+        return timeouts
+
     def _patch_to_evaluation(self, patch: Candidate) -> CandidateEvaluation:
         """
         Transforms a Darjeeling patch data structure into its Orchestrator
@@ -364,30 +762,77 @@ class Orchestrator(object):
                                    self.__searcher.outcomes[patch],
                                    str(patch.to_diff(self.__problem)))
 
-    def _build_problem(self, perturbation: Mutation) -> Problem:
+    def _build_problem(self,
+                       perturbation: Mutation,
+                       job: Optional[PerturbationJob] = None
+                       ) -> Problem:
         """
-        Transforms the scenario into a repair problem.
+        Transforms the scenario into a repair problem. If a job is given, its
+        progress is updated as each stage begins.
 
         Raises:
             FailedToComputeCoverage: if an error occurred during the coverage
                 computing process.
+            PerturbationCancelled: if the given job was cancelled.
         """
+        def advance(stage: PerturbationStage) -> None:
+            if job:
+                job.advance(stage)
+
         try:
             snapshot = self.__client_bugzoo.bugs[perturbation.snapshot]
+            advance(PerturbationStage.COMPUTING_COVERAGE)
             self.__coverage_for_mutant = \
-                compute_mutant_coverage(self.__client_bugzoo,
-                                        self.__client_boggart,
-                                        perturbation,
-                                        threads=self.__num_threads)
-            self.__localization = localize(perturbation,
-                                           self.__coverage_for_mutant)
+                self.__coverage_cache.get(self.__baseline,
+                                          perturbation.mutations,
+                                          self.__test_selection)
+            if self.__coverage_for_mutant is not None:
+                logger.info("using cached coverage for mutant: %s",
+                            perturbation.uuid)
+            else:
+                with self.__metrics.time('coverage'), \
+                        self.__concurrency.track(Stage.COVERAGE) as threads:
+                    coverage = \
+                        compute_selected_coverage(self.__client_bugzoo,
+                                                  self.__client_boggart,
+                                                  perturbation,
+                                                  threads=threads,
+                                                  selection=self.__test_selection,  # noqa: pycodestyle
+                                                  metrics=self.__metrics,
+                                                  analysis_cache=self.__analysis_cache)  # noqa: pycodestyle
+                    timeouts = [t for t in coverage
+                                if timed_out(coverage[t].outcome)]
+                    if timeouts:
+                        logger.warning("tests exceeded their time limit during coverage: %s",  # noqa: pycodestyle
+                                       ', '.join(timeouts))
+                        self.__concurrency.report_failure(Stage.COVERAGE)
+                self.__coverage_cache.put(self.__baseline,
+                                          perturbation.mutations,
+                                          coverage,
+                                          self.__test_selection)
+                self.__coverage_for_mutant = merge_with_baseline(coverage)
+            advance(PerturbationStage.LOCALIZING)
+            with self.__metrics.time('localization'):
+                self.__localization = localize(perturbation,
+                                               self.__coverage_for_mutant)
             self.__coverage_for_mutant = \
                 self.__coverage_for_mutant.restricted_to_files(self.__localization.files)
             covered_files = self.__coverage_for_mutant.failing.lines.files
+            advance(PerturbationStage.ANALYSING)
             logger.info("performing static analysis (may take a few minutes)")
             time_start = timer()
-            analysis = \
-                Analysis.build(self.__client_bugzoo, snapshot, covered_files)
+            file_to_key = \
+                {fn: AnalysisCache.content_key(self.__baseline,
+                                               fn,
+                                               perturbation.mutations)
+                 for fn in covered_files}
+            with self.__metrics.time('static-analysis'), \
+                    self.__concurrency.track(Stage.ANALYSIS) as threads:
+                analysis = \
+                    self.__analysis_cache.build(self.__client_bugzoo,
+                                                snapshot,
+                                                file_to_key,
+                                                threads=threads)
             time_taken = timer() - time_start
             logger.info("finished static analysis (took %.3f seconds)",
                         time_taken)
@@ -397,6 +842,10 @@ class Orchestrator(object):
                         self.__coverage_for_mutant,
                         perturbation,
                         analysis)
+        except PerturbationCancelled:
+            self.__localization = None
+            self.__coverage_for_mutant = None
+            raise
         except Exception:
             self.__localization = None
             self.__coverage_for_mutant = None
@@ -404,66 +853,126 @@ class Orchestrator(object):
             raise FailedToComputeCoverage
         return problem
 
-    def perturb(self, perturbation: Mutation) -> None:
+    def perturb(self,
+                perturbation: Mutation,
+                *,
+                wait: bool = True,
+                callback_progress: Optional[Callable[[PerturbationJob], None]] = None  # noqa: pycodestyle
+                ) -> PerturbationJob:
         """
         Attempts to generate baseline B by perturbing the original system.
+        The perturbation is injected on a background thread.
 
         Parameters:
             perturbation: the perturbation that should be applied.
+            wait: if True, this method blocks until the perturbation has
+                been injected and raises any error that occurred. Otherwise,
+                it returns as soon as the perturbation has been scheduled.
+            callback_progress: called with the job for the perturbation
+                whenever it begins a new stage, and once it has finished.
+
+        Returns:
+            a handle for the job that injects the perturbation, which may be
+            used to poll its status or to cancel it. The same handle is
+            given by the `perturbation_job` property.
 
         Raises:
             NotReadyToPerturb: if the system is not ready to be perturbed.
             NeutralPerturbation: if the given mutant does not fail any tests.
+                Only raised if `wait` is True.
             FailedToComputeCoverage: if coverage information could not be
-                obtained for the given mutant.
+                obtained for the given mutant. Only raised if `wait` is True.
         """
         logger.info("Attempting to perturb system using mutation: %s",
                     perturbation)
-        bz = self.__client_bugzoo
-        boggartd = self.__client_boggart
-        baseline = self.__baseline
         with self.__lock:
             if self.state != OrchestratorState.READY_TO_PERTURB:
                 logger.warning("System is not ready to be perturbed [state: %s]",  # noqa: pycodestyle
                                str(self.state))
                 raise NotReadyToPerturb
-
-            mutant = None
             self.__state = OrchestratorState.PERTURBING
+            job = PerturbationJob(perturbation, callback_progress)
+            self.__perturbation_job = job
+
+        logger.debug("starting perturbation thread for job: %s", job.uid)
+        thread = threading.Thread(target=self._perturb, args=(job,))
+        thread.start()
+        if wait:
+            job.result()
+        return job
+
+    def _perturb(self, job: PerturbationJob) -> None:
+        """
+        Injects the perturbation for a given job. Any errors are recorded by
+        the job, and the system is returned to a state in which it may be
+        perturbed.
+        """
+        perturbation = job.perturbation
+        bz = self.__client_bugzoo
+        boggartd = self.__client_boggart
+        baseline = self.__baseline
+        mutant = None
+        try:
             try:
-                try:
-                    # TODO capture unexpected errors during snapshot creation
-                    logger.debug("Applying perturbation to baseline snapshot.")
+                # TODO capture unexpected errors during snapshot creation
+                job.advance(PerturbationStage.MUTATING)
+                logger.debug("Applying perturbation to baseline snapshot.")
+                with self.__metrics.time('mutate'):
                     mutant = boggartd.mutate(baseline, [perturbation])
-                    snapshot = bz.bugs[mutant.snapshot]
-                    logger.info("Generated mutant snapshot: %s", snapshot.name)
-                    if not mutant_fails_test(bz, boggartd, mutant):
-                        raise NeutralPerturbation
-                    self.__problem = self._build_problem(mutant)
-                    self.__state = OrchestratorState.READY_TO_ADAPT
-                    logger.info("Transformed perturbed code into a repair problem.")  # noqa: pycodestyle
-                except OrchestratorError:
+                snapshot = bz.bugs[mutant.snapshot]
+                logger.info("Generated mutant snapshot: %s", snapshot.name)
+                job.advance(PerturbationStage.CHECKING_LIVENESS)
+                with self.__metrics.time('liveness'), \
+                        self.__concurrency.track(Stage.LIVENESS) as threads:  # noqa: pycodestyle
+                    killed = \
+                        mutant_fails_test(bz, boggartd, mutant,
+                                          threads=threads,
+                                          scheduler=self.__test_scheduler,
+                                          kill_matrix=self.__kill_matrix,
+                                          controller=self.__concurrency)
+                if not killed:
+                    self.__metrics.counter('perturbations_total',
+                                           'number of attempted perturbations',  # noqa: pycodestyle
+                                           outcome='neutral').inc()
                     raise NeutralPerturbation
-                except Exception as e:
-                    raise UnexpectedError(e)
+                problem = self._build_problem(mutant, job)
+                job.commit()
+                with self.__lock:
+                    self.__problem = problem
+                    self.__state = OrchestratorState.READY_TO_ADAPT
+                self.__metrics.counter('perturbations_total',
+                                       'number of attempted perturbations',  # noqa: pycodestyle
+                                       outcome='accepted').inc()
+                logger.info("Transformed perturbed code into a repair problem.")  # noqa: pycodestyle
+            except PerturbationCancelled:
+                self.__metrics.counter('perturbations_total',
+                                       'number of attempted perturbations',  # noqa: pycodestyle
+                                       outcome='cancelled').inc()
+                raise
             except OrchestratorError:
-                # deregister the mutant
-                if mutant:
-                    logger.debug("destroying mutant for perturbation.")
-                    try:
-                        del boggartd.mutants[mutant.uuid]
-                    except Exception:
-                        logger.exception("failed to destroy mutant for perturbation")
-                        raise
+                raise NeutralPerturbation
+            except Exception as e:
+                raise UnexpectedError(e)
+        except OrchestratorError as err:
+            # deregister the mutant
+            if mutant:
+                logger.debug("destroying mutant for perturbation.")
+                try:
+                    del boggartd.mutants[mutant.uuid]
                     logger.debug("destroyed mutant for perturbation")
+                except Exception:
+                    logger.exception("failed to destroy mutant for perturbation")  # noqa: pycodestyle
 
-                logger.debug("Resetting system state to be ready to perturb.")
+            logger.debug("Resetting system state to be ready to perturb.")
+            with self.__lock:
                 self.__problem = None
                 self.__state = OrchestratorState.READY_TO_PERTURB
-                logger.debug("System is now ready to perturb.")
-                raise
+            logger.debug("System is now ready to perturb.")
+            job.finish(err)
+            return
         logger.info("Successfully perturbed system using mutation: %s",
                     perturbation)
+        job.finish()
 
     def adapt(self,
               *,
@@ -511,32 +1020,63 @@ class Orchestrator(object):
                 try:
                     problem = self.__problem
                     assert self.__localization is not None
-                    candidates = build_search_space(problem,
-                                                    self.__localization)
-                    logger.debug("constructing search mechanism")
-                    self.__searcher = Searcher(bugzoo=self.__client_bugzoo,
-                                               problem=problem,
-                                               candidates=candidates,
-                                               threads=self.__num_threads,
-                                               candidate_limit=attempts,
-                                               time_limit=time_limit)
-                    logger.debug("constructed search mechanism")
-                    logger.info("beginning search")
-
-                    for patch in self.__searcher:
-                        evaluation = self._patch_to_evaluation(patch)
-                        self.__patches.append(evaluation)
-                        self.__callback_progress(evaluation, self.patches)
-
-                        # NOTE our evaluation outcome can't improve after we've
-                        # found a complete repair, so let's terminate the
-                        # search.
-                        break
+                    ranker = None  # type: Optional[CandidateRanker]
+                    if self.__rank_candidates:
+                        ranker = CandidateRanker(problem.mutant,
+                                                 self.__localization,
+                                                 load_schema_history())
+                    with self.__metrics.time('search-space'):
+                        candidates = build_search_space(problem,
+                                                        self.__localization,
+                                                        lazy=self.__lazy_search_space,  # noqa: pycodestyle
+                                                        threads=self.__concurrency.limit(Stage.SEARCH_SPACE),  # noqa: pycodestyle
+                                                        ranker=ranker)
+                    time_search_start = timer()
+                    with self.__concurrency.track(Stage.EVALUATION) as threads:  # noqa: pycodestyle
+                        logger.debug("constructing search mechanism")
+                        self.__searcher = Searcher(bugzoo=self.__client_bugzoo,
+                                                   problem=problem,
+                                                   candidates=candidates,
+                                                   threads=threads,
+                                                   candidate_limit=attempts,
+                                                   time_limit=time_limit)
+                        logger.debug("constructed search mechanism")
+                        if self.__closing.is_set():
+                            self.__searcher.stop()
+                        logger.info("beginning search")
+
+                        for patch in self.__searcher:
+                            evaluation = self._patch_to_evaluation(patch)
+                            self.__patches.append(evaluation)
+                            self.__callback_progress(evaluation, self.patches)
+
+                            # NOTE our evaluation outcome can't improve after
+                            # we've found a complete repair, so let's
+                            # terminate the search.
+                            break
+
+                        timeouts = self._count_evaluation_timeouts(problem)
+                        if timeouts:
+                            logger.warning("%d candidate tests exceeded their time limit",  # noqa: pycodestyle
+                                           timeouts)
+                            self.__concurrency.report_failure(Stage.EVALUATION)  # noqa: pycodestyle
 
                     self.__state = OrchestratorState.FINISHED
                     logger.info("finished search")
                     log = [self._patch_to_evaluation(p)
                            for p in self.__searcher.history]
+                    self.__metrics.observe_duration('search',
+                                                    timer() - time_search_start)  # noqa: pycodestyle
+                    self._record_evaluation_metrics(log)
+
+                    # learn which schemas repair this kind of perturbation
+                    if ranker:
+                        ranker.record([(transformation,
+                                        evaluation.is_complete_repair)
+                                       for (patch, evaluation) in
+                                       zip(self.__searcher.history, log)
+                                       for transformation in
+                                       patch.transformations])
 
                     # determine the outcome of the search
                     if self.patches:
@@ -559,7 +1099,7 @@ class Orchestrator(object):
 
             # TODO ensure that thread is killed cleanly
             logger.debug("creating search thread")
-            thread = threading.Thread(target=search)
+            self.__search_thread = threading.Thread(target=search)
             logger.debug("starting search thread")
-            thread.start()
+            self.__search_thread.start()
             logger.info("finished triggered adaptation")
@@ -0,0 +1,494 @@
+"""
+This module provides a persistent, on-disk index of all of the perturbations
+that can be made to each mutable file in the baseline snapshot.
+"""
+from typing import Dict, List, Optional, Iterable, Iterator, Callable, Any
+import concurrent.futures
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+from timeit import default_timer as timer
+
+from bugzoo.core.bug import Bug as Snapshot
+from bugzoo.core.fileline import FileLineSet
+from boggart import Client as BoggartClient
+from boggart import Mutation
+
+from .cache import CACHE_DIR, DiskCache
+from .snapshot import snapshot_identity, fetch_image_digest
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['PerturbationIndex', 'PerturbationRecord']
+
+# bumped whenever the format of the index is changed
+INDEX_VERSION = 2
+
+# the name of the file, within an index, that records the digest of the
+# Docker image for the baseline snapshot
+IMAGE_DIGEST_FN = 'image'
+
+
+def _covers(mutation: Mutation, line_num: int) -> bool:
+    # boggart associates each mutation with the line on which it starts
+    return mutation.location.start.line == line_num
+
+
+def _canonical_key(mutation: Mutation) -> Any:
+    """
+    Orders perturbations by their location, then by operator, regardless of
+    the order in which boggart produced them.
+    """
+    location = mutation.location
+    return (location.start.line, location.start.column,
+            location.stop.line, location.stop.column,
+            mutation.operator, mutation.transformation_index,
+            sorted(mutation.arguments.items()))
+
+
+class PerturbationRecord(object):
+    """
+    Describes a single perturbation, found during a bulk enumeration.
+    """
+    def __init__(self, mutation: Mutation) -> None:
+        self.__mutation = mutation
+
+    @property
+    def filename(self) -> str:
+        """
+        The name of the perturbed file.
+        """
+        return self.__mutation.location.filename
+
+    @property
+    def line_num(self) -> int:
+        """
+        The one-indexed number of the first perturbed line.
+        """
+        return self.__mutation.location.start.line
+
+    @property
+    def operator(self) -> str:
+        """
+        The name of the mutation operator that produced the perturbation.
+        """
+        return self.__mutation.operator
+
+    @property
+    def mutation(self) -> Mutation:
+        """
+        The perturbation itself.
+        """
+        return self.__mutation
+
+    def __repr__(self) -> str:
+        return "PerturbationRecord({}:{}, {})".format(self.filename,
+                                                       self.line_num,
+                                                       self.operator)
+
+
+class _EnumerationDone(object):
+    """
+    Signals that a single task within a bulk enumeration has finished.
+    """
+    def __init__(self,
+                 filename: str,
+                 mutations: List[Mutation],
+                 time_start: float,
+                 time_stop: float
+                 ) -> None:
+        self.filename = filename
+        self.mutations = mutations
+        self.time_start = time_start
+        self.time_stop = time_stop
+
+
+class _EnumerationFailed(object):
+    """
+    Signals that a single task within a bulk enumeration has failed.
+    """
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+
+class PerturbationIndex(object):
+    """
+    Stores the complete set of perturbations for each mutable file in the
+    baseline snapshot, across all supported mutation operators.
+
+    Perturbations for a file are enumerated using boggart the first time that
+    file is queried, and are written to disk so that subsequent queries, in
+    this or any later process, can be answered without contacting boggart.
+    The index is stored in a directory named after a digest of the baseline
+    snapshot description and the set of operators; a change to either of
+    these invalidates the index. The digest of the Docker image for the
+    baseline is recorded alongside the index, which is discarded if the
+    digest changes. If the digest cannot be determined (e.g., because the
+    image is only available to a remote BugZoo server), the index is used
+    as is. Perturbations for each file are stored in a canonical order.
+    """
+    def __init__(self,
+                 client_boggart: BoggartClient,
+                 baseline: Snapshot,
+                 lines: FileLineSet,
+                 operators: List[str],
+                 *,
+                 directory: Optional[str] = None
+                 ) -> None:
+        """
+        Constructs a new perturbation index.
+
+        Parameters:
+            client_boggart: a connection to the boggart server.
+            baseline: the baseline snapshot.
+            lines: the set of lines that may be perturbed.
+            operators: the names of the supported mutation operators.
+            directory: the directory in which indices should be stored.
+                Defaults to a directory within the orchestrator cache.
+        """
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, 'perturbations')
+        self.__client_boggart = client_boggart
+        self.__baseline = baseline
+        self.__lines = lines
+        self.__operators = list(operators)
+        self.__identity = DiskCache.key(INDEX_VERSION,
+                                        snapshot_identity(baseline),
+                                        sorted(operators))
+        self.__root = directory
+        self.__directory = os.path.join(directory, self.__identity)
+        self.__file_to_mutations = {}  # type: Dict[str, List[Mutation]]
+        self.__lock = threading.Lock()
+        self.__file_locks = {}  # type: Dict[str, threading.Lock]
+        os.makedirs(self.__directory, exist_ok=True)
+        self._prune()
+        self._check_image_digest(fetch_image_digest(baseline))
+
+    @property
+    def identity(self) -> str:
+        """
+        A digest that identifies the baseline and operators that were used
+        to build this index.
+        """
+        return self.__identity
+
+    @property
+    def directory(self) -> str:
+        """
+        The directory in which this index is stored.
+        """
+        return self.__directory
+
+    def _prune(self) -> None:
+        """
+        Removes indices for other baselines or operators.
+        """
+        for name in os.listdir(self.__root):
+            path = os.path.join(self.__root, name)
+            if name == self.__identity or not os.path.isdir(path):
+                continue
+            logger.info("removing stale perturbation index: %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _check_image_digest(self, digest: Optional[str]) -> None:
+        """
+        Discards the contents of this index if it was built for a different
+        Docker image, and records the digest of the current image. Nothing is
+        discarded unless both digests are known.
+        """
+        if digest is None:
+            logger.warning("unable to verify perturbation index against image: %s",  # noqa: pycodestyle
+                           self.__baseline.image)
+            return
+        fn = os.path.join(self.__directory, IMAGE_DIGEST_FN)
+        try:
+            with open(fn, 'r') as f:
+                digest_index = f.read().strip()
+        except OSError:
+            digest_index = None
+        if digest_index == digest:
+            return
+        if digest_index is not None:
+            logger.info("discarding perturbation index for old image: %s",
+                        self.__directory)
+            self.invalidate()
+        try:
+            with open(fn, 'w') as f:
+                f.write(digest)
+        except OSError:
+            logger.exception("failed to record image digest for perturbation index: %s",  # noqa: pycodestyle
+                             self.__directory)
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.__directory,
+                            DiskCache.key(filename) + '.json')
+
+    def _file_lock(self, filename: str) -> threading.Lock:
+        with self.__lock:
+            if filename not in self.__file_locks:
+                self.__file_locks[filename] = threading.Lock()
+            return self.__file_locks[filename]
+
+    def _save(self, filename: str, mutations: List[Mutation]) -> None:
+        fn = self._path(filename)
+        fn_tmp = '{}.tmp.{}'.format(fn, os.getpid())
+        jsn = {'file': filename,
+               'mutations': [m.to_dict() for m in mutations]}
+        try:
+            with open(fn_tmp, 'w') as f:
+                json.dump(jsn, f, separators=(',', ':'))
+            os.replace(fn_tmp, fn)
+        except OSError:
+            logger.exception("failed to write perturbation index for file: %s",
+                             filename)
+            if os.path.exists(fn_tmp):
+                os.remove(fn_tmp)
+
+    def _load(self, filename: str) -> Optional[List[Mutation]]:
+        fn = self._path(filename)
+        if not os.path.exists(fn):
+            return None
+        try:
+            with open(fn, 'r') as f:
+                jsn = json.load(f)
+            return [Mutation.from_dict(m) for m in jsn['mutations']]
+        except Exception:
+            logger.exception("failed to read perturbation index for file: %s",
+                             filename)
+            return None
+
+    def is_indexed(self, filename: str) -> bool:
+        """
+        Determines whether the perturbations for a given file have been
+        indexed.
+        """
+        return filename in self.__file_to_mutations \
+            or os.path.exists(self._path(filename))
+
+    def _cached(self, filename: str) -> Optional[List[Mutation]]:
+        """
+        Returns the indexed perturbations for a given file, or None if that
+        file has not been indexed.
+        """
+        try:
+            return self.__file_to_mutations[filename]
+        except KeyError:
+            pass
+        with self._file_lock(filename):
+            if filename not in self.__file_to_mutations:
+                mutations = self._load(filename)
+                if mutations is None:
+                    return None
+                self.__file_to_mutations[filename] = mutations
+        return self.__file_to_mutations[filename]
+
+    def _stream(self, filename: str) -> Iterator[Mutation]:
+        """
+        Streams all perturbations for a given file from boggart. If the
+        stream is consumed in its entirety, its contents are added to the
+        index.
+        """
+        boggartd = self.__client_boggart
+        operators = [boggartd.operators[name] for name in self.__operators]
+        restrict_to_lines = [l.num for l in self.__lines[filename]]
+        logger.info("indexing perturbations in file: %s", filename)
+        time_start = timer()
+        mutations = []  # type: List[Mutation]
+        for mutation in boggartd.mutations(self.__baseline,
+                                           filepath=filename,
+                                           operators=operators,
+                                           restrict_to_lines=restrict_to_lines):
+            mutations.append(mutation)
+            yield mutation
+        logger.info("indexed %d perturbations in file %s (took %.3f seconds)",
+                    len(mutations), filename, timer() - time_start)
+        self._add(filename, mutations)
+
+    def _add(self, filename: str, mutations: List[Mutation]) -> None:
+        """
+        Adds the complete set of perturbations for a given file to the index.
+        """
+        mutations = sorted(mutations, key=_canonical_key)
+        with self._file_lock(filename):
+            if filename not in self.__file_to_mutations:
+                self._save(filename, mutations)
+                self.__file_to_mutations[filename] = mutations
+
+    def in_file(self, filename: str) -> List[Mutation]:
+        """
+        Returns all perturbations for a given file, building the index for
+        that file if necessary.
+        """
+        mutations = self._cached(filename)
+        if mutations is None:
+            for _ in self._stream(filename):
+                pass
+            mutations = self.__file_to_mutations[filename]
+        return mutations
+
+    def iter_mutations(self,
+                       filename: str,
+                       line_num: Optional[int] = None,
+                       op_name: Optional[str] = None
+                       ) -> Iterator[Mutation]:
+        """
+        Returns an iterator over all perturbations for a given file,
+        optionally restricted to those that cover a given line and those that
+        are produced by a given operator. If the file has not been indexed,
+        perturbations are streamed from boggart as they are found.
+        """
+        mutations = self._cached(filename)
+        if mutations is None:
+            mutations = self._stream(filename)
+        for mutation in mutations:
+            if line_num is not None and not _covers(mutation, line_num):
+                continue
+            if op_name is not None and mutation.operator != op_name:
+                continue
+            yield mutation
+
+    def mutations(self,
+                  filename: str,
+                  line_num: Optional[int] = None,
+                  op_name: Optional[str] = None
+                  ) -> List[Mutation]:
+        """
+        Returns all perturbations for a given file, optionally restricted to
+        those that cover a given line and those that are produced by a given
+        operator.
+        """
+        self.in_file(filename)
+        return list(self.iter_mutations(filename, line_num, op_name))
+
+    def enumerate_all(self,
+                      files: Optional[Iterable[str]] = None,
+                      operators: Optional[Iterable[str]] = None,
+                      *,
+                      threads: int = 4,
+                      callback_timing: Optional[Callable[[str, float], None]] = None  # noqa: pycodestyle
+                      ) -> Iterator[PerturbationRecord]:
+        """
+        Enumerates the perturbations for many files at once. Perturbations
+        for files that have already been indexed are read from the index;
+        all other files are enumerated by boggart using a bounded pool of
+        threads, with one task per file and operator. Results are produced
+        as soon as they are found, in no particular order.
+
+        Parameters:
+            files: the files that should be enumerated. Defaults to all
+                mutable files.
+            operators: the names of the operators that should be used.
+                Defaults to all supported operators.
+            threads: the maximum number of concurrent requests to boggart.
+            callback_timing: called with the name of each file and the
+                wall-clock time, in seconds, taken to enumerate it, once
+                that file has been enumerated.
+
+        Raises:
+            Exception: if boggart fails to enumerate perturbations for a
+                file.
+        """
+        assert threads > 0
+        files = list(self.__lines.files if files is None else files)
+        operators = list(self.__operators if operators is None else operators)
+        is_complete = set(operators) == set(self.__operators)
+
+        def report(filename: str, duration: float) -> None:
+            logger.debug("enumerated perturbations in file %s (took %.3f seconds)",  # noqa: pycodestyle
+                         filename, duration)
+            if callback_timing:
+                callback_timing(filename, duration)
+
+        remaining = []  # type: List[str]
+        for filename in files:
+            time_start = timer()
+            mutations = self._cached(filename)
+            if mutations is None:
+                remaining.append(filename)
+                continue
+            for mutation in mutations:
+                if mutation.operator in operators:
+                    yield PerturbationRecord(mutation)
+            report(filename, timer() - time_start)
+
+        if not remaining:
+            return
+
+        boggartd = self.__client_boggart
+        results = queue.Queue()  # type: queue.Queue
+        stopped = threading.Event()
+
+        def enumerate_file(filename: str, op_name: str) -> None:
+            try:
+                time_start = timer()
+                found = []  # type: List[Mutation]
+                lines = [l.num for l in self.__lines[filename]]
+                for mutation in boggartd.mutations(self.__baseline,
+                                                   filepath=filename,
+                                                   operators=[boggartd.operators[op_name]],  # noqa: pycodestyle
+                                                   restrict_to_lines=lines):
+                    if stopped.is_set():
+                        return
+                    found.append(mutation)
+                    results.put(PerturbationRecord(mutation))
+                results.put(_EnumerationDone(filename, found,
+                                             time_start, timer()))
+            except Exception as err:
+                results.put(_EnumerationFailed(err))
+
+        # file -> [mutations, time_start, time_stop, outstanding tasks]
+        progress = {fn: [[], None, None, len(operators)]
+                     for fn in remaining}  # type: Dict[str, List[Any]]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        futures = [executor.submit(enumerate_file, fn, op)
+                   for fn in remaining for op in operators]
+        outstanding = len(futures)
+        try:
+            while outstanding > 0:
+                item = results.get()
+                if isinstance(item, PerturbationRecord):
+                    yield item
+                    continue
+                if isinstance(item, _EnumerationFailed):
+                    raise item.error
+
+                outstanding -= 1
+                state = progress[item.filename]
+                state[0] += item.mutations
+                state[1] = min(state[1] or item.time_start, item.time_start)
+                state[2] = max(state[2] or item.time_stop, item.time_stop)
+                state[3] -= 1
+                if state[3] == 0:
+                    if is_complete:
+                        self._add(item.filename, state[0])
+                    report(item.filename, state[2] - state[1])
+        finally:
+            stopped.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def build(self,
+              files: Optional[Iterable[str]] = None,
+              *,
+              threads: int = 4
+              ) -> None:
+        """
+        Ensures that the perturbations for each of the given files, or for
+        all mutable files if none are given, have been indexed.
+        """
+        for _ in self.enumerate_all(files, threads=threads):
+            pass
+
+    def invalidate(self) -> None:
+        """
+        Discards the contents of this index.
+        """
+        with self.__lock:
+            self.__file_to_mutations = {}
+            shutil.rmtree(self.__directory, ignore_errors=True)
+            os.makedirs(self.__directory, exist_ok=True)
@@ -0,0 +1,187 @@
+"""
+This module provides a pool of reusable containers for a given snapshot,
+allowing tests to be executed without provisioning a fresh container for
+each one.
+"""
+from typing import Iterator, List, Optional, Set
+import contextlib
+import logging
+import threading
+
+from bugzoo.client import Client as BugZooClient
+from bugzoo.core.bug import Bug as Snapshot
+from bugzoo.core.container import Container
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['ContainerPool']
+
+# removes the gcov counters produced by a previous test execution
+RESET_COVERAGE_COMMAND = "find . -name '*.gcda' -delete"
+
+
+class ContainerPool(object):
+    """
+    Maintains a bounded set of containers for a given snapshot. Each worker
+    borrows a container for the duration of a single test and returns it to
+    the pool afterwards. Containers are reset before they are reused, and are
+    destroyed and replaced if they fail or become unhealthy.
+    """
+    def __init__(self,
+                 client_bugzoo: BugZooClient,
+                 snapshot: Snapshot,
+                 size: int,
+                 *,
+                 reset_coverage: bool = False
+                 ) -> None:
+        """
+        Constructs a new container pool.
+
+        Parameters:
+            client_bugzoo: a connection to the BugZoo server.
+            snapshot: the snapshot used to provision containers.
+            size: the maximum number of containers that may be provisioned at
+                any given time.
+            reset_coverage: if True, coverage counters are cleared before a
+                container is returned to the pool.
+        """
+        assert size > 0
+        self.__client_bugzoo = client_bugzoo
+        self.__snapshot = snapshot
+        self.__size = size
+        self.__reset_coverage = reset_coverage
+        self.__idle = []  # type: List[Container]
+        # the UIDs of borrowed containers that must not be reused
+        self.__discarded = set()  # type: Set[str]
+        self.__num_provisioned = 0
+        self.__closed = False
+        self.__cv = threading.Condition()
+
+    def __enter__(self) -> 'ContainerPool':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @property
+    def snapshot(self) -> Snapshot:
+        """
+        The snapshot used to provision containers.
+        """
+        return self.__snapshot
+
+    @property
+    def size(self) -> int:
+        """
+        The maximum number of containers that may exist at any given time.
+        """
+        return self.__size
+
+    def _acquire(self) -> Container:
+        with self.__cv:
+            while not self.__closed and not self.__idle \
+                    and self.__num_provisioned >= self.__size:
+                self.__cv.wait()
+            if self.__closed:
+                raise RuntimeError("container pool has been closed")
+            if self.__idle:
+                return self.__idle.pop()
+            self.__num_provisioned += 1
+
+        try:
+            logger.debug("provisioning container for snapshot: %s",
+                         self.__snapshot.name)
+            return self.__client_bugzoo.containers.provision(self.__snapshot)
+        except Exception:
+            with self.__cv:
+                self.__num_provisioned -= 1
+                self.__cv.notify()
+            raise
+
+    def _reset(self, container: Container) -> bool:
+        """
+        Prepares a container for reuse.
+
+        Returns:
+            True if the container is healthy and was successfully reset, or
+            False if it should be discarded.
+        """
+        mgr_ctr = self.__client_bugzoo.containers
+        try:
+            if not mgr_ctr.is_alive(container):
+                logger.warning("container is no longer alive: %s",
+                               container.uid)
+                return False
+            if self.__reset_coverage:
+                response = mgr_ctr.exec(container,
+                                        RESET_COVERAGE_COMMAND,
+                                        self.__snapshot.source_dir)
+                if response.code != 0:
+                    logger.warning("failed to reset coverage for container: %s",  # noqa: pycodestyle
+                                   container.uid)
+                    return False
+        except Exception:
+            logger.exception("failed to reset container: %s", container.uid)
+            return False
+        return True
+
+    def _destroy(self, container: Container) -> None:
+        try:
+            del self.__client_bugzoo.containers[container.uid]
+        except Exception:
+            logger.exception("failed to destroy container: %s", container.uid)
+
+    def _release(self, container: Container, healthy: bool) -> None:
+        with self.__cv:
+            if container.uid in self.__discarded:
+                self.__discarded.remove(container.uid)
+                healthy = False
+        healthy = healthy and not self.__closed and self._reset(container)
+        with self.__cv:
+            if healthy and not self.__closed:
+                self.__idle.append(container)
+                self.__cv.notify()
+                return
+            self.__num_provisioned -= 1
+            self.__cv.notify()
+        logger.debug("recycling container: %s", container.uid)
+        self._destroy(container)
+
+    @contextlib.contextmanager
+    def container(self) -> Iterator[Container]:
+        """
+        Borrows a container from the pool for the duration of a with block.
+        If an exception is raised within the block, the container is
+        destroyed rather than returned to the pool.
+        """
+        container = self._acquire()
+        healthy = False
+        try:
+            yield container
+            healthy = True
+        finally:
+            self._release(container, healthy)
+
+    def discard(self, container: Container) -> None:
+        """
+        Ensures that a borrowed container is destroyed, rather than returned
+        to the pool, once it is released (e.g., because its state can no
+        longer be trusted).
+        """
+        with self.__cv:
+            self.__discarded.add(container.uid)
+
+    def close(self) -> None:
+        """
+        Destroys all idle containers. Containers that are currently borrowed
+        are destroyed when they are returned to the pool.
+        """
+        with self.__cv:
+            self.__closed = True
+            idle = self.__idle
+            self.__idle = []
+            self.__num_provisioned -= len(idle)
+            self.__cv.notify_all()
+        for container in idle:
+            self._destroy(container)
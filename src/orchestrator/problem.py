@@ -64,6 +64,7 @@ class Problem(darjeeling.problem.Problem):
                  analysis: Analysis
                  ) -> None:
         self.__client_bugzoo = client_bugzoo
+        self.__mutant = mutant
         snapshot = client_bugzoo.bugs[mutant.snapshot]
         super().__init__(bz=client_bugzoo,
                          bug=snapshot,
@@ -71,6 +72,13 @@ class Problem(darjeeling.problem.Problem):
                          client_rooibos=client_rooibos,
                          analysis=analysis)
 
+    @property
+    def mutant(self) -> Mutant:
+        """
+        The perturbation that should be repaired.
+        """
+        return self.__mutant
+
     def build_patch(self,
                     patch: Patch,
                     builder: Optional[Callable[[Container], BuildOutcome]] = None
@@ -0,0 +1,245 @@
+"""
+This module is responsible for prioritising candidate transformations using
+knowledge of the perturbation that was injected into the system. Candidates
+that are close to the perturbed location, and whose schema is likely to undo
+the mutation operator that was applied, are attempted first.
+"""
+from typing import Dict, List, Iterable, Optional, Tuple
+import json
+import logging
+import os
+import threading
+
+from boggart.core.mutant import Mutant
+from darjeeling.transformation import Transformation
+from darjeeling.localization import Localization
+
+from .cache import cache_path
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['CandidateRanker', 'load_schema_history']
+
+SCHEMA_HISTORY_VERSION = 1
+
+# the names of the transformation schemas that are able to undo each of the
+# mutation operators that are used to perturb the system
+OPERATOR_INVERSES = {
+    'flip-arithmetic-operator': [
+        'PlusToMinus', 'MinusToPlus', 'MulToDiv', 'DivToMul'
+    ],
+    'flip-boolean-operator': ['AndToOr', 'OrToAnd'],
+    'flip-relational-operator': [
+        'LEToGT', 'GTToLE', 'GEToLT', 'LTToGE', 'EQToNEQ', 'NEQToEQ'
+    ],
+    'flip-signedness': ['SignedToUnsigned'],
+    'undo-transformation': ['ApplyTransformation'],
+    'delete-void-function-call': ['InsertVoidFunctionCall'],
+    'delete-conditional-control-flow': [
+        'InsertConditionalReturn', 'InsertConditionalBreak'
+    ]
+}  # type: Dict[str, List[str]]
+
+# the prior probability that a schema repairs a perturbation produced by a
+# given operator, depending on whether that schema inverts the operator
+PRIOR_INVERSE = 0.5
+PRIOR_OTHER = 0.05
+
+# the number of pseudo-observations used to smooth success rates
+PRIOR_WEIGHT = 2.0
+
+# the relative weight given to proximity (rather than suspiciousness) when
+# scoring the location of a candidate
+PROXIMITY_WEIGHT = 0.75
+
+__SCHEMA_HISTORY = None  # type: Optional[SchemaHistory]
+
+
+class SchemaHistory(object):
+    """
+    Learns how often candidates produced by each transformation schema
+    repair perturbations produced by each mutation operator. Statistics are
+    persisted to a JSON file after each batch of updates.
+    """
+    def __init__(self, fn_history: Optional[str] = None) -> None:
+        self.__fn_history = fn_history
+        self.__lock = threading.Lock()
+        # operator -> schema -> [repairs, attempts]
+        self.__stats = {}  # type: Dict[str, Dict[str, List[int]]]
+        if fn_history and os.path.exists(fn_history):
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.__fn_history, 'r') as f:
+                jsn = json.load(f)
+        except (OSError, ValueError):
+            logger.exception("failed to load schema history: %s",
+                             self.__fn_history)
+            return
+        if jsn.get('version') != SCHEMA_HISTORY_VERSION:
+            logger.warning("ignoring schema history with unsupported version: %s",  # noqa: pycodestyle
+                           self.__fn_history)
+            return
+        self.__stats = jsn['operators']
+
+    def _save(self) -> None:
+        jsn = {'version': SCHEMA_HISTORY_VERSION,
+               'operators': self.__stats}
+        fn_tmp = '{}.tmp.{}'.format(self.__fn_history, os.getpid())
+        try:
+            with open(fn_tmp, 'w') as f:
+                json.dump(jsn, f, separators=(',', ':'))
+            os.replace(fn_tmp, self.__fn_history)
+        except OSError:
+            logger.exception("failed to save schema history: %s",
+                             self.__fn_history)
+
+    def success_rate(self, operator: str, schema: str) -> float:
+        """
+        Estimates the probability that a candidate produced by a given schema
+        repairs a perturbation produced by a given operator.
+        """
+        inverts = schema in OPERATOR_INVERSES.get(operator, [])
+        prior = PRIOR_INVERSE if inverts else PRIOR_OTHER
+        repairs, attempts = \
+            self.__stats.get(operator, {}).get(schema, (0, 0))
+        return (repairs + prior * PRIOR_WEIGHT) / (attempts + PRIOR_WEIGHT)
+
+    def record(self, operator: str, schema: str, repaired: bool) -> None:
+        """
+        Records whether a candidate produced by a given schema repaired a
+        perturbation produced by a given operator.
+        """
+        self.record_all([(operator, schema, repaired)])
+
+    def record_all(self,
+                   observations: Iterable[Tuple[str, str, bool]]
+                   ) -> None:
+        """
+        Records a batch of (operator, schema, repaired) observations, and
+        saves the history once all of them have been recorded.
+        """
+        with self.__lock:
+            for (operator, schema, repaired) in observations:
+                stats = self.__stats.setdefault(operator, {})
+                stats = stats.setdefault(schema, [0, 0])
+                stats[0] += int(repaired)
+                stats[1] += 1
+            if self.__fn_history:
+                self._save()
+
+
+class CandidateRanker(object):
+    """
+    Scores candidate transformations for a given perturbation by combining
+    the learned success rate of their schema against the operator that was
+    used, their distance from the perturbed lines, and the suspiciousness of
+    the line at which they are applied.
+    """
+    def __init__(self,
+                 perturbation: Mutant,
+                 localization: Localization,
+                 history: SchemaHistory
+                 ) -> None:
+        self.__history = history
+        self.__suspiciousness = {
+            (line.filename, line.num): localization[line]
+            for line in localization
+        }  # type: Dict[Tuple[str, int], float]
+        mutations = list(perturbation.mutations)
+        self.__operators = [m.operator for m in mutations]
+        self.__perturbed = [m.location for m in mutations]
+
+    @property
+    def operators(self) -> List[str]:
+        """
+        The names of the mutation operators used by the perturbation.
+        """
+        return list(self.__operators)
+
+    @staticmethod
+    def schema_of(transformation: Transformation) -> str:
+        return transformation.__class__.__name__
+
+    @staticmethod
+    def line_of(transformation: Transformation) -> int:
+        """
+        Returns the line at which a given transformation begins.
+        """
+        location = transformation.location
+        if hasattr(location, 'start'):
+            return location.start.line
+        return location.line
+
+    def distance(self, transformation: Transformation) -> Optional[int]:
+        """
+        Computes the distance, in lines, between a given transformation and
+        the nearest perturbed location. Returns None if the transformation
+        does not belong to a perturbed file.
+        """
+        filename = transformation.location.filename
+        line = self.line_of(transformation)
+        distances = []  # type: List[int]
+        for perturbed in self.__perturbed:
+            if perturbed.filename != filename:
+                continue
+            if perturbed.start.line <= line <= perturbed.stop.line:
+                return 0
+            distances.append(min(abs(line - perturbed.start.line),
+                                 abs(line - perturbed.stop.line)))
+        return min(distances) if distances else None
+
+    def score(self, transformation: Transformation) -> float:
+        schema = self.schema_of(transformation)
+        rate = max((self.__history.success_rate(op, schema)
+                    for op in self.__operators),
+                   default=PRIOR_OTHER)
+
+        distance = self.distance(transformation)
+        proximity = 0.0 if distance is None else 1.0 / (1.0 + distance)
+
+        key = (transformation.location.filename, self.line_of(transformation))
+        suspiciousness = self.__suspiciousness.get(key, 0.0)
+
+        return rate * (PROXIMITY_WEIGHT * proximity +
+                       (1.0 - PROXIMITY_WEIGHT) * suspiciousness)
+
+    def rank(self,
+             transformations: Iterable[Transformation]
+             ) -> List[Transformation]:
+        """
+        Orders a given set of transformations by descending score. Ties are
+        broken by their original order.
+        """
+        scored = [(self.score(t), i, t)
+                  for (i, t) in enumerate(transformations)]
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        logger.debug("ranked %d transformations", len(scored))
+        return [t for (_, _, t) in scored]
+
+    def record(self,
+               outcomes: Iterable[Tuple[Transformation, bool]]
+               ) -> None:
+        """
+        Records whether the candidates composed of each of a given set of
+        transformations repaired the perturbation. The schema history is
+        saved once, after all outcomes have been recorded.
+        """
+        operators = set(self.__operators)
+        self.__history.record_all((operator, self.schema_of(t), repaired)
+                                  for (t, repaired) in outcomes
+                                  for operator in operators)
+
+
+def load_schema_history() -> SchemaHistory:
+    """
+    Returns the schema success history, which is persisted within the cache
+    directory.
+    """
+    global __SCHEMA_HISTORY
+    if __SCHEMA_HISTORY:
+        return __SCHEMA_HISTORY
+    __SCHEMA_HISTORY = SchemaHistory(cache_path('ranking', 'history.json'))
+    return __SCHEMA_HISTORY
@@ -0,0 +1,283 @@
+"""
+This module is responsible for deciding the order in which tests should be
+executed when checking the liveness of a perturbation. Tests that are cheap
+to run and that are likely to kill the mutant are scheduled first.
+"""
+from typing import Callable, Dict, List, Iterable, Tuple, Optional
+from timeit import default_timer as timer
+import atexit
+import json
+import logging
+import os
+import threading
+
+from bugzoo.core.test import TestCase, TestOutcome
+from bugzoo.core.coverage import TestSuiteCoverage
+from boggart.core.location import FileLine
+
+from .cache import cache_path
+from .coverage import load_baseline_coverage, \
+                      load_baseline_coverage_database
+from .coveragedb import CoverageDatabase
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['TestScheduler', 'load_test_scheduler']
+
+HISTORY_VERSION = 1
+
+# the number of pseudo-observations used to smooth kill probabilities
+PRIOR_WEIGHT = 1.0
+
+# the kill probability assumed for tests that have never been observed
+PRIOR_KILL_PROBABILITY = 0.5
+
+# the minimum duration, given in seconds, assumed for any test
+MIN_DURATION = 0.01
+
+# the minimum number of seconds between writes of the kill history to disk
+SAVE_INTERVAL = 30.0
+
+__TEST_SCHEDULER = None  # type: Optional[TestScheduler]
+
+
+def _line_key(line: FileLine) -> str:
+    return "{}:{}".format(line.filename, line.num)
+
+
+def _durations(tests: Iterable[str],
+               outcome: Callable[[str], TestOutcome]
+               ) -> Dict[str, float]:
+    """
+    Returns the recorded duration of each of the given tests, whose outcomes
+    are provided by a given function. Tests without a recorded duration are
+    omitted.
+    """
+    durations = {}  # type: Dict[str, float]
+    for test in tests:
+        try:
+            duration = outcome(test).response.duration
+        except (AttributeError, KeyError, TypeError):
+            duration = None
+        if duration is None:
+            logger.warning("no duration recorded for test: %s", test)
+            continue
+        durations[test] = duration
+    return durations
+
+
+class TestScheduler(object):
+    """
+    Orders the tests for a liveness check by their expected cost of killing
+    the mutant (i.e., kill probability divided by duration), and learns kill
+    probabilities from past liveness checks.
+
+    Kill statistics are kept per test, both for each perturbed line and
+    across all lines. They are persisted to a JSON file at most once every
+    `SAVE_INTERVAL` seconds, and whenever `flush` is called.
+    """
+    @staticmethod
+    def from_coverage(coverage: TestSuiteCoverage,
+                      fn_history: Optional[str] = None
+                      ) -> 'TestScheduler':
+        """
+        Constructs a scheduler whose test durations are taken from a given
+        coverage report.
+
+        Parameters:
+            coverage: a coverage report containing the outcome of each test.
+            fn_history: the path to the file that should be used to persist
+                kill statistics. If None, statistics are not persisted.
+        """
+        durations = _durations(coverage, lambda t: coverage[t].outcome)
+        return TestScheduler(durations, fn_history)
+
+    @staticmethod
+    def from_database(db: CoverageDatabase,
+                      fn_history: Optional[str] = None
+                      ) -> 'TestScheduler':
+        """
+        Constructs a scheduler whose test durations are taken from the
+        outcomes stored in a given coverage database. The line coverage of
+        each test is not decoded.
+
+        Parameters:
+            db: a coverage database containing the outcome of each test.
+            fn_history: the path to the file that should be used to persist
+                kill statistics. If None, statistics are not persisted.
+        """
+        return TestScheduler(_durations(db, db.outcome), fn_history)
+
+    def __init__(self,
+                 durations: Dict[str, float],
+                 fn_history: Optional[str] = None
+                 ) -> None:
+        self.__durations = dict(durations)
+        if durations:
+            ordered = sorted(durations.values())
+            self.__default_duration = ordered[len(ordered) // 2]
+        else:
+            self.__default_duration = 1.0
+        self.__fn_history = fn_history
+        self.__lock = threading.Lock()
+        self.__lock_save = threading.Lock()
+        self.__time_saved = float('-inf')
+        self.__dirty = False
+        # test -> [kills, trials]
+        self.__test_stats = {}  # type: Dict[str, List[int]]
+        # line -> test -> [kills, trials]
+        self.__line_stats = {}  # type: Dict[str, Dict[str, List[int]]]
+        self.__last_ordering = []  # type: List[Tuple[str, float, float]]
+        if fn_history and os.path.exists(fn_history):
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.__fn_history, 'r') as f:
+                jsn = json.load(f)
+        except (OSError, ValueError):
+            logger.exception("failed to load test kill history: %s",
+                             self.__fn_history)
+            return
+        if jsn.get('version') != HISTORY_VERSION:
+            logger.warning("ignoring test kill history with unsupported version: %s",  # noqa: pycodestyle
+                           self.__fn_history)
+            return
+        self.__test_stats = jsn['tests']
+        self.__line_stats = jsn['lines']
+        logger.debug("loaded test kill history: %s", self.__fn_history)
+
+    def _save(self, contents: str) -> None:
+        fn_tmp = '{}.tmp.{}'.format(self.__fn_history, os.getpid())
+        try:
+            with open(fn_tmp, 'w') as f:
+                f.write(contents)
+            os.replace(fn_tmp, self.__fn_history)
+        except OSError:
+            logger.exception("failed to save test kill history: %s",
+                             self.__fn_history)
+
+    def flush(self) -> None:
+        """
+        Writes any kill statistics that have not yet been persisted to disk.
+        """
+        if not self.__fn_history:
+            return
+        with self.__lock_save:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                jsn = {'version': HISTORY_VERSION,
+                       'tests': self.__test_stats,
+                       'lines': self.__line_stats}
+                contents = json.dumps(jsn, separators=(',', ':'))
+                self.__dirty = False
+                self.__time_saved = timer()
+            self._save(contents)
+
+    @property
+    def last_ordering(self) -> List[Tuple[str, float, float]]:
+        """
+        The most recent ordering chosen by this scheduler, given as a list of
+        `(test, kill_probability, duration)` tuples.
+        """
+        return list(self.__last_ordering)
+
+    def duration(self, test: str) -> float:
+        """
+        Returns the expected duration of a given test, in seconds.
+        """
+        duration = self.__durations.get(test, self.__default_duration)
+        return max(duration, MIN_DURATION)
+
+    def kill_probability(self, test: str, lines: Iterable[FileLine]) -> float:
+        """
+        Estimates the probability that a given test will kill a mutant that
+        changes a given set of lines.
+        """
+        kills, trials = 0, 0
+        for line in lines:
+            k, n = self.__line_stats.get(_line_key(line), {}).get(test, (0, 0))
+            kills += k
+            trials += n
+
+        # fall back to the kill rate of the test across all lines
+        k, n = self.__test_stats.get(test, (0, 0))
+        prior = (k + PRIOR_KILL_PROBABILITY * PRIOR_WEIGHT) / (n + PRIOR_WEIGHT)
+        return (kills + prior * PRIOR_WEIGHT) / (trials + PRIOR_WEIGHT)
+
+    def order(self,
+              tests: List[TestCase],
+              lines: List[FileLine]
+              ) -> List[TestCase]:
+        """
+        Orders a given list of tests for a liveness check of a mutant that
+        changes a given set of lines.
+        """
+        with self.__lock:
+            scored = []
+            for test in tests:
+                probability = self.kill_probability(test.name, lines)
+                duration = self.duration(test.name)
+                scored.append((probability / duration, probability, duration, test))  # noqa: pycodestyle
+            scored.sort(key=lambda s: s[0], reverse=True)
+            self.__last_ordering = [(t.name, p, d) for (_, p, d, t) in scored]
+        logger.debug("scheduled tests: %s",
+                     ', '.join('{} (p={:.2f}, {:.2f}s)'.format(*o)
+                               for o in self.__last_ordering))
+        return [t for (_, _, _, t) in scored]
+
+    def record(self,
+               lines: List[FileLine],
+               outcomes: Dict[str, bool]
+               ) -> None:
+        """
+        Records the outcome of a liveness check. The updated statistics are
+        written to disk if they have not been written for `SAVE_INTERVAL`
+        seconds.
+
+        Parameters:
+            lines: the set of lines changed by the mutant.
+            outcomes: a mapping from the names of the tests that were executed
+                to a flag indicating whether that test killed the mutant.
+        """
+        if not outcomes:
+            return
+        with self.__lock:
+            for (test, killed) in outcomes.items():
+                stats = self.__test_stats.setdefault(test, [0, 0])
+                stats[0] += int(killed)
+                stats[1] += 1
+                for line in set(_line_key(l) for l in lines):
+                    line_stats = self.__line_stats.setdefault(line, {})
+                    stats = line_stats.setdefault(test, [0, 0])
+                    stats[0] += int(killed)
+                    stats[1] += 1
+            self.__dirty = True
+            is_due = timer() - self.__time_saved >= SAVE_INTERVAL
+        if is_due:
+            self.flush()
+
+
+def load_test_scheduler() -> TestScheduler:
+    """
+    Returns the test scheduler for Baseline A, whose kill statistics are
+    persisted within the cache directory. Any statistics that have not yet
+    been persisted are written to disk when the process exits.
+    """
+    global __TEST_SCHEDULER
+    if __TEST_SCHEDULER:
+        return __TEST_SCHEDULER
+    fn_history = cache_path('liveness', 'history.json')
+    try:
+        db = load_baseline_coverage_database()
+    except Exception:
+        logger.warning("failed to load coverage database for baseline A: reading test durations from coverage report.",  # noqa: pycodestyle
+                       exc_info=True)
+        __TEST_SCHEDULER = \
+            TestScheduler.from_coverage(load_baseline_coverage(), fn_history)
+    else:
+        __TEST_SCHEDULER = TestScheduler.from_database(db, fn_history)
+    atexit.register(__TEST_SCHEDULER.flush)
+    return __TEST_SCHEDULER
@@ -0,0 +1,220 @@
+"""
+This module allows many independent perturbation and repair scenarios to be
+hosted within a single process. Each scenario is modelled by its own
+orchestrator (i.e., session), but all sessions share their connections to
+BugZoo, boggart and rooibos, the read-only data for the baseline, and the
+on-disk caches. The total number of containers used by the workers of all
+sessions is capped by a shared budget.
+"""
+from typing import Dict, Iterator, Optional, Any, Callable
+import logging
+import threading
+import uuid
+
+import rooibos
+import boggart
+import bugzoo
+import bugzoo.client
+
+from .analysis import AnalysisCache
+from .concurrency import Stage, ContainerBudget, default_controller
+from .coverage import MutantCoverageCache, load_baseline_coverage, \
+                      load_baseline_lines
+from .donor import load_pool
+from .killmatrix import load_kill_matrix
+from .orchestrator import Orchestrator, OrchestratorState, OPERATOR_NAMES
+from .perturbationindex import PerturbationIndex
+from .scheduler import load_test_scheduler
+from .snapshot import fetch_baseline_snapshot, fetch_instrumentation_snapshot
+
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+__all__ = ['SessionManager']
+
+
+class SessionManager(object):
+    """
+    Hosts a collection of orchestrator sessions that share clients, caches
+    and a container budget.
+    """
+    def __init__(self,
+                 url_boggart: str,
+                 url_bugzoo: str,
+                 url_rooibos: str,
+                 *,
+                 max_containers: Optional[int] = None,
+                 client_bugzoo: Optional[bugzoo.client.Client] = None,
+                 client_boggart: Optional[boggart.Client] = None,
+                 client_rooibos: Optional[rooibos.Client] = None,
+                 **options: Any
+                 ) -> None:
+        """
+        Constructs a new session manager, and loads the data that is shared
+        by its sessions.
+
+        Parameters:
+            url_boggart: the base URL of the boggart server.
+            url_bugzoo: the base URL of the BugZoo server.
+            url_rooibos: the base URL of the rooibos server.
+            max_containers: the maximum number of containers that may be used
+                at once by the workers of all sessions. Defaults to the
+                number of evaluation workers supported by the host.
+            client_bugzoo: an optional client that should be used in place of
+                a connection to `url_bugzoo`.
+            client_boggart: an optional client that should be used in place
+                of a connection to `url_boggart`.
+            client_rooibos: an optional client that should be used in place
+                of a connection to `url_rooibos`.
+            options: default keyword arguments (e.g., `threads` or `seed`)
+                for the orchestrator of each session.
+        """
+        if max_containers is None:
+            max_containers = default_controller().ceiling(Stage.EVALUATION)
+        if client_rooibos is None:
+            client_rooibos = rooibos.Client(url_rooibos, timeout_connection=120)
+        if client_boggart is None:
+            client_boggart = boggart.Client(url_boggart, timeout_connection=120)
+        if client_bugzoo is None:
+            client_bugzoo = bugzoo.Client(url_bugzoo, timeout_connection=120)
+        self.__urls = (url_boggart, url_bugzoo, url_rooibos)
+        self.__client_bugzoo = client_bugzoo
+        self.__client_boggart = client_boggart
+        self.__client_rooibos = client_rooibos
+        self.__options = options
+        self.__budget = ContainerBudget(max_containers)
+        self.__sessions = {}  # type: Dict[str, Orchestrator]
+        self.__lock = threading.Lock()
+        logger.info("hosting sessions with at most %d containers",
+                    max_containers)
+
+        # warm the process-wide caches before any session is created
+        logger.debug("loading shared data for Baseline A")
+        baseline = fetch_baseline_snapshot(client_bugzoo)
+        fetch_instrumentation_snapshot(client_bugzoo)
+        load_baseline_coverage()
+        load_test_scheduler()
+        load_pool()
+        load_kill_matrix(baseline)
+        self.__coverage_cache = MutantCoverageCache()
+        self.__analysis_cache = AnalysisCache()
+        self.__perturbation_index = PerturbationIndex(client_boggart,
+                                                      baseline,
+                                                      load_baseline_lines(),
+                                                      OPERATOR_NAMES)
+        logger.debug("loaded shared data for Baseline A")
+
+    @property
+    def budget(self) -> ContainerBudget:
+        """
+        The budget that caps the number of containers used by all sessions.
+        """
+        return self.__budget
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Returns an iterator over the identifiers of the active sessions.
+        """
+        with self.__lock:
+            uids = list(self.__sessions)
+        yield from uids
+
+    def __len__(self) -> int:
+        return len(self.__sessions)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self.__sessions
+
+    def __getitem__(self, uid: str) -> Orchestrator:
+        """
+        Retrieves the orchestrator for a given session.
+
+        Raises:
+            KeyError: if no session exists with the given identifier.
+        """
+        return self.__sessions[uid]
+
+    def create(self,
+               callback_progress: Callable[..., None],
+               callback_done: Callable[..., None],
+               callback_error: Callable[[str, str], None],
+               **options: Any
+               ) -> str:
+        """
+        Creates a new session.
+
+        Parameters:
+            callback_progress: passed to the orchestrator for the session.
+            callback_done: passed to the orchestrator for the session.
+            callback_error: passed to the orchestrator for the session.
+            options: keyword arguments for the orchestrator of the session,
+                which take precedence over the defaults for this manager.
+
+        Returns:
+            the identifier of the new session.
+        """
+        kwargs = dict(self.__options)
+        kwargs.update(options)
+        url_boggart, url_bugzoo, url_rooibos = self.__urls
+        orchestrator = Orchestrator(url_boggart,
+                                    url_bugzoo,
+                                    url_rooibos,
+                                    callback_progress,
+                                    callback_done,
+                                    callback_error,
+                                    client_bugzoo=self.__client_bugzoo,
+                                    client_boggart=self.__client_boggart,
+                                    client_rooibos=self.__client_rooibos,
+                                    container_budget=self.__budget,
+                                    coverage_cache=self.__coverage_cache,
+                                    analysis_cache=self.__analysis_cache,
+                                    perturbation_index=self.__perturbation_index,  # noqa: pycodestyle
+                                    **kwargs)
+        uid = uuid.uuid4().hex
+        with self.__lock:
+            self.__sessions[uid] = orchestrator
+        self.__budget.join()
+        logger.info("created session: %s", uid)
+        return uid
+
+    def states(self) -> Dict[str, OrchestratorState]:
+        """
+        Returns the current state of each session.
+        """
+        with self.__lock:
+            return {uid: orc.state for (uid, orc) in self.__sessions.items()}
+
+    def close(self, uid: str) -> None:
+        """
+        Removes a given session. If the session is injecting a perturbation,
+        that perturbation is cancelled; if it is searching for a repair, the
+        search is stopped. The mutant for the session's perturbation, if
+        any, is destroyed. The clients that are shared by all sessions
+        remain open.
+
+        Raises:
+            KeyError: if no session exists with the given identifier.
+        """
+        with self.__lock:
+            orchestrator = self.__sessions.pop(uid)
+        if orchestrator.state == OrchestratorState.SEARCHING:
+            logger.info("stopping search for session: %s", uid)
+        orchestrator.close()
+        self.__budget.leave()
+        logger.info("closed session: %s", uid)
+
+    def shutdown(self) -> None:
+        """
+        Closes all sessions and ensures that the shared clients are safely
+        deallocated.
+        """
+        for uid in list(self):
+            self.close(uid)
+        for (name, client) in [('boggart', self.__client_boggart),
+                               ('BugZoo', self.__client_bugzoo)]:
+            logger.info("shutting down %s", name)
+            try:
+                client.shutdown()
+                logger.info("finished shutting down %s", name)
+            except Exception:
+                logger.exception("failed to shutdown %s", name)
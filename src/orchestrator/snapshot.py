@@ -1,13 +1,42 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import copy
+import hashlib
+import json
+import logging
 import os
+import threading
+import weakref
 
+import docker
 import yaml
 from bugzoo.core.bug import Bug as Snapshot
 from bugzoo.client import Client as BugZooClient
 
+from .cache import CACHE_DIR, DiskCache
 
-def _load_manifest() -> Dict[str, Any]:
-    fn = os.path.join(os.path.dirname(__file__), 'baseline.yml')
+logger = logging.getLogger(__name__)  # type: logging.Logger
+logger.setLevel(logging.DEBUG)
+
+# the maximum size of the cache of compiled manifests, given in bytes
+MANIFEST_CACHE_SIZE = 16 * 1024 * 1024
+
+# bumped whenever the compilation of the manifest is changed
+MANIFEST_COMPILED_VERSION = 1
+
+__LOCK = threading.Lock()
+__MANIFEST = None  # type: Optional[Dict[str, Any]]
+
+# the snapshots that have been registered with each BugZoo client, indexed
+# by name
+__REGISTERED = \
+    weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[BugZooClient, Dict[str, Snapshot]]  # noqa: pycodestyle
+
+
+def _compile_manifest(fn: str) -> Dict[str, Any]:
+    """
+    Parses the YAML description of the baseline snapshot at a given path and
+    augments it with oracle information.
+    """
     with open(fn, 'r') as f:
         desc = yaml.load(f)
 
@@ -27,17 +56,92 @@ def _load_manifest() -> Dict[str, Any]:
     return desc
 
 
+def _load_compiled_manifest(fn: str) -> Dict[str, Any]:
+    """
+    Loads the compiled form of the manifest at a given path from the cache
+    directory, compiling it if there is no compiled form for the current
+    contents of that manifest.
+    """
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        h.update(f.read())
+    key = DiskCache.key(MANIFEST_COMPILED_VERSION, h.hexdigest())
+    cache = DiskCache(os.path.join(CACHE_DIR, 'manifest'), MANIFEST_CACHE_SIZE)
+    desc = cache.get(key)
+    if desc is not None:
+        logger.debug("loaded compiled manifest: %s", fn)
+        return desc
+
+    logger.debug("compiling manifest: %s", fn)
+    desc = _compile_manifest(fn)
+    cache.put(key, desc)
+    return desc
+
+
+def _load_manifest() -> Dict[str, Any]:
+    """
+    Returns a copy of the description of the baseline snapshot. The manifest
+    is only loaded once per process.
+    """
+    global __MANIFEST
+    with __LOCK:
+        if __MANIFEST is None:
+            fn = os.path.join(os.path.dirname(__file__), 'baseline.yml')
+            __MANIFEST = _load_compiled_manifest(fn)
+        return copy.deepcopy(__MANIFEST)
+
+
+def _fetch_snapshot(bz: BugZooClient, desc: Dict[str, Any]) -> Snapshot:
+    """
+    Returns the snapshot with a given description, registering it with a
+    given BugZoo client if it has not already been registered with that
+    client by this process.
+    """
+    name = desc['name']
+    with __LOCK:
+        registered = __REGISTERED.setdefault(bz, {})
+        if name in registered:
+            return registered[name]
+        snapshot = Snapshot.from_dict(desc)
+        bz.bugs.register(snapshot)
+        registered[name] = snapshot
+        return snapshot
+
+
 def fetch_baseline_snapshot(bz: BugZooClient) -> Snapshot:
     desc = _load_manifest()
-    snapshot = Snapshot.from_dict(desc)
-    bz.bugs.register(snapshot)
-    return snapshot
+    return _fetch_snapshot(bz, desc)
 
 
 def fetch_instrumentation_snapshot(bz: BugZooClient) -> Snapshot:
     desc = _load_manifest()
     desc['name'] = 'mars:instrument'
     desc['image'] = 'cmumars/cp2:instrument'
-    snapshot = Snapshot.from_dict(desc)
-    bz.bugs.register(snapshot)
-    return snapshot
+    return _fetch_snapshot(bz, desc)
+
+
+def snapshot_identity(snapshot: Snapshot) -> str:
+    """
+    Computes a digest that uniquely identifies the description of a given
+    snapshot (e.g., its image, tests and build instructions).
+    """
+    jsn = json.dumps(snapshot.to_dict(), sort_keys=True)
+    return hashlib.sha256(jsn.encode('utf-8')).hexdigest()
+
+
+def fetch_image_digest(snapshot: Snapshot) -> Optional[str]:
+    """
+    Attempts to determine the digest of the Docker image for a given
+    snapshot, using the local Docker daemon.
+
+    Returns:
+        the ID of the image, or None if it could not be determined (e.g., if
+        the image is only available to a remote BugZoo server).
+    """
+    try:
+        client_docker = docker.client.from_env()
+        return client_docker.images.get(snapshot.image).id
+    except Exception:
+        logger.warning("failed to determine digest for image: %s",
+                       snapshot.image)
+        return None
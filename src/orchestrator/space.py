@@ -1,7 +1,9 @@
 """
 This module is responsible for composing the search space.
 """
-from typing import Iterator, Type
+from typing import Iterator, Type, List, Dict, Tuple, Optional
+import concurrent.futures
+import heapq
 import logging
 
 import darjeeling.transformation
@@ -12,46 +14,171 @@ from darjeeling.core import FileLine
 from darjeeling.candidate import Candidate
 from darjeeling.problem import Problem
 from darjeeling.localization import Localization
+from darjeeling.snippet import SnippetDatabase
 
 from .donor import load_pool
+from .ranking import CandidateRanker
+from .concurrency import Stage, default_controller
 
 logger = logging.getLogger(__name__)  # type: logging.Logger
 logger.setLevel(logging.DEBUG)
 
+SCHEMAS = [
+    darjeeling.transformation.AndToOr,
+    darjeeling.transformation.OrToAnd,
+    darjeeling.transformation.LEToGT,
+    darjeeling.transformation.GTToLE,
+    darjeeling.transformation.GEToLT,
+    darjeeling.transformation.LTToGE,
+    darjeeling.transformation.EQToNEQ,
+    darjeeling.transformation.NEQToEQ,
+    darjeeling.transformation.PlusToMinus,
+    darjeeling.transformation.MinusToPlus,
+    darjeeling.transformation.MulToDiv,
+    darjeeling.transformation.DivToMul,
+    darjeeling.transformation.SignedToUnsigned,
+    darjeeling.transformation.ApplyTransformation,
+    darjeeling.transformation.InsertVoidFunctionCall,
+    darjeeling.transformation.InsertConditionalReturn,
+    darjeeling.transformation.InsertConditionalBreak
+]  # type: List[Type[Transformation]]
+
+
+def _transformations_in_file(problem: Problem,
+                             snippets: SnippetDatabase,
+                             lines: List[FileLine],
+                             schemas: List[Type[Transformation]]
+                             ) -> Dict[FileLine, List[Transformation]]:
+    """
+    Computes all transformations at a given set of lines, all of which
+    belong to the same file.
+    """
+    line_to_transformations = {
+        line: [] for line in lines
+    }  # type: Dict[FileLine, List[Transformation]]
+    for schema in schemas:
+        at_lines = schema.all_at_lines(problem, snippets, lines)
+        for (line, transformations) in at_lines.items():
+            line_to_transformations[line] += list(transformations)
+    return line_to_transformations
+
+
+def stream_transformations(problem: Problem,
+                           snippets: SnippetDatabase,
+                           localization: Localization,
+                           schemas: List[Type[Transformation]],
+                           *,
+                           threads: int = 1,
+                           ranker: Optional[CandidateRanker] = None
+                           ) -> Iterator[Transformation]:
+    """
+    Returns an iterator over the transformations at the lines contained within
+    a fault localization, in descending order of suspiciousness. A pool of
+    background workers computes the transformations for each file, starting
+    with the most suspicious files; transformations at a line are produced
+    as soon as no line with a higher suspiciousness remains to be computed.
+    If a ranker is given, it is used to order the transformations at each
+    line.
+    """
+    file_to_lines = {}  # type: Dict[str, List[FileLine]]
+    for line in localization:
+        file_to_lines.setdefault(line.filename, []).append(line)
+    pending = {
+        fn: max(localization[line] for line in lines)
+        for (fn, lines) in file_to_lines.items()
+    }  # type: Dict[str, float]
+    files = sorted(pending, key=lambda fn: pending[fn], reverse=True)
+
+    # each entry is a tuple of the form (-score, tie-breaker, line, transformations)  # noqa: pycodestyle
+    ready = []  # type: List[Tuple[float, int, FileLine, List[Transformation]]]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    future_to_file = {
+        executor.submit(_transformations_in_file,
+                        problem, snippets, file_to_lines[fn], schemas): fn
+        for fn in files
+    }
+    try:
+        completed = concurrent.futures.as_completed(future_to_file)
+        while True:
+            # yield the ready lines that are at least as suspicious as any line
+            # whose transformations have yet to be computed
+            threshold = max(pending.values()) if pending else None
+            while ready and (threshold is None or -ready[0][0] >= threshold):
+                _, _, line, transformations = heapq.heappop(ready)
+                if ranker:
+                    transformations = ranker.rank(transformations)
+                logger.debug("generating %d transformations at line: %s",
+                             len(transformations), line)
+                yield from transformations
+            if not pending:
+                return
+
+            future = next(completed)
+            fn = future_to_file[future]
+            for (line, transformations) in future.result().items():
+                entry = (-localization[line], len(ready), line, transformations)
+                heapq.heappush(ready, entry)
+            del pending[fn]
+            logger.debug("computed transformations in file: %s", fn)
+    finally:
+        for future in future_to_file:
+            future.cancel()
+        executor.shutdown(wait=False)
+
 
 def build_search_space(problem: Problem,
-                       localization: Localization
+                       localization: Localization,
+                       *,
+                       lazy: bool = False,
+                       threads: Optional[int] = None,
+                       ranker: Optional[CandidateRanker] = None
                        ) -> Iterator[Candidate]:
     """
     Used to compose the sequence of patches that should be attempted.
+
+    Parameters:
+        problem: the repair problem.
+        localization: the fault localization for the problem.
+        lazy: if True, candidates are generated incrementally in descending
+            order of suspiciousness, allowing the search to begin before the
+            entire space has been computed. Otherwise, all transformations
+            are computed before sampling them according to suspiciousness.
+        threads: the number of threads used to compute transformations.
+            Defaults to the current concurrency limit for this stage.
+        ranker: an optional ranker that is used to prioritise candidates. In
+            lazy mode, candidates at each line are ordered by the ranker;
+            otherwise, the entire space is computed and then ordered.
     """
-    schemas = [
-        darjeeling.transformation.AndToOr,
-        darjeeling.transformation.OrToAnd,
-        darjeeling.transformation.LEToGT,
-        darjeeling.transformation.GTToLE,
-        darjeeling.transformation.GEToLT,
-        darjeeling.transformation.LTToGE,
-        darjeeling.transformation.EQToNEQ,
-        darjeeling.transformation.NEQToEQ,
-        darjeeling.transformation.PlusToMinus,
-        darjeeling.transformation.MinusToPlus,
-        darjeeling.transformation.MulToDiv,
-        darjeeling.transformation.DivToMul,
-        darjeeling.transformation.SignedToUnsigned,
-        darjeeling.transformation.ApplyTransformation,
-        darjeeling.transformation.InsertVoidFunctionCall,
-        darjeeling.transformation.InsertConditionalReturn,
-        darjeeling.transformation.InsertConditionalBreak
-    ]  # type: Type[Transformation]
+    if threads is None:
+        threads = default_controller().limit(Stage.SEARCH_SPACE)
     logger.info("constructing search space")
-    snippets = load_pool()
-    transformations = sample_by_localization_and_type(problem,
-                                                      snippets,
-                                                      localization,
-                                                      schemas,
-                                                      threads=8,
-                                                      eager=True)
+    pool = load_pool()
+    snippets = pool.restricted_to_files(localization.files)
+    logger.debug("using %d of %d donor snippets from localized files",
+                 len(snippets), len(pool))
+    if lazy:
+        transformations = stream_transformations(problem,
+                                                 snippets,
+                                                 localization,
+                                                 SCHEMAS,
+                                                 threads=threads,
+                                                 ranker=ranker)
+    elif ranker:
+        transformations = stream_transformations(problem,
+                                                 snippets,
+                                                 localization,
+                                                 SCHEMAS,
+                                                 threads=threads)
+        transformations = iter(ranker.rank(transformations))
+        logger.info("ranked transformations for operators: %s",
+                    ', '.join(ranker.operators))
+    else:
+        transformations = sample_by_localization_and_type(problem,
+                                                          snippets,
+                                                          localization,
+                                                          SCHEMAS,
+                                                          threads=threads,
+                                                          eager=True)
     candidates = all_single_edit_patches(transformations)
     logger.info("constructed search space")
     return candidates
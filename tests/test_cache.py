@@ -0,0 +1,30 @@
+import os
+import time
+
+from orchestrator.cache import DiskCache
+
+
+def test_put_evicts_least_recently_used_entries(tmp_path):
+    value = 'x' * 100
+    cache = DiskCache(str(tmp_path), 350)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, value)
+        # ensure that each entry has a distinct modification time
+        os.utime(cache._path(key), (time.time() - 10, time.time() - 10))
+        time.sleep(0.01)
+    cache.get('a')
+    cache.put('d', value)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert 'd' in cache
+    assert cache.size <= cache.max_size
+
+
+def test_put_replacing_entry_does_not_inflate_size(tmp_path):
+    cache = DiskCache(str(tmp_path), 250)
+    cache.put('a', 'x' * 100)
+    for _ in range(10):
+        cache.put('b', 'y' * 100)
+    assert 'a' in cache
+    assert 'b' in cache
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from orchestrator.concurrency import (ConcurrencyController, ContainerBudget,
+                                      Stage, INCREASE_AFTER_SUCCESSES)
+
+
+def build_controller():
+    # 16 cores and 64 GB give an evaluation ceiling of 16 workers
+    return ConcurrencyController(cores=16, memory=64.0)
+
+
+def test_limit_is_halved_after_failure():
+    controller = build_controller()
+    assert controller.limit(Stage.EVALUATION) == 16
+    controller.report_failure(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 8
+    controller.report_failure(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 4
+    for _ in range(4):
+        controller.report_failure(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 1
+    # other stages are unaffected
+    assert controller.limit(Stage.COVERAGE) == 8
+
+
+def test_limit_is_increased_after_successes():
+    controller = build_controller()
+    controller.report_failure(Stage.EVALUATION)
+    for _ in range(INCREASE_AFTER_SUCCESSES - 1):
+        controller.report_success(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 8
+    controller.report_success(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 9
+
+    # the limit never exceeds its ceiling
+    for _ in range(INCREASE_AFTER_SUCCESSES * 20):
+        controller.report_success(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 16
+
+
+def test_failure_resets_run_of_successes():
+    controller = build_controller()
+    controller.report_failure(Stage.EVALUATION)
+    for _ in range(INCREASE_AFTER_SUCCESSES - 1):
+        controller.report_success(Stage.EVALUATION)
+    controller.report_failure(Stage.EVALUATION)
+    controller.report_success(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 4
+
+
+def test_fixed_limits_are_never_adjusted():
+    controller = ConcurrencyController({Stage.EVALUATION: 3},
+                                       cores=16, memory=64.0)
+    controller.report_failure(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 3
+
+
+def test_track_reports_outcome_of_work():
+    controller = build_controller()
+    with pytest.raises(RuntimeError):
+        with controller.track(Stage.EVALUATION):
+            raise RuntimeError
+    assert controller.limit(Stage.EVALUATION) == 8
+
+    # a timeout reported during the work is not also counted as a success
+    for _ in range(INCREASE_AFTER_SUCCESSES):
+        with controller.track(Stage.EVALUATION) as threads:
+            assert threads == controller.limit(Stage.EVALUATION)
+            controller.report_failure(Stage.EVALUATION)
+    assert controller.limit(Stage.EVALUATION) == 1
+
+    for _ in range(INCREASE_AFTER_SUCCESSES):
+        with controller.track(Stage.EVALUATION):
+            pass
+    assert controller.limit(Stage.EVALUATION) == 2
+
+
+def test_budget_is_shared_between_sessions():
+    budget = ContainerBudget(8)
+    sessions = [ConcurrencyController(cores=16, memory=64.0, budget=budget)
+                for _ in range(2)]
+    for _ in sessions:
+        budget.join()
+
+    granted = []
+    with sessions[0].track(Stage.EVALUATION) as threads:
+        granted.append(threads)
+
+        # the second session must not be starved by the first
+        def search() -> None:
+            with sessions[1].track(Stage.EVALUATION) as threads:
+                granted.append(threads)
+
+        thread = threading.Thread(target=search)
+        thread.start()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+    assert granted == [4, 4]
+    assert budget.available == 8
+
+    # once a session leaves, the remaining session may use the whole budget
+    budget.leave()
+    with sessions[0].track(Stage.EVALUATION) as threads:
+        assert threads == 8
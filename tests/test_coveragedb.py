@@ -0,0 +1,22 @@
+from orchestrator.coveragedb import CoverageDatabase, write_database
+
+OUTCOME = {'passed': True,
+           'response': {'code': 0, 'duration': 1.5, 'output': ''}}
+
+COVERAGE = {
+    't1': {'outcome': OUTCOME, 'coverage': {'a.cpp': [3, 1], 'b.cpp': [7]}},
+    't2': {'outcome': OUTCOME, 'coverage': {'a.cpp': [2, 3]}}
+}
+
+
+def test_lines_are_read_from_file_index(tmp_path):
+    fn = str(tmp_path / 'coverage.db')
+    write_database(COVERAGE, fn)
+    db = CoverageDatabase(fn)
+    try:
+        assert db.lines_in_file('a.cpp') == [1, 2, 3]
+        assert db.lines_in_file('c.cpp') == []
+        assert set(db.lines()) == set(db.to_coverage().lines)
+        assert db.lines(['b.cpp']).files == ['b.cpp']
+    finally:
+        db.close()
@@ -0,0 +1,37 @@
+from bugzoo.core.fileline import FileLine
+
+from orchestrator.coveragedb import CoverageDatabase, write_database
+from orchestrator.coverageindex import CoverageIndex
+
+OUTCOME = {'passed': True,
+           'response': {'code': 0, 'duration': 1.5, 'output': ''}}
+
+COVERAGE = {
+    't1': {'outcome': OUTCOME, 'coverage': {'a.cpp': [3, 1], 'b.cpp': [7]}},
+    't2': {'outcome': OUTCOME, 'coverage': {'a.cpp': [2, 3]}},
+    't3': {'outcome': OUTCOME, 'coverage': {'c.cpp': [4]}}
+}
+
+
+def test_index_from_database_matches_index_from_coverage(tmp_path):
+    fn = str(tmp_path / 'coverage.db')
+    write_database(COVERAGE, fn)
+    db = CoverageDatabase(fn)
+    try:
+        files = ['a.cpp', 'b.cpp']
+        expected = CoverageIndex.from_coverage(db.to_coverage(files))
+        index = CoverageIndex.from_database(db, files)
+        assert sorted(index.files) == sorted(expected.files)
+        assert set(index) == set(expected)
+        for filename in ('a.cpp', 'b.cpp', 'c.cpp'):
+            assert index.tests_covering_file(filename) == \
+                expected.tests_covering_file(filename)
+        for num in range(1, 8):
+            line = FileLine('a.cpp', num)
+            assert index.tests_covering_line(line) == \
+                expected.tests_covering_line(line)
+        assert index.tests_covering_lines([FileLine('a.cpp', 3),
+                                           FileLine('b.cpp', 7)]) == \
+            {'t1', 't2'}
+    finally:
+        db.close()
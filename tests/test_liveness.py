@@ -0,0 +1,164 @@
+from uuid import uuid4
+
+import pytest
+from boggart import Mutation
+from boggart.core import Mutant
+from boggart.core.location import FileLocationRange
+
+import orchestrator.liveness as liveness
+from orchestrator.killmatrix import KillMatrix
+from orchestrator.liveness import mutant_fails_test, ScreeningOutcome
+from orchestrator.pool import ContainerPool
+
+TESTS = ['t1', 't2', 't3']
+
+
+def build_mutation() -> Mutation:
+    location = FileLocationRange.from_string('src/rospack/rospack.cpp@10:3::10:9')  # noqa: pycodestyle
+    return Mutation('delete-void-function-call', 0, location, {})
+
+
+def build_kill_matrix(mutation: Mutation, killing_tests) -> KillMatrix:
+    matrix = KillMatrix(TESTS, {}, identity='baseline', image_digest=None)
+    matrix.add(mutation, killing_tests)
+    return matrix
+
+
+def test_mutant_fails_test_uses_kill_matrix():
+    mutation = build_mutation()
+    mutant = Mutant(uuid4(), 'baseline', [mutation])
+    matrix = build_kill_matrix(mutation, ['t2'])
+    # no clients are required when the mutant is described by the matrix
+    assert mutant_fails_test(None, None, mutant, kill_matrix=matrix)
+
+
+def test_mutant_passes_test_uses_kill_matrix():
+    mutation = build_mutation()
+    mutant = Mutant(uuid4(), 'baseline', [mutation])
+    matrix = build_kill_matrix(mutation, [])
+    assert not mutant_fails_test(None, None, mutant, kill_matrix=matrix)
+
+
+class StubResponse(object):
+    def __init__(self, code: int = 0) -> None:
+        self.code = code
+        self.successful = code == 0
+        self.passed = code == 0
+
+
+class StubContainerManager(object):
+    def __init__(self,
+                 *,
+                 compiles=True,
+                 test_error=None,
+                 restore_fails=False
+                 ) -> None:
+        self.compiles = compiles
+        self.test_error = test_error
+        self.restore_fails = restore_fails
+        self.provisioned = []
+        self.destroyed = []
+        self.commands = []
+
+    def provision(self, snapshot):
+        container = StubContainer('c{}'.format(len(self.provisioned)))
+        self.provisioned.append(container.uid)
+        return container
+
+    def __delitem__(self, uid):
+        self.destroyed.append(uid)
+
+    def is_alive(self, container):
+        return container.uid not in self.destroyed
+
+    def exec(self, container, command, context=None):
+        self.commands.append(command)
+        if self.restore_fails and ' && rm ' in command:
+            return StubResponse(1)
+        return StubResponse()
+
+    def patch(self, container, diff):
+        return True
+
+    def compile(self, container):
+        return StubResponse(0 if self.compiles else 1)
+
+    def test(self, container, test):
+        if self.test_error:
+            raise self.test_error
+        return StubResponse(1)
+
+
+class StubContainer(object):
+    def __init__(self, uid: str) -> None:
+        self.uid = uid
+
+
+class StubBugZoo(object):
+    def __init__(self, containers: StubContainerManager) -> None:
+        self.containers = containers
+
+
+class StubDiff(object):
+    files = ['src/rospack/rospack.cpp']
+
+
+class StubBoggart(object):
+    def mutations_to_diff(self, snapshot, mutations):
+        return StubDiff()
+
+
+class StubSnapshot(object):
+    name = 'baseline'
+    source_dir = '/ros_ws'
+
+
+class StubTest(object):
+    name = 't1'
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(liveness, '_lines_changed', lambda *args: [])
+    monkeypatch.setattr(liveness, '_covering_tests',
+                        lambda *args: [StubTest()])
+    pools = []
+
+    def build(containers):
+        pool = ContainerPool(StubBugZoo(containers), StubSnapshot(), 1)
+        pools.append(pool)
+        return pool
+
+    yield build
+    for pool in pools:
+        pool.close()
+
+
+def screen(containers, pool):
+    return liveness._screen_mutation(StubBugZoo(containers), StubBoggart(),
+                                     pool, build_mutation(), None, False)
+
+
+def test_screen_restores_and_reuses_container(pool):
+    containers = StubContainerManager()
+    result = screen(containers, pool(containers))
+    assert result.killed
+    backup = 'src/rospack/rospack.cpp' + liveness.BACKUP_SUFFIX
+    assert containers.commands[-1].startswith('cp {} '.format(backup))
+    assert containers.destroyed == []
+
+
+def test_screen_destroys_container_that_fails_to_compile(pool):
+    containers = StubContainerManager(compiles=False)
+    result = screen(containers, pool(containers))
+    assert result.outcome == ScreeningOutcome.FAILED
+    assert result.error == "failed to compile perturbation"
+    assert containers.destroyed == containers.provisioned
+
+
+def test_screen_raises_original_error(pool):
+    containers = StubContainerManager(test_error=RuntimeError("boom"),
+                                      restore_fails=True)
+    with pytest.raises(RuntimeError, match="boom"):
+        screen(containers, pool(containers))
+    assert containers.destroyed == containers.provisioned
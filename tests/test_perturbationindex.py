@@ -0,0 +1,85 @@
+from bugzoo.core.fileline import FileLineSet
+from boggart import Mutation
+from boggart.core.location import FileLocationRange
+
+import orchestrator.perturbationindex as perturbationindex
+from orchestrator.perturbationindex import PerturbationIndex
+
+FILENAME = 'src/rospack/rospack.cpp'
+
+
+def build_mutation(line: int) -> Mutation:
+    location = FileLocationRange.from_string(
+        '{}@{}:3::{}:9'.format(FILENAME, line, line))
+    return Mutation('delete-void-function-call', 0, location, {})
+
+
+class StubSnapshot(object):
+    image = 'cmumars/cp2:base'
+
+    def to_dict(self):
+        return {'name': 'baseline', 'image': self.image}
+
+
+class StubOperator(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class StubOperators(object):
+    def __getitem__(self, name: str) -> StubOperator:
+        return StubOperator(name)
+
+
+class StubBoggart(object):
+    def __init__(self, mutations) -> None:
+        self.operators = StubOperators()
+        self.requests = 0
+        self.__mutations = mutations
+
+    def mutations(self, snapshot, filepath, *, operators, restrict_to_lines):
+        self.requests += 1
+        yield from self.__mutations
+
+
+def build_index(client, directory, digest, monkeypatch) -> PerturbationIndex:
+    monkeypatch.setattr(perturbationindex, 'fetch_image_digest',
+                        lambda snapshot: digest)
+    lines = FileLineSet.from_dict({FILENAME: [3, 5, 7]})
+    return PerturbationIndex(client, StubSnapshot(), lines,
+                             ['delete-void-function-call'],
+                             directory=str(directory))
+
+
+def test_mutations_are_stored_in_canonical_order(tmp_path, monkeypatch):
+    mutations = [build_mutation(7), build_mutation(3), build_mutation(5)]
+    client = StubBoggart(mutations)
+    index = build_index(client, tmp_path, None, monkeypatch)
+    index.mutations(FILENAME)
+    reloaded = build_index(client, tmp_path, None, monkeypatch)
+    lines = [m.location.start.line for m in reloaded.mutations(FILENAME)]
+    assert lines == [3, 5, 7]
+    assert client.requests == 1
+
+
+def test_unknown_image_digest_keeps_index(tmp_path, monkeypatch):
+    client = StubBoggart([build_mutation(3)])
+    build_index(client, tmp_path, 'sha256:a', monkeypatch).mutations(FILENAME)
+    for digest in (None, 'sha256:a', None):
+        index = build_index(client, tmp_path, digest, monkeypatch)
+        assert index.is_indexed(FILENAME)
+    assert client.requests == 1
+
+
+def test_changed_image_digest_discards_index(tmp_path, monkeypatch):
+    client = StubBoggart([build_mutation(3)])
+    build_index(client, tmp_path, 'sha256:a', monkeypatch).mutations(FILENAME)
+    index = build_index(client, tmp_path, 'sha256:b', monkeypatch)
+    assert not index.is_indexed(FILENAME)
+
+
+def test_in_file_returns_canonical_order_when_indexing(tmp_path, monkeypatch):
+    mutations = [build_mutation(7), build_mutation(3), build_mutation(5)]
+    index = build_index(StubBoggart(mutations), tmp_path, None, monkeypatch)
+    lines = [m.location.start.line for m in index.in_file(FILENAME)]
+    assert lines == [3, 5, 7]
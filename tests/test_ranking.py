@@ -0,0 +1,24 @@
+import json
+
+from orchestrator.ranking import SchemaHistory
+
+
+def test_history_is_saved_once_per_batch(tmp_path, monkeypatch):
+    fn_history = str(tmp_path / 'history.json')
+    history = SchemaHistory(fn_history)
+    saves = []
+    save = history._save
+    monkeypatch.setattr(history, '_save', lambda: saves.append(save()))
+
+    history.record_all([('flip-signedness', 'SignedToUnsigned', True),
+                        ('flip-signedness', 'SignedToUnsigned', False),
+                        ('flip-signedness', 'AndToOr', False)])
+    assert len(saves) == 1
+    with open(fn_history, 'r') as f:
+        operators = json.load(f)['operators']
+    assert operators['flip-signedness'] == {'SignedToUnsigned': [1, 2],
+                                            'AndToOr': [0, 1]}
+
+    reloaded = SchemaHistory(fn_history)
+    assert reloaded.success_rate('flip-signedness', 'SignedToUnsigned') == \
+        history.success_rate('flip-signedness', 'SignedToUnsigned')
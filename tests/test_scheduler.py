@@ -0,0 +1,56 @@
+import json
+import os
+
+from boggart.core.location import FileLine
+
+from orchestrator.coveragedb import CoverageDatabase, write_database
+from orchestrator.scheduler import TestScheduler as Scheduler
+
+LINES = [FileLine('a.cpp', 3)]
+
+
+def build_outcome(response):
+    return {'passed': True, 'response': response}
+
+
+COVERAGE = {
+    't1': {'outcome': build_outcome({'code': 0, 'duration': 2.0, 'output': ''}),  # noqa: pycodestyle
+           'coverage': {'a.cpp': [3]}},
+    't2': {'outcome': build_outcome({'code': 0, 'duration': None, 'output': ''}),  # noqa: pycodestyle
+           'coverage': {'a.cpp': [3]}},
+    't3': {'outcome': build_outcome(None),
+           'coverage': {'a.cpp': [3]}}
+}
+
+
+def test_tests_without_durations_are_skipped(tmp_path):
+    fn = str(tmp_path / 'coverage.db')
+    write_database(COVERAGE, fn)
+    db = CoverageDatabase(fn)
+    try:
+        for scheduler in (Scheduler.from_database(db),
+                          Scheduler.from_coverage(db.to_coverage())):
+            assert scheduler.duration('t1') == 2.0
+            assert scheduler.duration('t2') == 2.0
+            assert scheduler.duration('t3') == 2.0
+    finally:
+        db.close()
+
+
+def test_history_is_saved_at_intervals(tmp_path):
+    fn_history = str(tmp_path / 'history.json')
+    scheduler = Scheduler({'t1': 1.0}, fn_history)
+    scheduler.record(LINES, {'t1': True})
+    assert os.path.exists(fn_history)
+    os.remove(fn_history)
+
+    # later updates are held until the save interval elapses or a flush
+    scheduler.record(LINES, {'t1': False})
+    assert not os.path.exists(fn_history)
+    scheduler.flush()
+    with open(fn_history, 'r') as f:
+        assert json.load(f)['tests']['t1'] == [1, 2]
+
+    reloaded = Scheduler({'t1': 1.0}, fn_history)
+    assert reloaded.kill_probability('t1', LINES) == \
+        scheduler.kill_probability('t1', LINES)